@@ -0,0 +1,89 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Compare the upload throughput of bulk uploads and single uploads against a simulated server on the loopback interface.
+
+Run from the project root: python3 -m benchmarks.bulk_upload [--measurements 2000] [--thermostats 10] [--latency 0.005]
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from smart_heating_local.config import Config
+from smart_heating_local.models import Measurement, TemperatureMeasurement, epoch_now
+from smart_heating_local.server import Server
+from smart_heating_local.server_simulation import SimulatedServer
+from smart_heating_local.url_cache import ThermostatUrlCache
+
+
+def measure(bulk, measurements, latency, url_cache_path):
+    """
+    :return: Tuple of the elapsed seconds and the number of requests of one upload pass
+    :rtype: tuple
+    """
+    simulated = SimulatedServer(bulk=bulk, latency=latency)
+    simulated.start()
+    try:
+        Server._bulk_rejected_until = 0
+        server = Server()
+        server.SERVER_URL = simulated.url
+        server.thermostat_urls = ThermostatUrlCache(path=url_cache_path)
+        started = time.perf_counter()
+        for chunk_start in range(0, len(measurements), 200):
+            for measurement, error in server.upload_temperature_measurements(
+                    measurements[chunk_start:chunk_start + 200]):
+                assert error is None
+        return time.perf_counter() - started, simulated.requests
+    finally:
+        simulated.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the upload throughput of bulk uploads and single uploads.')
+    parser.add_argument('--measurements', type=int, default=2000, help='temperature measurements to upload')
+    parser.add_argument('--thermostats', type=int, default=10, help='thermostats the measurements belong to')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds each request is delayed')
+    arguments = parser.parse_args()
+
+    # Per measurement log messages would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+    temp_dir = tempfile.mkdtemp()
+    bulk_upload = Config.SERVER_BULK_UPLOAD
+    try:
+        now = epoch_now()
+        measurements = [TemperatureMeasurement('2e:ff:ff:00:22:%02x' % (index % arguments.thermostats), now + index,
+                                               21.5, Measurement.STATUS_NEW, 0, row_id=index + 1)
+                        for index in range(arguments.measurements)]
+
+        print('%8s %10s %10s %18s' % ('bulk', 'requests', 'pass [s]', 'measurements/s'))
+        for bulk in (False, True):
+            Config.SERVER_BULK_UPLOAD = bulk
+            elapsed, requests = measure(bulk, measurements, arguments.latency,
+                                        os.path.join(temp_dir, 'thermostat_urls_%s' % bulk))
+            print('%8s %10s %10.3f %18.0f' % (bulk, requests, elapsed, len(measurements) / elapsed))
+    finally:
+        Config.SERVER_BULK_UPLOAD = bulk_upload
+        Server._bulk_rejected_until = 0
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
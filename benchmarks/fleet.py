@@ -0,0 +1,142 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Measure a full thermostat cycle against a simulated fleet of thermostats on the loopback interface.
+
+Run from the project root: python3 -m benchmarks.fleet [--devices 10 100 1000] [--latency 0.02] [--loss 0.0]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+from smart_heating_local.config import Config
+from smart_heating_local.device_state import DeviceStateCache
+from smart_heating_local import registry
+from smart_heating_local.simulation import SimulatedFleet
+from smart_heating_local.storage import close_connections
+from smart_heating_local import thermostat_controller
+
+
+def percentile(values, fraction):
+    """
+    :param values: Sorted values
+    :type values: List[float]
+    :type fraction: float
+    :rtype: float
+    """
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(devices, arguments):
+    """
+    Run one cycle against a fleet of the given size.
+    :type devices: int
+    :return: Cycle time in seconds and the sorted request latencies
+    :rtype: (float, List[float])
+    """
+    temp_dir = tempfile.mkdtemp()
+    loop = asyncio.get_event_loop()
+    macs = ['2e:ff:ff:00:%02x:%02x' % (index // 256, index % 256) for index in range(devices)]
+    slowness = dict((mac, arguments.slowness) for mac in macs[:int(devices * arguments.slow_fraction)])
+    fleet = SimulatedFleet(macs, port=arguments.port, latency=arguments.latency, loss=arguments.loss,
+                           slowness=slowness, seed=devices)
+    latencies = []
+
+    original = (Config.CONFIG_PATH, Config.DATABASE_PATH, thermostat_controller.device_state,
+                registry.coap_url, thermostat_controller._coap_request)
+
+    @asyncio.coroutine
+    def timed_request(url, method, payload=None):
+        started = time.perf_counter()
+        try:
+            return (yield from original[4](url, method, payload))
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        Config.CONFIG_PATH = os.path.join(temp_dir, 'config')
+        Config.DATABASE_PATH = os.path.join(temp_dir, 'heating.db')
+        thermostat_controller.device_state = DeviceStateCache(path=os.path.join(temp_dir, 'device_state'))
+        registry.coap_url = fleet.coap_url
+        thermostat_controller.registry.clear()
+        thermostat_controller._coap_request = timed_request
+
+        config = Config()
+        config.save_thermostat_macs(macs)
+        for mac in macs:
+            config.save_heating_table(mac, [{'day': 0, 'time': '00:00:00', 'temperature': 21.0}])
+
+        loop.run_until_complete(fleet.start())
+        started = time.perf_counter()
+        loop.run_until_complete(thermostat_controller.cycle())
+        elapsed = time.perf_counter() - started
+
+        configured = sum(1 for thermostat in fleet.thermostats.values() if thermostat.target == 21.0)
+        if configured < devices:
+            print('  %s of %s thermostats did not receive their target temperature' % (devices - configured, devices))
+        return elapsed, sorted(latencies)
+    finally:
+        (Config.CONFIG_PATH, Config.DATABASE_PATH, thermostat_controller.device_state,
+         registry.coap_url, thermostat_controller._coap_request) = original
+        thermostat_controller.registry.clear()
+        thermostat_controller.shutdown_client_context()
+        close_connections()
+        fleet.stop()
+        shutil.rmtree(temp_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure a full thermostat cycle against a simulated fleet of thermostats.')
+    parser.add_argument('--devices', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--latency', type=float, default=0.02, help='mean seconds a thermostat takes to answer')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability of a datagram to be dropped')
+    parser.add_argument('--slow-fraction', type=float, default=0.0, help='fraction of slow thermostats')
+    parser.add_argument('--slowness', type=float, default=10.0, help='latency factor of slow thermostats')
+    parser.add_argument('--gap', type=float, default=Config.DEVICE_REQUEST_GAP,
+                        help='seconds between two requests to the same thermostat')
+    parser.add_argument('--port', type=int, default=56830)
+    arguments = parser.parse_args()
+
+    # Each simulated thermostat needs its own socket
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_NOFILE)
+    needed = max(arguments.devices) + 256
+    if soft_limit != resource.RLIM_INFINITY and soft_limit < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard_limit), hard_limit))
+
+    # Per request log messages would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+    thermostat_controller.pacer.gap = arguments.gap
+
+    print('%8s %10s %9s %9s %9s %9s' % ('devices', 'cycle [s]', 'requests', 'p50 [ms]', 'p95 [ms]', 'p99 [ms]'))
+    for devices in arguments.devices:
+        elapsed, latencies = run(devices, arguments)
+        print('%8s %10.2f %9s %9.1f %9.1f %9.1f' % (
+            devices, elapsed, len(latencies), 1000 * percentile(latencies, 0.50),
+            1000 * percentile(latencies, 0.95), 1000 * percentile(latencies, 0.99)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Measure the throughput of persisting thermostat readings.
+
+Run from the project root: python3 -m benchmarks.persistence
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from smart_heating_local.models import TemperatureReading, HeartbeatReading
+from smart_heating_local.storage import connect
+from smart_heating_local.thermostat_controller import store_temperatures, store_rssi
+
+READINGS = 10000
+THERMOSTATS = 50
+
+
+def generate_readings(count):
+    """
+    :return: Temperature and heartbeat readings of THERMOSTATS thermostats
+    :rtype: (List[TemperatureReading], List[HeartbeatReading])
+    """
+    start = datetime(2016, 1, 1)
+    temperatures = []
+    heartbeats = []
+    for index in range(count):
+        mac = '2e:ff:ff:00:22:%02x' % (index % THERMOSTATS)
+        timestamp = str(start + timedelta(minutes=15 * (index // THERMOSTATS), microseconds=index))
+        temperatures.append(TemperatureReading(mac, timestamp, 20 + index % 50 / 10))
+        heartbeats.append(HeartbeatReading(mac, timestamp, version='1', uptime=str(index), rssi=-60.0 - index % 30))
+    return temperatures, heartbeats
+
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        conn = connect(os.path.join(temp_dir, 'heating.db'))
+        temperatures, heartbeats = generate_readings(READINGS)
+
+        started = time.perf_counter()
+        store_temperatures(conn, temperatures)
+        store_rssi(conn, heartbeats)
+        conn.commit()
+        elapsed = time.perf_counter() - started
+
+        stored = conn.execute('SELECT COUNT(*) FROM heating_temperature').fetchone()[0] + \
+            conn.execute('SELECT COUNT(*) FROM heating_rssi').fetchone()[0]
+        conn.close()
+        assert stored == 2 * READINGS
+
+        print('Stored %s readings in %.3f s (%.0f readings/s)' % (stored, elapsed, stored / elapsed))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
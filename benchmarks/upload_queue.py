@@ -0,0 +1,141 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+"""
+Measure an upload pass over a growing history of already uploaded measurements and over a growing backlog.
+
+The server is replaced by a stub, so only the database work of the uploader is measured. The pass time should stay
+flat as the history grows and the peak memory should stay flat as the backlog grows.
+
+Run from the project root:
+python3 -m benchmarks.upload_queue [--history 100000 1000000 3000000] [--unsent 500] [--backlog 1000 10000 50000]
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from smart_heating_local.config import Config
+from smart_heating_local.models import Measurement, to_epoch
+from smart_heating_local import server_controller
+from smart_heating_local import storage
+from smart_heating_local.url_cache import ThermostatUrlCache
+
+THERMOSTATS = 50
+
+
+class StubServer(object):
+    """
+    Accepts every upload without network access.
+    """
+    thermostat_urls = None
+
+    def is_connected(self):
+        return True
+
+    def upload_temperature_measurements(self, measurements):
+        return ((measurement, None) for measurement in measurements)
+
+    def upload_meta_measurements(self, measurements):
+        return ((measurement, None) for measurement in measurements)
+
+
+def generate_rows(start, count, status):
+    """
+    :return: Rows (mac, timestamp, value, status) of THERMOSTATS thermostats measuring every 15 minutes
+    """
+    first = to_epoch(datetime(2016, 1, 1))
+    for index in range(start, start + count):
+        mac = '2e:ff:ff:00:22:%02x' % (index % THERMOSTATS)
+        yield mac, first + 15 * 60 * 1000000 * (index // THERMOSTATS) + index, 20 + index % 50 / 10, status
+
+
+def fill(conn, start, count, status):
+    conn.executemany('INSERT INTO heating_temperature (mac, timestamp, temperature, status) VALUES (?, ?, ?, ?)',
+                     generate_rows(start, count, status))
+    conn.executemany('INSERT INTO heating_rssi (mac, timestamp, rssi, status) VALUES (?, ?, ?, ?)',
+                     generate_rows(start, count, status))
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure an upload pass over a growing history and a growing backlog of measurements.')
+    parser.add_argument('--history', type=int, nargs='+', default=[100000, 1000000, 3000000],
+                        help='uploaded measurements per table')
+    parser.add_argument('--unsent', type=int, default=500, help='measurements per table to upload in each pass')
+    parser.add_argument('--backlog', type=int, nargs='+', default=[1000, 10000, 50000],
+                        help='temperature measurements to upload in one pass to measure the peak memory')
+    arguments = parser.parse_args()
+
+    # Per measurement log messages would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+    temp_dir = tempfile.mkdtemp()
+    original = (Config.DATABASE_PATH, server_controller.Server)
+    try:
+        Config.DATABASE_PATH = os.path.join(temp_dir, 'heating.db')
+        server_controller.Server = StubServer
+        StubServer.thermostat_urls = ThermostatUrlCache(path=os.path.join(temp_dir, 'thermostat_urls'))
+        conn = storage.get_connection()
+
+        print('%10s %9s %10s %15s' % ('history', 'unsent', 'pass [s]', 'backlog [ms]'))
+        history = 0
+        for size in sorted(arguments.history):
+            fill(conn, history, size - history, Measurement.STATUS_SENT)
+            fill(conn, size, arguments.unsent, Measurement.STATUS_NEW)
+            history = size + arguments.unsent
+
+            started = time.perf_counter()
+            backlog = server_controller.get_upload_backlog()
+            backlog_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            server_controller.upload_temperatures()
+            server_controller.upload_meta_data()
+            elapsed = time.perf_counter() - started
+
+            assert backlog == {'heating_temperature': arguments.unsent, 'heating_rssi': arguments.unsent}
+            assert server_controller.get_upload_backlog() == {'heating_temperature': 0, 'heating_rssi': 0}
+            print('%10s %9s %10.3f %15.2f' % (size, 2 * arguments.unsent, elapsed, 1000 * backlog_time))
+
+        print()
+        print('%10s %10s %12s' % ('backlog', 'pass [s]', 'peak [KiB]'))
+        for size in arguments.backlog:
+            fill(conn, history, size, Measurement.STATUS_NEW)
+            history += size
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            server_controller.upload_temperatures()
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            server_controller.upload_meta_data()
+            print('%10s %10.3f %12.0f' % (size, elapsed, peak / 1024))
+    finally:
+        Config.DATABASE_PATH, server_controller.Server = original
+        storage.close_connections()
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
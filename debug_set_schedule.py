@@ -19,6 +19,11 @@ limitations under the License.
 Set the target temperature on all configured thermostats.
 """
 
+import asyncio
+
 from smart_heating_local import thermostat_controller
 
-thermostat_controller.set_target_temperatures()
+try:
+    asyncio.get_event_loop().run_until_complete(thermostat_controller.set_target_temperatures())
+finally:
+    thermostat_controller.shutdown_client_context()
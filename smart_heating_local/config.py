@@ -16,6 +16,7 @@ limitations under the License.
 
 import os
 import shelve
+import threading
 
 
 class Config:
@@ -24,6 +25,84 @@ class Config:
     """
     PROJECT_ROOT = os.path.realpath(os.path.dirname(__file__) + '/..')
     CONFIG_PATH = os.path.realpath(PROJECT_ROOT + '/data/config')
+    DEVICE_STATE_PATH = os.path.realpath(PROJECT_ROOT + '/data/device_state')
+    DATABASE_PATH = os.path.realpath(PROJECT_ROOT + '/data/heating.db')
+    THERMOSTAT_URL_CACHE_PATH = os.path.realpath(PROJECT_ROOT + '/data/thermostat_urls')
+
+    # Seconds a mode or target temperature confirmed by a thermostat is trusted without querying it again
+    DEVICE_STATE_TTL = 2 * 60 * 60
+
+    # Seconds the server URL of a thermostat looked up by its MAC address is trusted without looking it up again
+    THERMOSTAT_URL_TTL = 24 * 60 * 60
+
+    # Minimal time in seconds between two CoAP requests to the same thermostat
+    DEVICE_REQUEST_GAP = 3.0
+
+    # Retries of failed CoAP requests with exponential backoff in seconds
+    COAP_MAX_ATTEMPTS = 3
+    COAP_BACKOFF_BASE = 2.0
+    COAP_BACKOFF_MAX = 30.0
+    # Seconds a CoAP operation including its retries may take
+    COAP_DEADLINE = 180.0
+
+    # Maximum number of CoAP requests outstanding at the same time over the border router
+    COAP_MAX_IN_FLIGHT = 8
+    # Halve the limit on timeouts and raise it again slowly (AIMD), down to COAP_MIN_IN_FLIGHT
+    COAP_ADAPTIVE_WINDOW = False
+    COAP_MIN_IN_FLIGHT = 1
+
+    # Port of the metrics endpoint in the Prometheus text format served by the daemon. None disables it.
+    METRICS_PORT = None
+    METRICS_HOST = '127.0.0.1'
+
+    # Connections to the server kept alive by the shared HTTP session
+    HTTP_POOL_SIZE = 4
+    # Seconds to wait for a connection to the server and between bytes of its response
+    HTTP_TIMEOUT = (10, 30)
+    # Retries of failed HTTP requests with a backoff of HTTP_BACKOFF * 2 ** retry seconds
+    HTTP_RETRIES = 3
+    HTTP_BACKOFF = 0.5
+
+    # Whether the uploader tries to upload the measurements of a thermostat in one request. Falls back to one request
+    # per measurement if the server does not support it.
+    SERVER_BULK_UPLOAD = True
+
+    # Seconds until bulk uploads are tried again after the server rejected one
+    SERVER_BULK_RETRY_INTERVAL = 60 * 60
+
+    # Intervals in seconds of the recurring jobs run by the daemon
+    THERMOSTAT_SYNC_INTERVAL = 15 * 60
+    SERVER_SYNC_INTERVAL = 5 * 60
+    RETENTION_INTERVAL = 6 * 60 * 60
+
+    # Age in seconds after which uploaded measurements are aggregated per hour and deleted
+    RETENTION_RAW_AGE = 30 * 24 * 60 * 60
+    # Age in seconds after which hourly aggregates are merged into daily aggregates
+    RETENTION_HOURLY_AGE = 365 * 24 * 60 * 60
+    # Maximum number of free database pages returned to the file system per retention run. None frees all.
+    RETENTION_VACUUM_PAGES = 2048
+
+    # Whether the daemon observes (RFC 7641) the thermostats temperature instead of polling it
+    OBSERVE_TEMPERATURE = False
+    # Seconds to wait before registering a failed observation again
+    OBSERVE_RETRY_DELAY = 60
+    # Seconds without notification after which an observation is considered lost and registered again
+    OBSERVE_MAX_SILENCE = 2 * THERMOSTAT_SYNC_INTERVAL
+
+    # Whether the daemon pushes target temperatures at heating schedule transitions instead of every thermostat sync
+    SETPOINT_SCHEDULER = False
+    # Seconds between two checks of the locally stored heating tables for changes
+    SETPOINT_CHECK_INTERVAL = SERVER_SYNC_INTERVAL
+    # Seconds between two verifications of mode and target temperature of a thermostat
+    SETPOINT_RECONCILE_INTERVAL = 6 * 60 * 60
+    # Seconds to wait before pushing a failed target temperature again
+    SETPOINT_RETRY_DELAY = 60
+
+    # Serializes shelve access of threads within one process, e.g. the daemon jobs
+    _lock = threading.RLock()
+
+    # Incremented whenever this process saves the thermostat MACs, so readers know when to load them again
+    generation = 0
 
     THERMOSTAT_MACS = 'thermostat_macs'
     HEATING_TABLES = 'heating_tables'
@@ -33,7 +112,7 @@ class Config:
         Retrieve the list of stored thermostat MAC addresses.
         :rtype: List[str]
         """
-        with shelve.open(self.CONFIG_PATH) as config:
+        with self._lock, shelve.open(self.CONFIG_PATH) as config:
             return config.get(self.THERMOSTAT_MACS, None)
 
     def save_thermostat_macs(self, thermostat_macs):
@@ -41,10 +120,11 @@ class Config:
         Store a list of thermostat MAC addresses in the config file.
         :type thermostat_macs: List[str]
         """
-        with shelve.open(self.CONFIG_PATH) as config:
+        with self._lock, shelve.open(self.CONFIG_PATH) as config:
             config[self.THERMOSTAT_MACS] = thermostat_macs
             # Write to file
             config.sync()
+            Config.generation += 1
 
     def get_heating_table(self, thermostat_mac):
         """
@@ -52,7 +132,7 @@ class Config:
         :type thermostat_mac: str
         :rtype: List[dict]
         """
-        with shelve.open(self.CONFIG_PATH) as config:
+        with self._lock, shelve.open(self.CONFIG_PATH) as config:
             tables = config.get(self.HEATING_TABLES, None)
             if tables is None:
                 return []
@@ -65,7 +145,7 @@ class Config:
         :type thermostat_mac: str
         :type heating_table_entries: List[dict]
         """
-        with shelve.open(self.CONFIG_PATH) as config:
+        with self._lock, shelve.open(self.CONFIG_PATH) as config:
             # Ensure config is a dict
             current_tables = config.get(self.HEATING_TABLES, None)
             if current_tables is None or not isinstance(current_tables, dict):
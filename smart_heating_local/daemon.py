@@ -0,0 +1,198 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+from asyncio.tasks import async
+import functools
+import signal
+
+from smart_heating_local.config import Config
+from smart_heating_local.health import health, render_metrics, MetricsServer
+from smart_heating_local import retention
+from smart_heating_local import server_controller
+from smart_heating_local import thermostat_controller
+from smart_heating_local.setpoint_scheduler import SetpointScheduler
+from smart_heating_local.storage import close_connections
+from smart_heating_local import logging
+
+
+class Job(object):
+    """
+    A recurring job run by the daemon.
+
+    Runs of the same job never overlap. A run taking longer than the interval delays the next run.
+    """
+
+    def __init__(self, name, function, interval, blocking=False):
+        """
+        :param name: Name used in log messages
+        :type name: str
+        :param function: Coroutine function or, if blocking is set, plain function to run
+        :param interval: Time in seconds between the start of two runs
+        :type interval: float
+        :param blocking: Whether the function blocks and therefore has to be run in a thread
+        :type blocking: bool
+        """
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self.blocking = blocking
+        self.runs = 0
+
+    @asyncio.coroutine
+    def run_once(self, loop):
+        """
+        Run the job once and log errors instead of raising them.
+        Runs async.
+        """
+        self.runs += 1
+        started = loop.time()
+        try:
+            if self.blocking:
+                yield from loop.run_in_executor(None, self.function)
+            else:
+                yield from self.function()
+        except Exception as e:
+            health.job_failed(self.name)
+            logging.error('Job %s failed' % self.name)
+            logging.exception(e)
+        logging.info('Job %s finished in %.1f s' % (self.name, loop.time() - started))
+
+    def __repr__(self):
+        return '<Job name:"%s" interval:"%s" runs:"%s">' % (self.name, self.interval, self.runs)
+
+
+class Daemon(object):
+    """
+    Runs recurring jobs and long running services on a single event loop until it is stopped.
+    """
+
+    def __init__(self, jobs, services=(), loop=None):
+        """
+        :type jobs: list[Job]
+        :param services: Coroutine functions running until they are cancelled on stop
+        :type services: list
+        """
+        self.jobs = jobs
+        self.services = services
+        self.loop = loop or asyncio.get_event_loop()
+        self._stopped = asyncio.Event(loop=self.loop)
+
+    def stop(self):
+        """
+        Request a graceful shutdown. Running jobs are allowed to finish.
+        """
+        logging.info('Stopping daemon')
+        self._stopped.set()
+
+    @asyncio.coroutine
+    def _run_job(self, job):
+        """
+        Run a job each interval until the daemon is stopped.
+        Runs async.
+        :type job: Job
+        """
+        while not self._stopped.is_set():
+            next_run = self.loop.time() + job.interval
+            yield from job.run_once(self.loop)
+
+            delay = next_run - self.loop.time()
+            if delay < 0:
+                logging.warning('Job %s took %.1f s longer than its interval' % (job.name, -delay))
+                continue
+            try:
+                yield from asyncio.wait_for(self._stopped.wait(), delay, loop=self.loop)
+            except asyncio.TimeoutError:
+                pass
+
+    @asyncio.coroutine
+    def run(self):
+        """
+        Run all jobs and services until the daemon is stopped.
+        Runs async.
+        """
+        services = [async(service(), loop=self.loop) for service in self.services]
+        try:
+            yield from asyncio.gather(*[self._run_job(job) for job in self.jobs], loop=self.loop)
+        finally:
+            for service in services:
+                service.cancel()
+            if len(services) > 0:
+                yield from asyncio.wait(services, loop=self.loop)
+
+
+def default_jobs():
+    """
+    :return: The thermostat and server synchronization and the retention jobs
+    :rtype: list[Job]
+    """
+    thermostat_sync = functools.partial(thermostat_controller.cycle, observe=Config.OBSERVE_TEMPERATURE,
+                                        set_targets=not Config.SETPOINT_SCHEDULER)
+    return [
+        Job('thermostat_sync', thermostat_sync, Config.THERMOSTAT_SYNC_INTERVAL),
+        Job('server_sync', server_controller.main, Config.SERVER_SYNC_INTERVAL, blocking=True),
+        Job('retention', retention.main, Config.RETENTION_INTERVAL, blocking=True),
+    ]
+
+
+def collect_metrics(backlog):
+    """
+    Render the metrics of the daemon on the event loop.
+
+    The exchange totals are only updated on the event loop. The health counters are also updated by the jobs running
+    in threads, so a snapshot is rendered.
+    :param backlog: The upload backlog, queried in a thread
+    :type backlog: dict
+    :rtype: str
+    """
+    return render_metrics(health.snapshot(), thermostat_controller.exchange_metrics.totals, backlog)
+
+
+def default_services():
+    """
+    :return: The long running services enabled in the config
+    :rtype: list
+    """
+    services = []
+    if Config.SETPOINT_SCHEDULER:
+        services.append(SetpointScheduler().run)
+    if Config.METRICS_PORT is not None:
+        services.append(MetricsServer(collect_metrics, server_controller.get_upload_backlog).run)
+    return services
+
+
+def main():
+    """
+    Run the thermostat and server synchronization as recurring jobs in one long running process.
+
+    State like the CoAP client context is kept between runs. Stops gracefully on SIGTERM and SIGINT.
+    """
+    loop = asyncio.get_event_loop()
+    daemon = Daemon(default_jobs(), default_services(), loop=loop)
+
+    loop.add_signal_handler(signal.SIGTERM, daemon.stop)
+    loop.add_signal_handler(signal.SIGINT, daemon.stop)
+
+    logging.info('Daemon started')
+    try:
+        loop.run_until_complete(daemon.run())
+    finally:
+        thermostat_controller.stop_observations()
+        thermostat_controller.shutdown_client_context()
+        close_connections()
+        loop.remove_signal_handler(signal.SIGTERM)
+        loop.remove_signal_handler(signal.SIGINT)
+        logging.info('Daemon stopped')
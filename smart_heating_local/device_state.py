@@ -0,0 +1,92 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from smart_heating_local.persisted_cache import PersistedCache
+
+
+class DeviceStateCache(PersistedCache):
+    """
+    Last known state of each thermostat, e.g. its mode and target temperature, as confirmed by the thermostat.
+
+    A cached value is trusted until its time to live expires, the thermostat reboots or a write to it fails.
+    The cache is kept in memory and persisted in a shelve file by save(), so it survives restarts.
+    """
+    PATH_SETTING = 'DEVICE_STATE_PATH'
+    TTL_SETTING = 'DEVICE_STATE_TTL'
+
+    MODE = 'mode'
+    TARGET = 'target'
+    UPTIME = 'uptime'
+
+    def _entry(self, mac):
+        """
+        :return: The mutable state entry of a thermostat, {key: (value, confirmation time)}
+        :rtype: dict
+        """
+        return self._get_entries().setdefault(mac, {})
+
+    def _restore(self, entry):
+        return dict(entry)
+
+    def get(self, mac, key):
+        """
+        :return: The confirmed value or None if it is unknown or expired
+        """
+        value, confirmed = self._entry(mac).get(key, (None, 0))
+        if not self._is_fresh(confirmed):
+            return None
+        return value
+
+    def confirm(self, mac, key, value):
+        """
+        Store a value the thermostat confirmed by a response.
+        """
+        self._entry(mac)[key] = (value, self.clock())
+        self._changed(mac)
+
+    def invalidate(self, mac, key=None):
+        """
+        Forget a value or, if key is omitted, the whole state of a thermostat, e.g. after a failed write.
+        """
+        entry = self._entry(mac)
+        if key is None:
+            entry.clear()
+        else:
+            entry.pop(key, None)
+        self._changed(mac)
+
+    def update_uptime(self, mac, uptime):
+        """
+        Store the uptime reported by the heartbeat. Forget the state of the thermostat if it rebooted, i.e. if the
+        uptime decreased.
+        :type mac: str
+        :param uptime: The uptime as reported by the thermostat
+        :type uptime: str|int
+        """
+        try:
+            uptime = int(uptime)
+        except (TypeError, ValueError):
+            return
+
+        entry = self._entry(mac)
+        previous_uptime, confirmed = entry.get(self.UPTIME, (None, 0))
+        if previous_uptime is not None and uptime < previous_uptime:
+            entry.clear()
+        entry[self.UPTIME] = (uptime, self.clock())
+        self._changed(mac)
+
+    def __repr__(self):
+        return '<DeviceStateCache thermostats:"%s">' % (0 if self._entries is None else len(self._entries))
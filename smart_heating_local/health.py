@@ -0,0 +1,330 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import copy
+import resource
+import time
+import tracemalloc
+
+from smart_heating_local.config import Config
+from smart_heating_local.metrics import LATENCY_BUCKETS
+from smart_heating_local import logging
+
+
+class HealthMetrics(object):
+    """
+    Counters describing the health of the controller and the uploader.
+
+    Updating a counter is a plain attribute or dict update, so they are cheap to maintain. The counters are
+    rendered in the Prometheus text format only when the metrics endpoint is scraped.
+    """
+
+    def __init__(self):
+        self.cycles = 0
+        self.cycle_seconds = 0.0
+        self.last_cycle_seconds = 0.0
+        # Thermostat operations which did not succeed
+        self.device_failures = 0
+        # Table -> uploaded measurements
+        self.uploads = {}
+        # Table -> failed uploads
+        self.upload_errors = {}
+        # Table -> seconds spent uploading
+        self.upload_seconds = {}
+        # Table -> peak memory in bytes allocated during the last upload pass, if traced
+        self.upload_peak_memory = {}
+        # Job name -> failed runs
+        self.job_failures = {}
+        # Synchronization, i.e. 'thermostat' or 'server' -> time of the last successful run in seconds since the epoch
+        self.last_success = {}
+
+    def cycle_finished(self, seconds, failures):
+        """
+        :param seconds: Duration of the thermostat cycle
+        :type seconds: float
+        :param failures: Number of failed thermostat operations
+        :type failures: int
+        """
+        self.cycles += 1
+        self.cycle_seconds += seconds
+        self.last_cycle_seconds = seconds
+        self.device_failures += failures
+
+    def upload_finished(self, table, uploaded, errors, seconds, peak_memory=None):
+        """
+        :param table: The table the measurements were read from
+        :type table: str
+        :type uploaded: int
+        :type errors: int
+        :type seconds: float
+        :param peak_memory: Peak memory in bytes allocated during the upload pass or None if it is unknown
+        :type peak_memory: int
+        """
+        self.uploads[table] = self.uploads.get(table, 0) + uploaded
+        self.upload_errors[table] = self.upload_errors.get(table, 0) + errors
+        self.upload_seconds[table] = self.upload_seconds.get(table, 0.0) + seconds
+        if peak_memory is not None:
+            self.upload_peak_memory[table] = peak_memory
+
+    def job_failed(self, name):
+        """
+        :type name: str
+        """
+        self.job_failures[name] = self.job_failures.get(name, 0) + 1
+
+    def synchronized(self, name):
+        """
+        Remember the time of a successful synchronization.
+        :param name: 'thermostat' or 'server'
+        :type name: str
+        """
+        self.last_success[name] = time.time()
+
+    def snapshot(self):
+        """
+        Copy the counters, so they can be read while the jobs keep updating them in other threads.
+
+        Copying a dict does not release the GIL, unlike iterating it in Python code.
+        :rtype: HealthMetrics
+        """
+        snapshot = copy.copy(self)
+        for name, value in vars(self).items():
+            if isinstance(value, dict):
+                setattr(snapshot, name, dict(value))
+        return snapshot
+
+    def __repr__(self):
+        return '<HealthMetrics cycles:"%s" device_failures:"%s" uploads:"%s">' % (
+            self.cycles, self.device_failures, sum(self.uploads.values()))
+
+
+# Health of this process
+health = HealthMetrics()
+
+
+def process_max_rss():
+    """
+    :return: The maximum resident memory of this process since it started in bytes. It never decreases.
+    :rtype: int
+    """
+    # Linux reports kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryTrace(object):
+    """
+    Traces the memory allocated by Python within a with block using tracemalloc.
+
+    If tracemalloc is already tracing, e.g. in a benchmark, the running trace is used and left running.
+    """
+
+    def __init__(self):
+        self._tracing = False
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def peak(self):
+        """
+        :return: The peak memory in bytes allocated since entering the block, or since the running trace started
+        :rtype: int
+        """
+        return tracemalloc.get_traced_memory()[1]
+
+
+def _format_labels(labels):
+    if len(labels) == 0:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+class _Writer(object):
+    """
+    Collects metric families in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, metric_type, help_text):
+        self.lines.append('# HELP %s %s' % (name, help_text))
+        self.lines.append('# TYPE %s %s' % (name, metric_type))
+
+    def sample(self, name, value, *labels):
+        self.lines.append('%s%s %s' % (name, _format_labels(labels), repr(float(value))))
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def render_metrics(health, exchange_totals, backlog):
+    """
+    Render the metrics in the Prometheus text exposition format.
+    :type health: HealthMetrics
+    :param exchange_totals: Resource path -> ExchangeStatistics since the start of the process
+    :type exchange_totals: dict
+    :param backlog: Table -> number of measurements waiting for the upload
+    :type backlog: dict
+    :rtype: str
+    """
+    writer = _Writer()
+
+    writer.family('smart_heating_cycle_duration_seconds', 'summary', 'Duration of the thermostat cycles.')
+    writer.sample('smart_heating_cycle_duration_seconds_sum', health.cycle_seconds)
+    writer.sample('smart_heating_cycle_duration_seconds_count', health.cycles)
+    writer.family('smart_heating_last_cycle_duration_seconds', 'gauge', 'Duration of the last thermostat cycle.')
+    writer.sample('smart_heating_last_cycle_duration_seconds', health.last_cycle_seconds)
+    writer.family('smart_heating_device_failures_total', 'counter', 'Failed thermostat operations.')
+    writer.sample('smart_heating_device_failures_total', health.device_failures)
+
+    writer.family('smart_heating_coap_requests_total', 'counter', 'CoAP exchanges by resource path and outcome.')
+    for path, statistics in sorted(exchange_totals.items()):
+        for outcome, count in (('success', statistics.successes), ('error', statistics.error_responses),
+                               ('timeout', statistics.timeouts), ('exception', statistics.exceptions)):
+            writer.sample('smart_heating_coap_requests_total', count, ('path', path), ('outcome', outcome))
+    writer.family('smart_heating_coap_request_duration_seconds', 'histogram', 'Latency of the CoAP exchanges.')
+    for path, statistics in sorted(exchange_totals.items()):
+        count = 0
+        for bound, bucket in zip(LATENCY_BUCKETS + ('+Inf',), statistics.buckets):
+            count += bucket
+            writer.sample('smart_heating_coap_request_duration_seconds_bucket', count, ('path', path), ('le', bound))
+        writer.sample('smart_heating_coap_request_duration_seconds_sum', statistics.latency_sum, ('path', path))
+        writer.sample('smart_heating_coap_request_duration_seconds_count', statistics.requests, ('path', path))
+
+    writer.family('smart_heating_upload_backlog', 'gauge', 'Measurements waiting for the upload.')
+    for table, count in sorted(backlog.items()):
+        writer.sample('smart_heating_upload_backlog', count, ('table', table))
+    writer.family('smart_heating_uploads_total', 'counter', 'Uploaded measurements.')
+    for table, count in sorted(health.uploads.items()):
+        writer.sample('smart_heating_uploads_total', count, ('table', table))
+    writer.family('smart_heating_upload_errors_total', 'counter', 'Failed measurement uploads.')
+    for table, count in sorted(health.upload_errors.items()):
+        writer.sample('smart_heating_upload_errors_total', count, ('table', table))
+    writer.family('smart_heating_upload_seconds_total', 'counter', 'Time spent uploading measurements.')
+    for table, seconds in sorted(health.upload_seconds.items()):
+        writer.sample('smart_heating_upload_seconds_total', seconds, ('table', table))
+
+    writer.family('smart_heating_upload_peak_memory_bytes', 'gauge',
+                  'Peak memory allocated during the last upload pass, if traced.')
+    for table, peak in sorted(health.upload_peak_memory.items()):
+        writer.sample('smart_heating_upload_peak_memory_bytes', peak, ('table', table))
+
+    writer.family('smart_heating_process_max_rss_bytes', 'gauge',
+                  'Maximum resident memory of the process since it started.')
+    writer.sample('smart_heating_process_max_rss_bytes', process_max_rss())
+
+    writer.family('smart_heating_job_failures_total', 'counter', 'Failed runs of the daemon jobs.')
+    for name, count in sorted(health.job_failures.items()):
+        writer.sample('smart_heating_job_failures_total', count, ('job', name))
+    writer.family('smart_heating_last_success_timestamp_seconds', 'gauge', 'Time of the last successful sync.')
+    for name, timestamp in sorted(health.last_success.items()):
+        writer.sample('smart_heating_last_success_timestamp_seconds', timestamp, ('sync', name))
+
+    return writer.text()
+
+
+class MetricsServer(object):
+    """
+    Minimal HTTP server answering GET /metrics on the event loop of the daemon.
+    """
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+    TIMEOUT = 10
+
+    def __init__(self, collect, query=None, host=None, port=None):
+        """
+        :param collect: Function returning the rendered metrics. Runs on the event loop, which updates most counters,
+        so it must not block.
+        :param query: Blocking function run in a thread before collect, e.g. a database query. Its result is passed
+        to collect.
+        :param host: Defaults to Config.METRICS_HOST
+        :param port: Defaults to Config.METRICS_PORT
+        """
+        self.collect = collect
+        self.query = query
+        self.host = Config.METRICS_HOST if host is None else host
+        self.port = Config.METRICS_PORT if port is None else port
+        self.scrapes = 0
+
+    @asyncio.coroutine
+    def run(self):
+        """
+        Serve the metrics until cancelled.
+        Runs async.
+        """
+        server = yield from asyncio.start_server(self._handle, self.host, self.port)
+        logging.info('Serving metrics on http://%s:%s/metrics' % (self.host, self.port))
+        try:
+            yield from asyncio.Future()
+        finally:
+            server.close()
+
+    @asyncio.coroutine
+    def _handle(self, reader, writer):
+        """
+        Answer a single request and close the connection.
+        Runs async.
+        """
+        try:
+            request_line = yield from asyncio.wait_for(reader.readline(), self.TIMEOUT)
+            # Skip the headers
+            while True:
+                line = yield from asyncio.wait_for(reader.readline(), self.TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] != 'GET':
+                status, body = '405 Method Not Allowed', ''
+            elif parts[1].split('?')[0] != '/metrics':
+                status, body = '404 Not Found', ''
+            else:
+                self.scrapes += 1
+                if self.query is None:
+                    body = self.collect()
+                else:
+                    result = yield from asyncio.get_event_loop().run_in_executor(None, self.query)
+                    body = self.collect(result)
+                status = '200 OK'
+        except (asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            logging.error('Could not render metrics')
+            logging.exception(e)
+            status, body = '500 Internal Server Error', ''
+
+        encoded_body = body.encode('utf-8')
+        writer.write(('HTTP/1.0 %s\r\nContent-Type: %s\r\nContent-Length: %s\r\nConnection: close\r\n\r\n' % (
+            status, self.CONTENT_TYPE, len(encoded_body))).encode('latin-1') + encoded_body)
+        try:
+            yield from writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def __repr__(self):
+        return '<MetricsServer host:"%s" port:"%s" scrapes:"%s">' % (self.host, self.port, self.scrapes)
@@ -0,0 +1,94 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from smart_heating_local.config import Config
+
+# Responses retried like connection errors. Only idempotent requests are retried after a response.
+RETRY_STATUS_CODES = (502, 503, 504)
+
+
+class IdempotentRetry(Retry):
+    """
+    Retries read errors only for idempotent requests.
+
+    urllib3 retries read errors of all methods, e.g. a connection closed before the response arrived, although the
+    server may already have processed the request. Non-idempotent requests raise read errors instead, so the caller
+    decides whether to send them again. urllib3 reports refused connections as read errors as well, so they are not
+    retried for non-idempotent requests either.
+    """
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if error is not None and self._is_read_error(error) and method is not None and \
+                method.upper() not in self.method_whitelist:
+            raise error
+        return super(IdempotentRetry, self).increment(method, url, response=response, error=error, _pool=_pool,
+                                                      _stacktrace=_stacktrace)
+
+
+class TimeoutSession(requests.Session):
+    """
+    A requests session which applies a default timeout to requests without one.
+    """
+
+    def __init__(self, timeout):
+        """
+        :param timeout: Seconds to wait for the connection and between bytes of the response, or a tuple of both
+        :type timeout: float|tuple
+        """
+        super(TimeoutSession, self).__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super(TimeoutSession, self).request(method, url, **kwargs)
+
+
+def create_session(pool_size=None, timeout=None, retries=None, backoff=None):
+    """
+    Create a session keeping connections to the server alive between requests.
+
+    Connect timeouts are retried for all requests. Read errors and RETRY_STATUS_CODES are only retried for
+    idempotent requests, see IdempotentRetry, so a measurement is not posted twice by the session.
+    :param pool_size: Connections kept per host. Defaults to Config.HTTP_POOL_SIZE
+    :type pool_size: int
+    :param timeout: Defaults to Config.HTTP_TIMEOUT
+    :type timeout: float|tuple
+    :param retries: Defaults to Config.HTTP_RETRIES
+    :type retries: int
+    :param backoff: Backoff factor in seconds of the retries. Defaults to Config.HTTP_BACKOFF
+    :type backoff: float
+    :rtype: TimeoutSession
+    """
+    pool_size = Config.HTTP_POOL_SIZE if pool_size is None else pool_size
+    timeout = Config.HTTP_TIMEOUT if timeout is None else timeout
+    retries = Config.HTTP_RETRIES if retries is None else retries
+    backoff = Config.HTTP_BACKOFF if backoff is None else backoff
+
+    session = TimeoutSession(timeout)
+    retry = IdempotentRetry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUS_CODES)
+    adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# Shared by all server communication of this process
+session = create_session()
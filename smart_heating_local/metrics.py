@@ -0,0 +1,244 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from bisect import bisect_left
+
+# Upper bounds in seconds of the latency histogram buckets. The last bucket counts all slower exchanges.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+OUTCOME_SUCCESS = 'success'
+OUTCOME_ERROR = 'error'
+OUTCOME_TIMEOUT = 'timeout'
+OUTCOME_EXCEPTION = 'exception'
+
+# Timestamps are microseconds since the epoch like those of the measurement tables
+CREATE_EXCHANGE_TABLE_SQL = "CREATE TABLE IF NOT EXISTS heating_coap_exchanges (" \
+                            "timestamp INTEGER NOT NULL," \
+                            "mac CHAR(20) NOT NULL," \
+                            "path TEXT NOT NULL," \
+                            "requests INTEGER NOT NULL," \
+                            "successes INTEGER NOT NULL," \
+                            "error_responses INTEGER NOT NULL," \
+                            "timeouts INTEGER NOT NULL," \
+                            "exceptions INTEGER NOT NULL," \
+                            "latency_sum FLOAT NOT NULL," \
+                            "latency_max FLOAT NOT NULL," \
+                            "histogram TEXT NOT NULL," \
+                            "error_codes TEXT NOT NULL);"
+INSERT_EXCHANGE_SQL = 'INSERT INTO heating_coap_exchanges (timestamp, mac, path, requests, successes, ' \
+                      'error_responses, timeouts, exceptions, latency_sum, latency_max, histogram, error_codes) ' \
+                      'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+
+class ExchangeStatistics(object):
+    """
+    Counters and latency histogram of the CoAP exchanges with one resource of a thermostat.
+    """
+    __slots__ = ('requests', 'successes', 'error_responses', 'timeouts', 'exceptions', 'latency_sum',
+                 'latency_max', 'buckets', 'error_codes')
+
+    def __init__(self):
+        self.requests = 0
+        self.successes = 0
+        self.error_responses = 0
+        self.timeouts = 0
+        self.exceptions = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        # Exchanges per bucket of LATENCY_BUCKETS plus one bucket for slower exchanges
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        # Response code, e.g. '4.04' -> count
+        self.error_codes = {}
+
+    def add(self, outcome, latency, code=None):
+        """
+        :param outcome: One of OUTCOME_SUCCESS, OUTCOME_ERROR, OUTCOME_TIMEOUT and OUTCOME_EXCEPTION
+        :type outcome: str
+        :param latency: Seconds the exchange took
+        :type latency: float
+        :param code: The response code of an error response as formatted by '%.2f'
+        :type code: str
+        """
+        self.requests += 1
+        if outcome == OUTCOME_SUCCESS:
+            self.successes += 1
+        elif outcome == OUTCOME_ERROR:
+            self.error_responses += 1
+            self.error_codes[code] = self.error_codes.get(code, 0) + 1
+        elif outcome == OUTCOME_TIMEOUT:
+            self.timeouts += 1
+        else:
+            self.exceptions += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def merge(self, other):
+        """
+        Add the exchanges of other statistics.
+        :type other: ExchangeStatistics
+        """
+        self.requests += other.requests
+        self.successes += other.successes
+        self.error_responses += other.error_responses
+        self.timeouts += other.timeouts
+        self.exceptions += other.exceptions
+        self.latency_sum += other.latency_sum
+        self.latency_max = max(self.latency_max, other.latency_max)
+        self.buckets = [count + other_count for count, other_count in zip(self.buckets, other.buckets)]
+        for code, count in other.error_codes.items():
+            self.error_codes[code] = self.error_codes.get(code, 0) + count
+
+    @property
+    def latency_mean(self):
+        """
+        :rtype: float
+        """
+        return self.latency_sum / self.requests if self.requests > 0 else 0.0
+
+    def percentile(self, fraction):
+        """
+        Estimate a latency percentile from the histogram.
+        :param fraction: E.g. 0.95 for the 95th percentile
+        :type fraction: float
+        :return: The upper bound of the bucket containing the percentile. The maximum latency for the last bucket.
+        :rtype: float
+        """
+        rank = fraction * self.requests
+        count = 0
+        for index, bucket in enumerate(self.buckets):
+            count += bucket
+            if count >= rank and count > 0:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else self.latency_max
+        return 0.0
+
+    def to_row(self, timestamp, mac, path):
+        """
+        :return: The parameters of INSERT_EXCHANGE_SQL
+        :rtype: tuple
+        """
+        histogram = ','.join(str(bucket) for bucket in self.buckets)
+        error_codes = ','.join('%s:%s' % (code, count) for code, count in sorted(self.error_codes.items()))
+        return (timestamp, mac, path, self.requests, self.successes, self.error_responses, self.timeouts,
+                self.exceptions, self.latency_sum, self.latency_max, histogram, error_codes)
+
+    def __repr__(self):
+        return '<ExchangeStatistics requests:"%s" successes:"%s" error_responses:"%s" timeouts:"%s" ' \
+               'exceptions:"%s" latency_mean:"%.3f" latency_max:"%.3f">' % (
+                   self.requests, self.successes, self.error_responses, self.timeouts, self.exceptions,
+                   self.latency_mean, self.latency_max)
+
+
+class ExchangeMetrics(object):
+    """
+    Aggregates the CoAP exchanges in memory per thermostat and resource path until they are flushed to the database.
+    """
+
+    def __init__(self):
+        # (mac, path) -> ExchangeStatistics
+        self.statistics = {}
+        # path -> ExchangeStatistics of all flushed exchanges
+        self.totals = {}
+
+    def record(self, mac, path, outcome, latency, code=None):
+        """
+        Record a single exchange. See ExchangeStatistics.add().
+        :type mac: str
+        :param path: Resource path, e.g. '/sensors/temperature'
+        :type path: str
+        """
+        key = (mac, path)
+        statistics = self.statistics.get(key)
+        if statistics is None:
+            statistics = self.statistics[key] = ExchangeStatistics()
+        statistics.add(outcome, latency, code)
+
+    def take_rows(self, timestamp):
+        """
+        Take the aggregates as rows of INSERT_EXCHANGE_SQL, add them to the totals and start aggregating anew.
+        :param timestamp: Microseconds since the epoch
+        :type timestamp: int
+        :rtype: list[tuple]
+        """
+        rows = [statistics.to_row(timestamp, mac, path) for (mac, path), statistics in self.statistics.items()]
+        for (mac, path), statistics in self.statistics.items():
+            total = self.totals.get(path)
+            if total is None:
+                total = self.totals[path] = ExchangeStatistics()
+            total.merge(statistics)
+        self.statistics.clear()
+        return rows
+
+    def flush(self, conn, timestamp):
+        """
+        Insert the aggregates into the database, add them to the totals and start aggregating anew. Does not commit.
+        :type conn: Connection
+        :param timestamp: Microseconds since the epoch
+        :type timestamp: int
+        :return: The number of inserted rows
+        :rtype: int
+        """
+        rows = self.take_rows(timestamp)
+        store_exchanges(conn, rows)
+        return len(rows)
+
+    def __repr__(self):
+        return '<ExchangeMetrics resources:"%s" requests:"%s">' % (
+            len(self.statistics), sum(statistics.requests for statistics in self.statistics.values()))
+
+
+def store_exchanges(conn, rows):
+    """
+    Insert exchange aggregates taken by ExchangeMetrics.take_rows(). Does not commit.
+    :type conn: Connection
+    :type rows: list[tuple]
+    """
+    conn.executemany(INSERT_EXCHANGE_SQL, rows)
+
+
+def create_exchange_table(conn):
+    """
+    Create the table of the flushed exchange aggregates in case it does not exist. Does not commit.
+    :type conn: Connection
+    """
+    conn.execute(CREATE_EXCHANGE_TABLE_SQL)
+
+
+def query_exchanges(conn, mac=None, path=None, since=None):
+    """
+    Query the flushed exchange aggregates, e.g. to follow the round trip times of a thermostat.
+    :type conn: Connection
+    :param mac: Only rows of this thermostat
+    :param path: Only rows of this resource path
+    :param since: Only rows flushed at or after this timestamp in microseconds since the epoch
+    :type since: int
+    :return: Tuples (timestamp, mac, path, requests, successes, error_responses, timeouts, exceptions, mean latency,
+    max latency) ordered by timestamp
+    :rtype: List[tuple]
+    """
+    conditions = []
+    parameters = []
+    for column, operator, value in (('mac', '=', mac), ('path', '=', path), ('timestamp', '>=', since)):
+        if value is not None:
+            conditions.append('%s %s ?' % (column, operator))
+            parameters.append(value)
+
+    sql = 'SELECT timestamp, mac, path, requests, successes, error_responses, timeouts, exceptions, ' \
+          'latency_sum / requests, latency_max FROM heating_coap_exchanges'
+    if len(conditions) > 0:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY timestamp, mac, path'
+    return conn.execute(sql, parameters).fetchall()
@@ -14,13 +14,44 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import time
 from datetime import datetime
 
 
+def to_epoch(moment):
+    """
+    :param moment: Local time
+    :type moment: datetime
+    :return: Microseconds since the epoch as stored in the database
+    :rtype: int
+    """
+    return int(time.mktime(moment.timetuple())) * 1000000 + moment.microsecond
+
+
+def from_epoch(epoch):
+    """
+    :param epoch: Microseconds since the epoch
+    :type epoch: int
+    :return: Local time
+    :rtype: datetime
+    """
+    return datetime.fromtimestamp(epoch // 1000000).replace(microsecond=epoch % 1000000)
+
+
+def epoch_now():
+    """
+    :return: The current time in microseconds since the epoch
+    :rtype: int
+    """
+    return int(time.time() * 1000000)
+
+
 class Measurement(object):
     """
     Base class for all types of measurements.
     """
+    __slots__ = ('row_id', 'mac', 'timestamp', 'status', 'attempts', '_date')
+
     STATUS_NEW = 0
     STATUS_SENT = 1
     STATUS_ERROR = 2
@@ -31,39 +62,142 @@ class Measurement(object):
         STATUS_ERROR,
     )
 
-    def __init__(self, mac, date, status, attempts):
+    def __init__(self, mac, timestamp, status, attempts, row_id=None):
+        # Row ID of the measurement in its table
+        self.row_id = row_id
         self.mac = mac
-        self.date = datetime.strptime(date, '%Y-%m-%d %H:%M:%S.%f')
+        # Microseconds since the epoch. Converted to a datetime on first access of date.
+        self.timestamp = timestamp
+        self._date = None
         if status is None:
             status = self.STATUS_NEW
         assert status in self.STATUSES
         self.status = status
         self.attempts = attempts
 
+    @property
+    def date(self):
+        """
+        :return: Local time of the measurement
+        :rtype: datetime
+        """
+        if self._date is None:
+            self._date = from_epoch(self.timestamp)
+        return self._date
+
 
 class TemperatureMeasurement(Measurement):
     """
     Represents a temperature measurement.
     """
+    __slots__ = ('temperature',)
 
-    def __init__(self, mac, date, temperature, status, attempts):
-        super(TemperatureMeasurement, self).__init__(mac=mac, date=date, status=status, attempts=attempts)
+    def __init__(self, mac, timestamp, temperature, status, attempts, row_id=None):
+        super(TemperatureMeasurement, self).__init__(mac=mac, timestamp=timestamp, status=status, attempts=attempts,
+                                                     row_id=row_id)
         self.temperature = temperature
 
     def __repr__(self):
-        return '<TemperatureMeasurement mac:"%s" date:"%s" temperature:"%s" status:"%s">' % (
-        self.mac, self.date, self.temperature, self.status)
+        return '<TemperatureMeasurement mac:"%s" timestamp:"%s" temperature:"%s" status:"%s">' % (
+        self.mac, self.timestamp, self.temperature, self.status)
 
 
 class MetaMeasurement(Measurement):
     """
     Represents a meta data measurement containing data about signal strength.
     """
+    __slots__ = ('rssi',)
 
-    def __init__(self, mac, date, rssi, status, attempts):
-        super(MetaMeasurement, self).__init__(mac=mac, date=date, status=status, attempts=attempts)
+    def __init__(self, mac, timestamp, rssi, status, attempts, row_id=None):
+        super(MetaMeasurement, self).__init__(mac=mac, timestamp=timestamp, status=status, attempts=attempts,
+                                              row_id=row_id)
         self.rssi = rssi
 
     def __repr__(self):
-        return '<MetaMeasurement mac:"%s" date:"%s" rssi:"%s" status:"%s">' % (
-        self.mac, self.date, self.rssi, self.status)
+        return '<MetaMeasurement mac:"%s" timestamp:"%s" rssi:"%s" status:"%s">' % (
+        self.mac, self.timestamp, self.rssi, self.status)
+
+
+class DeviceResult(object):
+    """
+    Base class for the result of a CoAP operation on a thermostat.
+
+    Results are returned by the controller coroutines. A failed operation is reported by its error description.
+    """
+    __slots__ = ('mac', 'timestamp', 'error')
+
+    def __init__(self, mac, timestamp, error=None):
+        """
+        :type mac: str
+        :param timestamp: Time the operation started in microseconds since the epoch
+        :type timestamp: int
+        :param error: Description of the failure or None if the operation succeeded
+        :type error: str|None
+        """
+        self.mac = mac
+        self.timestamp = timestamp
+        self.error = error
+
+    @property
+    def ok(self):
+        """
+        :rtype: bool
+        """
+        return self.error is None
+
+    def _fields(self):
+        fields = []
+        for cls in reversed(type(self).__mro__):
+            fields.extend(getattr(cls, '__slots__', ()))
+        return ' '.join('%s:"%s"' % (field, getattr(self, field)) for field in fields)
+
+    def __repr__(self):
+        return '<%s %s>' % (type(self).__name__, self._fields())
+
+
+class TemperatureReading(DeviceResult):
+    """
+    Result of querying a thermostats temperature.
+    """
+    __slots__ = ('temperature',)
+
+    def __init__(self, mac, timestamp, temperature=None, error=None):
+        super(TemperatureReading, self).__init__(mac, timestamp, error)
+        self.temperature = temperature
+
+
+class HeartbeatReading(DeviceResult):
+    """
+    Result of querying a thermostats heartbeat containing firmware version, uptime and signal strength.
+    """
+    __slots__ = ('version', 'uptime', 'rssi')
+
+    def __init__(self, mac, timestamp, version=None, uptime=None, rssi=None, error=None):
+        super(HeartbeatReading, self).__init__(mac, timestamp, error)
+        self.version = version
+        self.uptime = uptime
+        self.rssi = rssi
+
+
+class ModeResult(DeviceResult):
+    """
+    Result of ensuring a thermostats operating mode.
+    """
+    __slots__ = ('mode', 'changed')
+
+    def __init__(self, mac, timestamp, mode=None, changed=False, error=None):
+        super(ModeResult, self).__init__(mac, timestamp, error)
+        self.mode = mode
+        self.changed = changed
+
+
+class TargetResult(DeviceResult):
+    """
+    Result of ensuring a thermostats target temperature.
+    """
+    __slots__ = ('target', 'changed')
+
+    def __init__(self, mac, timestamp, target=None, changed=False, error=None):
+        super(TargetResult, self).__init__(mac, timestamp, error)
+        self.target = target
+        self.changed = changed
@@ -0,0 +1,177 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+from collections import deque
+import time
+
+from smart_heating_local.config import Config
+
+
+class DevicePacer(object):
+    """
+    Enforces a minimal gap between two requests to the same device without blocking the event loop.
+
+    A low power device needs time to finish its last request. Only requests to that device are delayed,
+    requests to other devices proceed concurrently.
+    """
+
+    def __init__(self, gap=None, clock=time.monotonic):
+        """
+        :param gap: Minimal time in seconds between the end of a request and the start of the next one to the same
+        device. Defaults to Config.DEVICE_REQUEST_GAP.
+        :type gap: float
+        :param clock: Monotonic clock returning seconds
+        """
+        self.gap = Config.DEVICE_REQUEST_GAP if gap is None else gap
+        self.clock = clock
+        # mac -> asyncio.Lock serializing the requests to a device
+        self._locks = {}
+        # mac -> earliest clock time the next request to the device may start
+        self._ready_at = {}
+
+        self.cycle_start = None
+        self.paced_requests = 0
+        self.total_delay = 0.0
+
+    @asyncio.coroutine
+    def acquire(self, mac):
+        """
+        Wait until a request to the device may be sent. Every call must be followed by a call to release().
+        Runs async.
+        :type mac: str
+        """
+        lock = self._locks.get(mac)
+        if lock is None:
+            lock = self._locks[mac] = asyncio.Lock()
+        yield from lock.acquire()
+
+        delay = self._ready_at.get(mac, 0) - self.clock()
+        if delay > 0:
+            self.paced_requests += 1
+            self.total_delay += delay
+            try:
+                yield from asyncio.sleep(delay)
+            except Exception:
+                lock.release()
+                raise
+
+    def release(self, mac):
+        """
+        Mark the current request to the device as finished and start its gap.
+        :type mac: str
+        """
+        self._ready_at[mac] = self.clock() + self.gap
+        self._locks[mac].release()
+
+    def start_cycle(self):
+        """
+        Reset the cycle statistics.
+        """
+        self.cycle_start = self.clock()
+        self.paced_requests = 0
+        self.total_delay = 0.0
+
+    def cycle_time(self):
+        """
+        :return: The wall clock time in seconds since start_cycle() was called
+        :rtype: float
+        """
+        if self.cycle_start is None:
+            return 0.0
+        return self.clock() - self.cycle_start
+
+    def __repr__(self):
+        return '<DevicePacer gap:"%s" cycle_time:"%.2f" paced_requests:"%s" total_delay:"%.2f">' % (
+            self.gap, self.cycle_time(), self.paced_requests, self.total_delay)
+
+
+class RequestWindow(object):
+    """
+    Limits the number of outstanding requests over the shared border router.
+
+    A burst of simultaneous requests causes collisions and retransmissions on the radio, so requests beyond the
+    limit wait for a free slot. In adaptive mode the limit follows AIMD: it grows by one per window of completed
+    requests and is halved on every timeout.
+    """
+
+    def __init__(self, limit=None, adaptive=None, min_limit=None):
+        """
+        :param limit: Maximum number of outstanding requests. Defaults to Config.COAP_MAX_IN_FLIGHT.
+        :type limit: int
+        :param adaptive: Whether to adapt the limit to timeouts. Defaults to Config.COAP_ADAPTIVE_WINDOW.
+        :type adaptive: bool
+        :param min_limit: Lower bound of the adaptive limit. Defaults to Config.COAP_MIN_IN_FLIGHT.
+        :type min_limit: int
+        """
+        self.max_limit = Config.COAP_MAX_IN_FLIGHT if limit is None else limit
+        self.adaptive = Config.COAP_ADAPTIVE_WINDOW if adaptive is None else adaptive
+        self.min_limit = Config.COAP_MIN_IN_FLIGHT if min_limit is None else min_limit
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        # Futures of the requests waiting for a slot, in order of arrival
+        self._waiters = deque()
+
+        self.queued_requests = 0
+        self.timeouts = 0
+
+    @asyncio.coroutine
+    def acquire(self):
+        """
+        Wait for a free slot. Every call must be followed by a call to release().
+        Runs async.
+        """
+        if self.in_flight < int(self.limit) and len(self._waiters) == 0:
+            self.in_flight += 1
+            return
+
+        self.queued_requests += 1
+        waiter = asyncio.Future()
+        self._waiters.append(waiter)
+        try:
+            yield from waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self._waiters.remove(waiter)
+            else:
+                # The slot has been handed over already
+                self.release()
+            raise
+
+    def release(self, timed_out=False):
+        """
+        Free the slot of a finished request and wake up waiting requests.
+        :param timed_out: Whether the request timed out
+        :type timed_out: bool
+        """
+        self.in_flight -= 1
+        if timed_out:
+            self.timeouts += 1
+        if self.adaptive:
+            if timed_out:
+                self.limit = max(float(self.min_limit), self.limit / 2)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+        while len(self._waiters) > 0 and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def __repr__(self):
+        return '<RequestWindow limit:"%.1f" in_flight:"%s" queued_requests:"%s" timeouts:"%s">' % (
+            self.limit, self.in_flight, self.queued_requests, self.timeouts)
@@ -0,0 +1,102 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import shelve
+import time
+
+from smart_heating_local.config import Config
+
+
+class PersistedCache(object):
+    """
+    Base class of caches holding one entry per thermostat MAC with values trusted for a time to live.
+
+    The entries are kept in memory and the changed entries are persisted in a shelve file by save(), so they survive
+    restarts. Subclasses set the names of the Config attributes holding the defaults of the path and the time to live.
+    """
+    PATH_SETTING = None
+    TTL_SETTING = None
+
+    def __init__(self, path=None, ttl=None, clock=time.time):
+        """
+        :param path: Path of the shelve file. Defaults to the Config attribute named by PATH_SETTING.
+        :param ttl: Seconds a value is trusted. Defaults to the Config attribute named by TTL_SETTING.
+        :param clock: Wall clock returning seconds since the epoch
+        """
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        # mac -> entry, loaded on first use
+        self._entries = None
+        self._dirty = set()
+
+    def _get_path(self):
+        return getattr(Config, self.PATH_SETTING) if self.path is None else self.path
+
+    def _get_ttl(self):
+        return getattr(Config, self.TTL_SETTING) if self.ttl is None else self.ttl
+
+    def _get_entries(self):
+        """
+        :return: The entries by MAC, loaded on first use
+        :rtype: dict
+        """
+        if self._entries is None:
+            self.load()
+        return self._entries
+
+    def _is_fresh(self, stored):
+        """
+        :param stored: Time the value was stored in seconds since the epoch
+        :return: Whether the time to live of a value has not expired yet
+        :rtype: bool
+        """
+        return self.clock() - stored <= self._get_ttl()
+
+    def _changed(self, mac):
+        """
+        Mark the entry of a thermostat to be persisted by the next save().
+        """
+        self._dirty.add(mac)
+
+    def _restore(self, entry):
+        """
+        :return: The in-memory entry of a persisted entry
+        """
+        return entry
+
+    def load(self):
+        """
+        Load the persisted entries, replacing the entries in memory.
+        """
+        with shelve.open(self._get_path()) as storage:
+            self._entries = dict((mac, self._restore(storage[mac])) for mac in storage.keys())
+        self._dirty.clear()
+
+    def save(self):
+        """
+        Persist the changed entries.
+        """
+        if len(self._dirty) == 0:
+            return
+        with shelve.open(self._get_path()) as storage:
+            for mac in self._dirty:
+                if mac in self._entries:
+                    storage[mac] = self._entries[mac]
+                elif mac in storage:
+                    del storage[mac]
+            storage.sync()
+        self._dirty.clear()
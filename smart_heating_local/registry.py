@@ -0,0 +1,138 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ipaddress
+from urllib.parse import urlsplit
+
+from smart_heating_local.config import Config
+
+
+def ipv6(mac_addr):
+    """
+    Convert MAC into IPv6 format.
+
+    E.g. 2e:ff:ff:00:22:8b to 2eff:ff00:228b
+
+    :type mac_addr: str
+    :rtype: str
+    """
+    digits = mac_addr.replace(':', '')
+    # Prefix from border router
+    return 'fdfd::221:' + ':'.join(digits[index:index + 4] for index in range(0, len(digits), 4))
+
+
+def coap_url(mac_addr):
+    """
+    Return the CoAP url associated to a MAC address
+    :type mac_addr: str
+    """
+    return 'coap://[' + ipv6(mac_addr) + ']'
+
+
+class Thermostat(object):
+    """
+    A thermostat with its parsed address, precomputed resource URIs and runtime state.
+
+    The confirmed mode and target temperature are kept by the DeviceStateCache.
+    """
+    __slots__ = ('mac', 'url', 'address', 'temperature_uri', 'heartbeat_uri', 'mode_uri', 'target_uri',
+                 'last_rtt', 'failure_streak')
+
+    def __init__(self, mac, url):
+        """
+        :type mac: str
+        :param url: Base CoAP URL of the thermostat, e.g. 'coap://[fdfd::221:2eff:ff00:228b]'
+        :type url: str
+        """
+        self.mac = mac
+        self.url = url
+        self.address = ipaddress.IPv6Address(urlsplit(url).hostname)
+        self.temperature_uri = url + '/sensors/temperature'
+        self.heartbeat_uri = url + '/debug/heartbeat'
+        self.mode_uri = url + '/set/mode'
+        self.target_uri = url + '/set/target'
+
+        # Seconds of the last successful exchange
+        self.last_rtt = None
+        # Number of consecutive failed requests
+        self.failure_streak = 0
+
+    def request_finished(self, success, rtt=None):
+        """
+        Update the runtime state after a request.
+        :param success: Whether the thermostat responded successfully
+        :type success: bool
+        :param rtt: Seconds of the last exchange of a successful request
+        :type rtt: float
+        """
+        if success:
+            self.failure_streak = 0
+            self.last_rtt = rtt
+        else:
+            self.failure_streak += 1
+
+    def __repr__(self):
+        return '<Thermostat mac:"%s" address:"%s" last_rtt:"%s" failure_streak:"%s">' % (
+            self.mac, self.address, self.last_rtt, self.failure_streak)
+
+
+class ThermostatRegistry(object):
+    """
+    The configured thermostats, loaded once from the config.
+
+    The registry is loaded again only if the thermostat MACs have been saved since or the config path changed.
+    Thermostats keep their runtime state across reloads. Their URLs are computed by coap_url().
+    """
+
+    def __init__(self):
+        # mac -> Thermostat, including thermostats which are not configured but have been requested
+        self._thermostats = {}
+        # Configured thermostats in the order of the config
+        self._configured = None
+        self._loaded_key = None
+
+    def thermostats(self):
+        """
+        :return: The configured thermostats or None if no thermostats are configured
+        :rtype: List[Thermostat]|None
+        """
+        key = (Config.CONFIG_PATH, Config.generation)
+        if key != self._loaded_key:
+            macs = Config().get_thermostat_macs()
+            self._configured = None if macs is None else [self.get(mac) for mac in macs]
+            self._loaded_key = key
+        return self._configured
+
+    def get(self, mac):
+        """
+        :return: The thermostat of a MAC, whether it is configured or not
+        :rtype: Thermostat
+        """
+        thermostat = self._thermostats.get(mac)
+        if thermostat is None:
+            thermostat = self._thermostats[mac] = Thermostat(mac, coap_url(mac))
+        return thermostat
+
+    def clear(self):
+        """
+        Forget all thermostats and their runtime state, e.g. after coap_url has been replaced.
+        """
+        self._thermostats.clear()
+        self._configured = None
+        self._loaded_key = None
+
+    def __repr__(self):
+        return '<ThermostatRegistry thermostats:"%s">' % (0 if self._configured is None else len(self._configured))
@@ -0,0 +1,181 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from datetime import datetime, timedelta
+
+from smart_heating_local.config import Config
+from smart_heating_local.models import Measurement, to_epoch
+from smart_heating_local.storage import get_connection
+from smart_heating_local import logging
+
+RESOLUTION_HOUR = 60 * 60
+RESOLUTION_DAY = 24 * RESOLUTION_HOUR
+
+# Raw measurement table -> value column. The aggregates of a table are kept in <table>_aggregates.
+MEASUREMENT_TABLES = (
+    ('heating_temperature', 'temperature'),
+    ('heating_rssi', 'rssi'),
+)
+
+# Measurements which will not change anymore and can be aggregated. New measurements still have to be uploaded.
+FINISHED_STATUSES = (Measurement.STATUS_SENT, Measurement.STATUS_ERROR)
+
+
+def bucket_sql(resolution):
+    """
+    :param resolution: RESOLUTION_HOUR or RESOLUTION_DAY
+    :return: SQL expression of the start of the hour or local day of the timestamp column
+    :rtype: str
+    """
+    if resolution == RESOLUTION_HOUR:
+        return 'timestamp - timestamp %% %d' % (RESOLUTION_HOUR * 1000000)
+    if resolution == RESOLUTION_DAY:
+        return "CAST(strftime('%s', timestamp / 1000000, 'unixepoch', 'localtime', 'start of day', 'utc') " \
+               "AS INTEGER) * 1000000"
+    raise ValueError('Unsupported resolution %s' % resolution)
+
+
+def bucket_start(moment, resolution):
+    """
+    :type moment: datetime
+    :param resolution: RESOLUTION_HOUR or RESOLUTION_DAY
+    :return: The start of the hour or day of the moment
+    :rtype: datetime
+    """
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if resolution == RESOLUTION_DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def roll_up(conn, table, column, before):
+    """
+    Aggregate the finished raw measurements before a timestamp per thermostat and hour, then delete them.
+    Does not commit.
+    :type conn: Connection
+    :param table: A raw measurement table of MEASUREMENT_TABLES
+    :param column: The value column of the table
+    :param before: Start of an hour in microseconds since the epoch, so no hour is aggregated partially
+    :type before: int
+    :return: The number of deleted raw measurements
+    :rtype: int
+    """
+    condition = 'status IN (%s) AND timestamp < ?' % ', '.join(str(status) for status in FINISHED_STATUSES)
+    conn.execute('INSERT INTO %s_aggregates (mac, timestamp, resolution, minimum, maximum, total, count) '
+                 'SELECT mac, %s AS bucket, %s, MIN(%s), MAX(%s), SUM(%s), COUNT(*) FROM %s WHERE %s '
+                 'GROUP BY mac, bucket' % (table, bucket_sql(RESOLUTION_HOUR), RESOLUTION_HOUR, column, column, column,
+                                           table, condition), (before,))
+    return conn.execute('DELETE FROM %s WHERE %s' % (table, condition), (before,)).rowcount
+
+
+def compact(conn, table, before):
+    """
+    Merge the hourly aggregates before a timestamp into daily aggregates. Does not commit.
+    :type conn: Connection
+    :param table: A raw measurement table of MEASUREMENT_TABLES
+    :param before: Start of a day in microseconds since the epoch, so no day is aggregated partially
+    :type before: int
+    :return: The number of merged hourly aggregates
+    :rtype: int
+    """
+    condition = 'resolution = %s AND timestamp < ?' % RESOLUTION_HOUR
+    conn.execute('INSERT INTO %s_aggregates (mac, timestamp, resolution, minimum, maximum, total, count) '
+                 'SELECT mac, %s AS bucket, %s, MIN(minimum), MAX(maximum), SUM(total), SUM(count) '
+                 'FROM %s_aggregates WHERE %s GROUP BY mac, bucket' % (table, bucket_sql(RESOLUTION_DAY),
+                                                                        RESOLUTION_DAY, table, condition), (before,))
+    return conn.execute('DELETE FROM %s_aggregates WHERE %s' % (table, condition), (before,)).rowcount
+
+
+def vacuum(conn, pages=None):
+    """
+    Return free pages of the database file to the file system. Needs auto_vacuum=INCREMENTAL, see storage.
+    :type conn: Connection
+    :param pages: Maximum number of pages to free or None to free all
+    :type pages: int|None
+    :return: The number of freed pages
+    :rtype: int
+    """
+    free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if pages is None:
+        conn.execute('PRAGMA incremental_vacuum').fetchall()
+    else:
+        conn.execute('PRAGMA incremental_vacuum(%d)' % pages).fetchall()
+    return free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+def query_measurements(conn, table, mac=None, since=None, until=None, resolution=None):
+    """
+    Query the measurement history of raw measurements and aggregates alike.
+
+    Without a resolution raw measurements are returned as they are, with a resolution of 0 and a count of 1, and
+    aggregates with their own resolution. With a resolution all rows are merged per hour or day. Aggregates coarser
+    than the requested resolution keep their resolution.
+    :type conn: Connection
+    :param table: A raw measurement table of MEASUREMENT_TABLES
+    :param mac: Only measurements of this thermostat
+    :param since: Only measurements and aggregates starting at or after this time in microseconds since the epoch
+    :type since: int
+    :param until: Only measurements and aggregates starting before this time in microseconds since the epoch
+    :type until: int
+    :param resolution: None, RESOLUTION_HOUR or RESOLUTION_DAY
+    :return: Tuples (timestamp, mac, resolution, minimum, maximum, mean, count) ordered by timestamp and mac
+    :rtype: List[tuple]
+    """
+    column = dict(MEASUREMENT_TABLES)[table]
+    conditions = []
+    parameters = []
+    for name, operator, value in (('mac', '=', mac), ('timestamp', '>=', since), ('timestamp', '<', until)):
+        if value is not None:
+            conditions.append('%s %s ?' % (name, operator))
+            parameters.append(value)
+    where = ''
+    if len(conditions) > 0:
+        where = ' WHERE ' + ' AND '.join(conditions)
+
+    rows = 'SELECT timestamp, mac, 0 AS resolution, %s AS minimum, %s AS maximum, %s AS total, 1 AS count ' \
+           'FROM %s%s UNION ALL ' \
+           'SELECT timestamp, mac, resolution, minimum, maximum, total, count FROM %s_aggregates%s' % (
+               column, column, column, table, where, table, where)
+    if resolution is None:
+        sql = 'SELECT timestamp, mac, resolution, MIN(minimum), MAX(maximum), SUM(total) / SUM(count), ' \
+              'SUM(count) FROM (%s) GROUP BY timestamp, mac, resolution ORDER BY timestamp, mac, resolution' % rows
+    else:
+        sql = 'SELECT %s AS bucket, mac, MAX(MAX(resolution), %s), MIN(minimum), MAX(maximum), ' \
+              'SUM(total) / SUM(count), SUM(count) FROM (%s) GROUP BY bucket, mac ORDER BY bucket, mac' % (
+                  bucket_sql(resolution), resolution, rows)
+    return conn.execute(sql, parameters * 2).fetchall()
+
+
+def main(now=None):
+    """
+    Aggregate old measurements, merge old hourly aggregates and shrink the database file.
+    :param now: Defaults to the current time
+    :type now: datetime
+    """
+    if now is None:
+        now = datetime.now()
+    raw_before = bucket_start(now - timedelta(seconds=Config.RETENTION_RAW_AGE), RESOLUTION_HOUR)
+    hourly_before = bucket_start(now - timedelta(seconds=Config.RETENTION_HOURLY_AGE), RESOLUTION_DAY)
+
+    conn = get_connection()
+    with conn:
+        for table, column in MEASUREMENT_TABLES:
+            rolled_up = roll_up(conn, table, column, to_epoch(raw_before))
+            compacted = compact(conn, table, to_epoch(hourly_before))
+            logging.info('Aggregated %s measurements before %s and merged %s hourly aggregates before %s of %s' % (
+                rolled_up, raw_before, compacted, hourly_before, table))
+    freed = vacuum(conn, Config.RETENTION_VACUUM_PAGES)
+    logging.info('Freed %s database pages' % freed)
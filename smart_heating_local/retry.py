@@ -0,0 +1,108 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import random
+
+from smart_heating_local.config import Config
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed CoAP operation is attempted again.
+
+    Uses exponential backoff with full jitter: the n-th retry waits a random time between 0 and
+    min(max_delay, base_delay * 2 ** (n - 1)) seconds. No attempt is started after the operations deadline.
+    """
+
+    def __init__(self, max_attempts=None, base_delay=None, max_delay=None, deadline=None, random=random.random):
+        """
+        :param max_attempts: Defaults to Config.COAP_MAX_ATTEMPTS
+        :param base_delay: Seconds. Defaults to Config.COAP_BACKOFF_BASE.
+        :param max_delay: Seconds. Defaults to Config.COAP_BACKOFF_MAX.
+        :param deadline: Seconds an operation may take in total. Defaults to Config.COAP_DEADLINE.
+        :param random: Function returning a random float in [0, 1)
+        """
+        self.max_attempts = Config.COAP_MAX_ATTEMPTS if max_attempts is None else max_attempts
+        self.base_delay = Config.COAP_BACKOFF_BASE if base_delay is None else base_delay
+        self.max_delay = Config.COAP_BACKOFF_MAX if max_delay is None else max_delay
+        self.deadline = Config.COAP_DEADLINE if deadline is None else deadline
+        self.random = random
+
+    def is_retryable_code(self, code):
+        """
+        Client errors (4.xx) are permanent, server errors (5.xx) may be temporary.
+        :param code: Response code as returned by parse_coap_response_code
+        :type code: float
+        :rtype: bool
+        """
+        return code >= 5
+
+    def delay(self, attempt):
+        """
+        :param attempt: Number of the failed attempt, starting at 1
+        :type attempt: int
+        :return: Seconds to wait before the next attempt
+        :rtype: float
+        """
+        return self.random() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+
+    def next_delay(self, attempt, remaining):
+        """
+        :param attempt: Number of the failed attempt, starting at 1
+        :type attempt: int
+        :param remaining: Seconds left until the operations deadline
+        :type remaining: float
+        :return: Seconds to wait before the next attempt or None to give up
+        :rtype: float|None
+        """
+        if attempt >= self.max_attempts:
+            return None
+        delay = self.delay(attempt)
+        if delay >= remaining:
+            return None
+        return delay
+
+    def __repr__(self):
+        return '<RetryPolicy max_attempts:"%s" base_delay:"%s" max_delay:"%s" deadline:"%s">' % (
+            self.max_attempts, self.base_delay, self.max_delay, self.deadline)
+
+
+class RetryStatistics(object):
+    """
+    Counts the CoAP operations and attempts of a single thermostat.
+    """
+    __slots__ = ('operations', 'attempts', 'timeouts', 'failures', 'error_responses', 'latency')
+
+    def __init__(self):
+        self.operations = 0
+        self.attempts = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.error_responses = 0
+        # Seconds spent in operations including retries and backoff
+        self.latency = 0.0
+
+    @property
+    def retries(self):
+        """
+        :rtype: int
+        """
+        return self.attempts - self.operations
+
+    def __repr__(self):
+        return '<RetryStatistics operations:"%s" attempts:"%s" timeouts:"%s" failures:"%s" error_responses:"%s" ' \
+               'latency:"%.2f">' % (self.operations, self.attempts, self.timeouts, self.failures,
+                                    self.error_responses, self.latency)
@@ -0,0 +1,110 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import functools
+from bisect import bisect_right
+from datetime import timedelta
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def minute_of_week(moment):
+    """
+    :type moment: datetime
+    :return: Minutes since Monday 00:00
+    :rtype: int
+    """
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+class HeatingSchedule(object):
+    """
+    A heating table compiled for lookups by bisection.
+
+    Each entry sets a temperature from its day and time on until the next entry. The last entry of the week is
+    still applicable at the beginning of the week.
+    """
+    __slots__ = ('starts', 'temperatures')
+
+    def __init__(self, entries):
+        """
+        :param entries: Tuples (day, time, temperature) with day 0 for Monday and time formatted as 'HH:MM[:SS]'
+        :type entries: Iterable[tuple]
+        """
+        compiled = []
+        for day, time, temperature in entries:
+            hours, minutes = time.split(':')[:2]
+            compiled.append((day * MINUTES_PER_DAY + int(hours) * 60 + int(minutes), temperature))
+        # The sort is stable, the last of several entries with the same start wins
+        compiled.sort(key=lambda entry: entry[0])
+
+        self.starts = [start for start, temperature in compiled]
+        self.temperatures = [temperature for start, temperature in compiled]
+
+    def temperature_at(self, moment):
+        """
+        :type moment: datetime
+        :return: The scheduled temperature or None if the schedule is empty
+        :rtype: float|None
+        """
+        if len(self.starts) == 0:
+            return None
+        # Index -1 wraps around to the last entry of the previous week
+        return self.temperatures[bisect_right(self.starts, minute_of_week(moment)) - 1]
+
+    def next_transition(self, moment):
+        """
+        :type moment: datetime
+        :return: The start of the next entry after moment or None if the schedule is empty
+        :rtype: datetime|None
+        """
+        if len(self.starts) == 0:
+            return None
+        minute = minute_of_week(moment)
+        index = bisect_right(self.starts, minute)
+        if index < len(self.starts):
+            next_start = self.starts[index]
+        else:
+            next_start = self.starts[0] + MINUTES_PER_WEEK
+        return moment.replace(second=0, microsecond=0) + timedelta(minutes=next_start - minute)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return '<HeatingSchedule entries:"%s">' % len(self)
+
+
+def compile_schedule(heating_table):
+    """
+    Return the compiled schedule of a heating table. Schedules are cached by the content of the heating table, so
+    a schedule is only compiled again after the heating table has changed.
+    :param heating_table: Heating table entries as downloaded from the server
+    :type heating_table: List[dict]
+    :rtype: HeatingSchedule
+    """
+    entries = tuple((entry.get('day'), entry.get('time'), entry.get('temperature')) for entry in heating_table)
+    return _compile_schedule(entries)
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_schedule(entries):
+    """
+    :type entries: tuple
+    :rtype: HeatingSchedule
+    """
+    return HeatingSchedule(entries)
@@ -15,10 +15,17 @@ limitations under the License.
 """
 
 import json
+import time
+from collections import OrderedDict
 
 import requests
 import subprocess
 
+from smart_heating_local.config import Config
+from smart_heating_local.http_session import session
+from smart_heating_local.url_cache import ThermostatUrlCache
+from smart_heating_local import logging
+
 
 class Error(Exception):
     def __init__(self, response, *args, permanent=False, **kwargs):
@@ -36,6 +43,24 @@ class Server:
     """
     SERVER_URL = 'http://52.28.68.182:8000/'
 
+    # Shared keep-alive session. Attribute to allow dependency injection.
+    requests = session
+
+    # Server URLs of the thermostats by MAC address, shared by all instances
+    thermostat_urls = ThermostatUrlCache()
+
+    # Responses to a cached thermostat URL which mean it has to be looked up again
+    STALE_URL_STATUS_CODES = (404, 410)
+
+    # Responses to a bulk upload which mean the server does not support it
+    BULK_UNSUPPORTED_STATUS_CODES = (400, 404, 405, 415, 501)
+
+    # The local MAC address does not change while the process is running
+    _local_mac_address = None
+
+    # Monotonic time until which measurements are uploaded one by one because the server rejected a bulk upload
+    _bulk_rejected_until = 0
+
     def thermostat_url(self, rfid=None):
         """
         Return the URL of a thermostats API endpoint.
@@ -80,7 +105,7 @@ class Server:
             assert rfid is not None
             url = self.device_thermostat_url(rfid)
 
-        r = requests.get(url)
+        r = self.requests.get(url)
         assert (200 <= r.status_code < 300)
 
         return r.json()
@@ -103,56 +128,194 @@ class Server:
         :rtype: bool
         """
         try:
-            r = requests.get(self.SERVER_URL)
+            r = self.requests.get(self.SERVER_URL)
         except requests.ConnectionError:
             return False
         else:
             return True
 
-    def upload_temperature_measurement(self, temperature_measurement):
+    def lookup_thermostat_url(self, mac):
         """
-        Upload a temperature measurement.
-        :type temperature_measurement: smart_heating_local.models.TemperatureMeasurement
-        :raise Error: If upload failed
+        Look up the server URL of a thermostat by its MAC address and cache it.
+        :type mac: str
+        :rtype: str
         """
-        mac = temperature_measurement.mac
-        device_thermostat = self.device_thermostat(mac=mac)
+        url = self.device_thermostat(mac=mac).get('thermostat').get('url')
+        self.thermostat_urls.put(mac, url)
+        return url
 
-        thermostat_url = device_thermostat.get('thermostat').get('url')
-        data = json.dumps({'datetime': temperature_measurement.date.isoformat(),
-                           'value': temperature_measurement.temperature})
+    def _post(self, mac, collection_url, data):
+        """
+        Post to a collection endpoint of a thermostat.
+
+        The thermostat URL is taken from the cache if possible. A cached URL unknown to the server is looked up
+        again once.
+        :type mac: str
+        :param collection_url: Returns the URL of the collection endpoint of a thermostat URL
+        :param data: JSON string
+        :type data: str
+        :rtype: requests.Response
+        """
         headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
 
-        r = requests.post(self.temperature_url(thermostat_url), data=data, headers=headers)
+        thermostat_url = self.thermostat_urls.get(mac)
+        cached = thermostat_url is not None
+        if not cached:
+            thermostat_url = self.lookup_thermostat_url(mac)
+
+        r = self.requests.post(collection_url(thermostat_url), data=data, headers=headers)
+        if cached and r.status_code in self.STALE_URL_STATUS_CODES:
+            self.thermostat_urls.invalidate(mac)
+            thermostat_url = self.lookup_thermostat_url(mac)
+            r = self.requests.post(collection_url(thermostat_url), data=data, headers=headers)
+        return r
+
+    def _post_measurement(self, measurement, collection_url, data):
+        """
+        Post a measurement to a collection endpoint of its thermostat.
+        :param collection_url: Returns the URL of the collection endpoint of a thermostat URL
+        :param data: The measurement as a JSON string
+        :type data: str
+        :raise Error: If upload failed
+        """
+        r = self._post(measurement.mac, collection_url, data)
 
         if not (200 <= r.status_code < 300):
             # Handle error
             default_exception = Error('Failed to upload measurement %s, Result: %s %s' %
-                                      (temperature_measurement, r.status_code, r.text))
-
+                                      (measurement, r.status_code, r.text))
             raise default_exception
 
+    def _post_bulk(self, measurements, collection_url, item):
+        """
+        Post the measurements of one thermostat as a list in one request.
+
+        A server supporting bulk uploads answers with a list of per item results like {"status": 201} in the order
+        of the posted items. Items without a status, e.g. the created measurements, count as accepted. Other servers
+        reject the list, see BULK_UNSUPPORTED_STATUS_CODES, and bulk uploads are paused for
+        Config.SERVER_BULK_RETRY_INTERVAL. The rejection may also be caused by a single invalid item.
+        :param measurements: Measurements of the same thermostat
+        :type measurements: list[smart_heating_local.models.Measurement]
+        :param collection_url: Returns the URL of the collection endpoint of a thermostat URL
+        :param item: Returns the JSON object of a measurement as a dict
+        :return: None or the error of each measurement, or None if the server rejected the bulk upload
+        :rtype: list|None
+        :raise Error: If the whole upload failed
+        """
+        r = self._post(measurements[0].mac, collection_url, json.dumps([item(measurement)
+                                                                        for measurement in measurements]))
+        if r.status_code in self.BULK_UNSUPPORTED_STATUS_CODES:
+            logging.info('The server rejected a bulk upload (%s). Uploading measurements one by one.' %
+                         r.status_code)
+            Server._bulk_rejected_until = time.monotonic() + Config.SERVER_BULK_RETRY_INTERVAL
+            return None
+        if not (200 <= r.status_code < 300):
+            raise Error('Failed to upload %s measurements, Result: %s %s' % (len(measurements), r.status_code,
+                                                                             r.text))
+
+        try:
+            results = r.json()
+        except ValueError:
+            results = None
+        if not isinstance(results, list) or len(results) != len(measurements):
+            # The server accepted the request. Uploading the measurements again could duplicate them.
+            logging.warning('Unexpected result of a bulk upload of %s measurements, counting them as uploaded: %s' %
+                            (len(measurements), r.text))
+            return [None] * len(measurements)
+
+        errors = []
+        for measurement, result in zip(measurements, results):
+            status = result.get('status') if isinstance(result, dict) else None
+            if status is None or 200 <= status < 300:
+                errors.append(None)
+            else:
+                errors.append(Error('Failed to upload measurement %s, Result: %s %s' % (measurement, status,
+                                                                                         result.get('errors'))))
+        return errors
+
+    def upload_measurements(self, measurements, collection_url, item):
+        """
+        Upload measurements with one request per thermostat if the server supports bulk uploads, or one request per
+        measurement otherwise.
+        :type measurements: list[smart_heating_local.models.Measurement]
+        :param collection_url: Returns the URL of the collection endpoint of a thermostat URL
+        :param item: Returns the JSON object of a measurement as a dict
+        :return: Generator of tuples (measurement, None or the error of its upload) as soon as the results are known
+        """
+        by_thermostat = OrderedDict()
+        for measurement in measurements:
+            by_thermostat.setdefault(measurement.mac, []).append(measurement)
+
+        for group in by_thermostat.values():
+            if Config.SERVER_BULK_UPLOAD and time.monotonic() >= Server._bulk_rejected_until and len(group) > 1:
+                try:
+                    errors = self._post_bulk(group, collection_url, item)
+                except Exception as e:
+                    errors = [e] * len(group)
+                if errors is not None:
+                    for measurement, error in zip(group, errors):
+                        yield measurement, error
+                    continue
+
+            for measurement in group:
+                try:
+                    self._post_measurement(measurement, collection_url, json.dumps(item(measurement)))
+                    error = None
+                except Exception as e:
+                    error = e
+                yield measurement, error
+
+    @staticmethod
+    def temperature_item(temperature_measurement):
+        """
+        :type temperature_measurement: smart_heating_local.models.TemperatureMeasurement
+        :return: The JSON object of a temperature measurement
+        :rtype: dict
+        """
+        return {'datetime': temperature_measurement.date.isoformat(), 'value': temperature_measurement.temperature}
+
+    @staticmethod
+    def meta_item(meta_measurement):
+        """
+        :type meta_measurement: smart_heating_local.models.MetaMeasurement
+        :return: The JSON object of a meta measurement
+        :rtype: dict
+        """
+        return {'datetime': meta_measurement.date.isoformat(), 'rssi': meta_measurement.rssi}
+
+    def upload_temperature_measurement(self, temperature_measurement):
+        """
+        Upload a temperature measurement.
+        :type temperature_measurement: smart_heating_local.models.TemperatureMeasurement
+        :raise Error: If upload failed
+        """
+        data = json.dumps(self.temperature_item(temperature_measurement))
+        self._post_measurement(temperature_measurement, self.temperature_url, data)
+
     def upload_meta_measurement(self, meta_measurement):
         """
         Upload a meta measurement.
         :type meta_measurement: smart_heating_local.models.MetaMeasurement
         :raise Error: If upload fails
         """
-        mac = meta_measurement.mac
-        device_thermostat = self.device_thermostat(mac=mac)
+        data = json.dumps(self.meta_item(meta_measurement))
+        self._post_measurement(meta_measurement, self.meta_url, data)
 
-        thermostat_url = device_thermostat.get('thermostat').get('url')
-        data = json.dumps({'datetime': meta_measurement.date.isoformat(),
-                           'rssi': meta_measurement.rssi})
-        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
-
-        r = requests.post(self.meta_url(thermostat_url), data=data, headers=headers)
+    def upload_temperature_measurements(self, temperature_measurements):
+        """
+        Upload temperature measurements, in bulk if possible.
+        :type temperature_measurements: list[smart_heating_local.models.TemperatureMeasurement]
+        :return: Generator of tuples (measurement, None or the error of its upload)
+        """
+        return self.upload_measurements(temperature_measurements, self.temperature_url, self.temperature_item)
 
-        if not (200 <= r.status_code < 300):
-            # Handle error
-            default_exception = Error('Failed to upload measurement %s, Result: %s %s' %
-                                      (meta_measurement, r.status_code, r.text))
-            raise default_exception
+    def upload_meta_measurements(self, meta_measurements):
+        """
+        Upload meta measurements, in bulk if possible.
+        :type meta_measurements: list[smart_heating_local.models.MetaMeasurement]
+        :return: Generator of tuples (measurement, None or the error of its upload)
+        """
+        return self.upload_measurements(meta_measurements, self.meta_url, self.meta_item)
 
     def get_thermostats_macs(self):
         """
@@ -161,7 +324,7 @@ class Server:
         """
         macs = []
         for rfid in self.get_thermostats_rfids():
-            r = requests.get(self.SERVER_URL + 'device/thermostat/' + rfid)
+            r = self.requests.get(self.SERVER_URL + 'device/thermostat/' + rfid)
             data = r.json()
             macs.append(data.get('mac'))
 
@@ -175,7 +338,7 @@ class Server:
         """
         raspberry_mac = self.get_local_mac_address()
         lookup_url = self.SERVER_URL + 'device/raspberry/lookup/?mac=' + raspberry_mac
-        r = requests.get(lookup_url)
+        r = self.requests.get(lookup_url)
 
         if r.status_code == 404:
             raise Exception('This raspberries MAC address has not been registered! '
@@ -200,16 +363,20 @@ class Server:
         :rtype: list[dict]
         """
         thermostats_url = room_url + 'thermostat/'
-        r = requests.get(thermostats_url)
+        r = self.requests.get(thermostats_url)
         thermostats = r.json()
         return thermostats
 
     def get_local_mac_address(self):
         """
         Capture the shell output of ifconfig and return the first found MAC address.
+        The result is cached for the lifetime of the process.
         :return: The local MAC address
         :rtype: str
         """
+        if Server._local_mac_address is not None:
+            return Server._local_mac_address
+
         out_binary = subprocess.check_output('/sbin/ifconfig', shell=True, stderr=subprocess.STDOUT)
         out = out_binary.decode('ascii')
         lines = out.split()
@@ -224,5 +391,6 @@ class Server:
             raise Exception('Could not find HWaddr in ifconfig output')
 
         mac = lines[hwaddr_index + 1]
+        Server._local_mac_address = mac
 
         return mac
@@ -14,13 +14,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import sqlite3
+import time
 import traceback
 from smart_heating_local.config import Config
+from smart_heating_local.health import health, process_max_rss, MemoryTrace
 
 from smart_heating_local.models import *
 from smart_heating_local.server import Server
 from smart_heating_local.server_models import RaspberryDevice
+from smart_heating_local.storage import get_connection
 import requests
 
 from smart_heating_local import logging
@@ -28,6 +30,15 @@ from smart_heating_local import logging
 # Maximal number of attempts to send a measurement to the server after marking it as a permanent error.
 MAX_ATTEMPTS = 5
 
+# Measurements read from the database at a time by the uploader
+UPLOAD_CHUNK_SIZE = 200
+
+# Maximal time in seconds the status updates of uploaded measurements wait for their commit
+UPLOAD_COMMIT_INTERVAL = 10
+
+# Tables of the measurements to upload
+UPLOAD_TABLES = ('heating_temperature', 'heating_rssi')
+
 
 def get_thermostat_devices():
     """
@@ -45,29 +56,35 @@ def get_thermostat_devices():
     return thermostat_devices
 
 
-def download_linked_thermostats():
+def download_linked_thermostats(thermostat_devices=None):
     """
     Load the list of associated thermostats from the server and store it in the config.
+    :param thermostat_devices: Already loaded thermostat devices. Loaded from the server if omitted.
+    :type thermostat_devices: list[ThermostatDevice]
     """
-    thermostat_devices = get_thermostat_devices()
+    if thermostat_devices is None:
+        thermostat_devices = get_thermostat_devices()
     thermostat_macs = [thermostat_device.mac for thermostat_device in thermostat_devices]
 
     Config().save_thermostat_macs(thermostat_macs)
     logging.info('Wrote downloaded thermostat MACs to config.')
 
 
-def download_heating_tables():
+def download_heating_tables(thermostat_devices=None):
     """
     Load the heating tables of the associated thermostats from the server and store them in the config.
+    :param thermostat_devices: Already loaded thermostat devices. Loaded from the server if omitted.
+    :type thermostat_devices: list[ThermostatDevice]
     """
-    thermostat_devices = get_thermostat_devices()
+    if thermostat_devices is None:
+        thermostat_devices = get_thermostat_devices()
 
     for thermostat_device in thermostat_devices:
         mac = thermostat_device.mac
         heating_table_url = thermostat_device.thermostat.heating_table_url
 
         # Request heating table
-        response = requests.get(heating_table_url)
+        response = Server.requests.get(heating_table_url)
         assert (200 <= response.status_code < 300)
         heating_table_entries = response.json()
 
@@ -78,88 +95,156 @@ def download_heating_tables():
             logging.info("New config: Heating Table for %s" % mac)
 
 
-def upload_temperatures():
+def unsent_measurements(conn, table, value_column, measurement_class, chunk_size=None):
     """
-    Upload all remaining temperature measurements to the server.
+    Page through the measurements waiting for the upload in ID order.
+
+    Each chunk is read by a separate query continuing after the last ID of the previous chunk. Only one chunk is
+    held in memory and measurements left unsent by a failed upload are not read again in the same pass.
+    :type conn: Connection
+    :param table: The table to read the measurements from
+    :type table: str
+    :param value_column: The value column of the table, e.g. 'temperature'
+    :type value_column: str
+    :param measurement_class: The measurement class to construct from the rows
+    :param chunk_size: Defaults to UPLOAD_CHUNK_SIZE
+    :type chunk_size: int
+    :return: Generator of lists of at most chunk_size measurements
+    """
+    if chunk_size is None:
+        chunk_size = UPLOAD_CHUNK_SIZE
+    # A literal status lets SQLite use the partial index on unsent rows, which is ordered by ID
+    sql = 'SELECT id, mac, timestamp, %s, status, attempts FROM %s WHERE status = %s AND id > ? ' \
+          'ORDER BY id LIMIT %d' % (value_column, table, Measurement.STATUS_NEW, chunk_size)
+    last_row_id = 0
+    while True:
+        rows = conn.execute(sql, (last_row_id,)).fetchall()
+        if len(rows) == 0:
+            return
+        last_row_id = rows[-1][0]
+        yield [measurement_class(*row[1:], row_id=row[0]) for row in rows]
+
+
+def _apply_updates(conn, update_status_sql, updates):
+    """
+    Apply the collected status updates in one transaction and clear them.
+    :type conn: Connection
+    :type update_status_sql: str
+    :type updates: list[dict]
     """
+    if len(updates) > 0:
+        conn.executemany(update_status_sql, updates)
+        conn.commit()
+        del updates[:]
 
-    with sqlite3.connect('/home/pi/smart-heating-local/data/heating.db') as conn:
-        get_temperatures_sql = 'SELECT * FROM heating_temperature WHERE status = %s' % Measurement.STATUS_NEW
-        rows = conn.execute(get_temperatures_sql).fetchall()
-        measurements = [TemperatureMeasurement(*row) for row in rows]
 
+def upload_measurements(server, table, value_column, measurement_class, upload):
+    """
+    Upload the measurements waiting in a table chunk by chunk and update their status.
+    :type server: Server
+    :param table: The table to read the measurements from
+    :type table: str
+    :param value_column: The value column of the table, e.g. 'temperature'
+    :type value_column: str
+    :param measurement_class: The measurement class to construct from the rows
+    :param upload: Uploads a chunk of measurements and yields each measurement with None or the error of its upload,
+        e.g. server.upload_temperature_measurements
+    """
+
+    with get_connection() as conn, MemoryTrace() as memory_trace:
         # Future work: improve error handling
         # Handle unlinked or invalid thermostat MACs
 
         # Test for internet connection first
-        if not Server().is_connected():
+        if not server.is_connected():
             logging.error('Could not upload. No connection to the server.')
             return
 
-        for measurement in measurements:
-            update_status_sql = 'UPDATE heating_temperature SET status=:status, attempts=attempts+1 WHERE mac=:mac AND timestamp=:date'
-            try:
-                Server().upload_temperature_measurement(measurement)
-                conn.execute(update_status_sql,
-                             {'status': Measurement.STATUS_SENT, 'mac': measurement.mac, 'date': measurement.date})
-                conn.commit()
-                logging.info('upload successful: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
-            except requests.ConnectionError as e:
-                # Log connection error but don't mark it as a permanent error
-                conn.execute(update_status_sql,
-                             {'status': Measurement.STATUS_NEW, 'mac': measurement.mac, 'date': measurement.date})
-                conn.commit()
-                logging.error('Could not upload: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
-                logging.error('%s: %s' % (e.__class__.__name__, e))
-            except Exception as e:
-                # Increase attempts. Mark as permanent error after to many attempts.
-                status = Measurement.STATUS_NEW if measurement.attempts < MAX_ATTEMPTS else Measurement.STATUS_ERROR
-                conn.execute(update_status_sql, {'status': status, 'mac': measurement.mac, 'date': measurement.date})
-                conn.commit()
-                logging.error('Could not upload: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
-                logging.error(traceback.format_exc())
+        # Look up the row by its ID. The columns guard against an ID reused in the meantime.
+        update_status_sql = 'UPDATE %s SET status=:status, attempts=attempts+1 ' \
+                            'WHERE id=:row_id AND mac=:mac AND timestamp=:timestamp' % table
+        # Status updates of the current chunk. They are only collected after the server responded, so a crash
+        # loses acknowledgements and uploads the measurements again, but never marks an unsent measurement as sent.
+        updates = []
+        url_cache = server.thermostat_urls
+        hits = url_cache.hits
+        misses = url_cache.misses
+        uploaded = 0
+        errors = 0
+        chunks = 0
+        started = time.monotonic()
+        last_commit = started
+        for measurements in unsent_measurements(conn, table, value_column, measurement_class):
+            chunks += 1
+            for measurement, error in upload(measurements):
+                if error is None:
+                    status = Measurement.STATUS_SENT
+                    uploaded += 1
+                    logging.info('upload successful: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
+                elif isinstance(error, requests.ConnectionError):
+                    # Log connection error but don't mark it as a permanent error
+                    status = Measurement.STATUS_NEW
+                    errors += 1
+                    logging.error('Could not upload: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
+                    logging.error('%s: %s' % (error.__class__.__name__, error))
+                else:
+                    # Increase attempts. Mark as permanent error after to many attempts.
+                    status = Measurement.STATUS_NEW if measurement.attempts < MAX_ATTEMPTS else Measurement.STATUS_ERROR
+                    errors += 1
+                    logging.error('Could not upload: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
+                    logging.error(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+                updates.append({'status': status, 'row_id': measurement.row_id, 'mac': measurement.mac,
+                                'timestamp': measurement.timestamp})
+
+                # Do not keep acknowledgements of slow uploads waiting for the end of the chunk
+                if time.monotonic() - last_commit >= UPLOAD_COMMIT_INTERVAL:
+                    _apply_updates(conn, update_status_sql, updates)
+                    last_commit = time.monotonic()
+            _apply_updates(conn, update_status_sql, updates)
+            last_commit = time.monotonic()
+
+        url_cache.save()
+        peak = memory_trace.peak()
+        health.upload_finished(table, uploaded, errors, time.monotonic() - started, peak)
+
+        hits = url_cache.hits - hits
+        lookups = hits + url_cache.misses - misses
+        logging.info('Uploaded %s and failed %s measurements of %s in %s chunks. Peak memory of the pass %.1f KiB. '
+                     'Process max RSS %.1f MiB. Thermostat URL cache hit rate %.0f %% of %s lookups' % (
+                         uploaded, errors, table, chunks, peak / 1024, process_max_rss() / 1024 / 1024,
+                         100.0 * hits / lookups if lookups > 0 else 0, lookups))
 
 
-def upload_meta_data():
+def upload_temperatures():
     """
-    Upload all remaining meta data entries to the server.
+    Upload all remaining temperature measurements to the server.
     """
+    server = Server()
+    upload_measurements(server, 'heating_temperature', 'temperature', TemperatureMeasurement,
+                        server.upload_temperature_measurements)
 
-    with sqlite3.connect('/home/pi/smart-heating-local/data/heating.db') as conn:
-        get_meta_sql = 'SELECT * FROM heating_rssi WHERE status = %s' % Measurement.STATUS_NEW
-        rows = conn.execute(get_meta_sql).fetchall()
-        measurements = [MetaMeasurement(*row) for row in rows]
 
-        # Future work: improve error handling
-        # Handle unlinked or invalid thermostat MACs
+def upload_meta_data():
+    """
+    Upload all remaining meta data entries to the server.
+    """
+    server = Server()
+    upload_measurements(server, 'heating_rssi', 'rssi', MetaMeasurement, server.upload_meta_measurements)
 
-        # Test for internet connection first
-        if not Server().is_connected():
-            logging.error('Could not upload. No connection to the server.')
-            return
 
-        for measurement in measurements:
-            update_status_sql = 'UPDATE heating_rssi SET status=:status, attempts=attempts+1 WHERE mac=:mac AND timestamp=:date'
-            try:
-                Server().upload_meta_measurement(measurement)
-                conn.execute(update_status_sql,
-                             {'status': Measurement.STATUS_SENT, 'mac': measurement.mac, 'date': measurement.date})
-                conn.commit()
-                logging.info('upload successful: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
-            except requests.ConnectionError as e:
-                # Log connection error but don't mark it as a permanent error
-                conn.execute(update_status_sql,
-                             {'status': Measurement.STATUS_NEW, 'mac': measurement.mac, 'date': measurement.date})
-                conn.commit()
-                logging.error('Could not upload: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
-                logging.error('%s: %s' % (e.__class__.__name__, e))
-            except Exception as e:
-                # Increase attempts. Mark as permanent error after to many attempts.
-                status = Measurement.STATUS_NEW if measurement.attempts < MAX_ATTEMPTS else Measurement.STATUS_ERROR
-                conn.execute(update_status_sql, {'status': status, 'mac': measurement.mac, 'date': measurement.date})
-                conn.commit()
-                logging.error('Could not upload: %s. Attempt #%s' % (repr(measurement), measurement.attempts))
-                logging.error(traceback.format_exc())
+def get_upload_backlog():
+    """
+    Count the measurements waiting for the upload.
+    :return: Table -> number of measurements with status STATUS_NEW
+    :rtype: dict
+    """
+    backlog = {}
+    with get_connection() as conn:
+        for table in UPLOAD_TABLES:
+            # A literal status lets SQLite use the partial index on unsent rows
+            backlog[table] = conn.execute('SELECT COUNT(*) FROM %s WHERE status = %s' % (
+                table, Measurement.STATUS_NEW)).fetchone()[0]
+    return backlog
 
 
 def main():
@@ -168,5 +253,9 @@ def main():
     """
     upload_temperatures()
     upload_meta_data()
-    download_linked_thermostats()
-    download_heating_tables()
+
+    # Look up the associated thermostats once for both downloads
+    thermostat_devices = get_thermostat_devices()
+    download_linked_thermostats(thermostat_devices)
+    download_heating_tables(thermostat_devices)
+    health.synchronized('server')
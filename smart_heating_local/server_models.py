@@ -14,7 +14,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import requests
+from smart_heating_local.http_session import session
 
 
 class Model(object):
@@ -32,8 +32,8 @@ class RaspberryDevice(Model):
     RESOURCE_URL = 'device/raspberry/'
     LOOKUP_MAC_SUFFIX_PATTERN = 'lookup?mac={mac}'
 
-    # Attribute to allow dependency injection
-    requests = requests
+    # Shared keep-alive session. Attribute to allow dependency injection.
+    requests = session
 
     def __init__(self, json):
         self.__json = json
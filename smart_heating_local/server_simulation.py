@@ -0,0 +1,185 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+COLLECTIONS = ('temperature', 'meta_entry')
+
+_COLLECTION_PATH = re.compile(r'^/thermostat/(\d+)/(%s)/$' % '|'.join(COLLECTIONS))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive like the real server
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one segment, unbuffered writes are delayed by Nagle's algorithm on keep-alive connections
+    wbufsize = -1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status_code, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def do_GET(self):
+        simulated = self.server.simulated
+        simulated.count_request()
+        url = urlparse(self.path)
+        if url.path == '/':
+            self._respond(200, {})
+        elif url.path == '/device/thermostat/lookup/':
+            mac = parse_qs(url.query).get('mac', [''])[0]
+            self._respond(200, {'mac': mac, 'thermostat': {'url': simulated.thermostat_url(mac)}})
+        else:
+            self._respond(404, {'detail': 'Not found.'})
+
+    def do_POST(self):
+        simulated = self.server.simulated
+        simulated.count_request()
+        content = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        match = _COLLECTION_PATH.match(urlparse(self.path).path)
+        if match is None:
+            self._respond(404, {'detail': 'Not found.'})
+        elif isinstance(content, dict):
+            errors = simulated.validate(content)
+            if errors is None:
+                simulated.receive(int(match.group(1)), match.group(2), content)
+            self._respond(201 if errors is None else 400, content if errors is None else errors)
+        elif not simulated.bulk:
+            self._respond(400, {'non_field_errors': ['Invalid data. Expected a dictionary, but got list.']})
+        elif simulated.echo:
+            # Like a list serializer, all items are saved or none
+            errors = [simulated.validate(item) for item in content]
+            if any(errors):
+                self._respond(400, [{} if error is None else error for error in errors])
+            else:
+                for item in content:
+                    simulated.receive(int(match.group(1)), match.group(2), item)
+                self._respond(201, content)
+        else:
+            results = []
+            for item in content:
+                errors = simulated.validate(item)
+                if errors is None:
+                    simulated.receive(int(match.group(1)), match.group(2), item)
+                    results.append({'status': 201})
+                else:
+                    results.append({'status': 400, 'errors': errors})
+            self._respond(200, results)
+
+
+class SimulatedServer(object):
+    """
+    A local HTTP server answering the thermostat lookups and measurement uploads of the uploader.
+
+    Bulk uploads post a list of measurements to a collection and are answered with one result {"status": 201} per
+    measurement. Without bulk support lists are rejected like by the real server.
+    """
+
+    def __init__(self, bulk=True, echo=False, latency=0.0, reject=None):
+        """
+        :param bulk: Whether lists of measurements are accepted
+        :type bulk: bool
+        :param echo: Answer bulk uploads with the created measurements instead of per item results, and reject the
+            whole list if a measurement is invalid
+        :type echo: bool
+        :param latency: Seconds each request is delayed, e.g. to simulate a mobile connection
+        :type latency: float
+        :param reject: Returns True for measurement dictionaries answered with 400 Bad Request
+        """
+        self.bulk = bulk
+        self.echo = echo
+        self.latency = latency
+        self.reject = reject
+        self.requests = 0
+        # (thermostat ID, collection) -> list of received measurement dictionaries
+        self.received = {}
+        self._thermostat_ids = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        :return: Base URL of the running server, to be used as Server.SERVER_URL
+        :rtype: str
+        """
+        host, port = self._server.server_address
+        return 'http://%s:%s/' % (host, port)
+
+    def thermostat_url(self, mac):
+        """
+        :type mac: str
+        :return: The URL of the thermostat with a MAC address, numbered in the order of the first lookup
+        :rtype: str
+        """
+        with self._lock:
+            thermostat_id = self._thermostat_ids.setdefault(mac, len(self._thermostat_ids) + 1)
+        return '%sthermostat/%s/' % (self.url, thermostat_id)
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def validate(self, item):
+        """
+        :return: None or the validation errors of a measurement
+        :rtype: dict|None
+        """
+        if 'datetime' not in item:
+            return {'datetime': ['This field is required.']}
+        if self.reject is not None and self.reject(item):
+            return {'non_field_errors': ['Rejected.']}
+        return None
+
+    def receive(self, thermostat_id, collection, item):
+        """
+        Store a valid measurement.
+        """
+        with self._lock:
+            self.received.setdefault((thermostat_id, collection), []).append(item)
+
+    def start(self):
+        """
+        Listen on an ephemeral port of the loopback interface.
+        """
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _RequestHandler)
+        self._server.simulated = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
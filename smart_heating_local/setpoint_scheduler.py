@@ -0,0 +1,156 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+from asyncio.tasks import async
+from datetime import datetime, timedelta
+
+from smart_heating_local.config import Config
+from smart_heating_local.schedule import compile_schedule
+from smart_heating_local import thermostat_controller
+from smart_heating_local import logging
+
+
+class SetpointScheduler(object):
+    """
+    Pushes the scheduled target temperature to a thermostat when its heating schedule transitions, instead of
+    checking every thermostat each cycle.
+
+    Between transitions, each thermostat only wakes up to check its locally stored heating table for changes,
+    which costs no radio traffic. Mode and target temperature are verified on the thermostat once per
+    reconciliation interval.
+    """
+
+    def __init__(self, check_interval=None, reconcile_interval=None, retry_delay=None):
+        """
+        :param check_interval: Seconds between two checks of the heating tables. Defaults to
+        Config.SETPOINT_CHECK_INTERVAL.
+        :param reconcile_interval: Seconds between two verifications of a thermostat. Defaults to
+        Config.SETPOINT_RECONCILE_INTERVAL.
+        :param retry_delay: Seconds to wait after a failed push. Defaults to Config.SETPOINT_RETRY_DELAY.
+        """
+        self.check_interval = timedelta(
+            seconds=Config.SETPOINT_CHECK_INTERVAL if check_interval is None else check_interval)
+        self.reconcile_interval = timedelta(
+            seconds=Config.SETPOINT_RECONCILE_INTERVAL if reconcile_interval is None else reconcile_interval)
+        self.retry_delay = timedelta(seconds=Config.SETPOINT_RETRY_DELAY if retry_delay is None else retry_delay)
+
+        # mac -> Task running the thermostats schedule
+        self.tasks = {}
+        # mac -> last target temperature confirmed by the thermostat
+        self.pushed = {}
+        # mac -> datetime of the last successful verification
+        self.reconciled = {}
+
+        self.pushes = 0
+        self.reconciliations = 0
+
+    @asyncio.coroutine
+    def run(self):
+        """
+        Run the schedules of the configured thermostats until cancelled.
+        Runs async.
+        """
+        try:
+            while True:
+                macs = set(thermostat.mac for thermostat in thermostat_controller.get_thermostats())
+                for mac in macs.difference(self.tasks):
+                    self.tasks[mac] = async(self._run_thermostat(mac))
+                for mac in set(self.tasks).difference(macs):
+                    self.tasks.pop(mac).cancel()
+                yield from asyncio.sleep(self.check_interval.total_seconds())
+        finally:
+            for task in self.tasks.values():
+                task.cancel()
+            self.tasks.clear()
+
+    @asyncio.coroutine
+    def _run_thermostat(self, mac):
+        """
+        Update a thermostat and sleep until it needs to be updated again, until cancelled.
+        Runs async.
+        :type mac: str
+        """
+        while True:
+            now = datetime.now()
+            try:
+                wake = yield from self.update(mac, now)
+            except Exception as e:
+                logging.error('Setpoint update of %s failed' % mac)
+                logging.exception(e)
+                wake = now + self.retry_delay
+            yield from asyncio.sleep(max(0, (wake - datetime.now()).total_seconds()))
+
+    @asyncio.coroutine
+    def update(self, mac, now):
+        """
+        Push the scheduled target temperature if it differs from the last pushed one or a verification is due.
+        Runs async.
+        :type mac: str
+        :type now: datetime
+        :return: When the thermostat needs to be updated next
+        :rtype: datetime
+        """
+        schedule = compile_schedule(Config().get_heating_table(mac))
+        target = schedule.temperature_at(now)
+        if target is None:
+            return now + self.check_interval
+
+        reconcile = mac not in self.reconciled or now - self.reconciled[mac] >= self.reconcile_interval
+        if reconcile or self.pushed.get(mac) != target:
+            success = yield from self.push(mac, target, reconcile)
+            if not success:
+                return now + self.retry_delay
+            if reconcile:
+                self.reconciled[mac] = now
+
+        return min(now + self.check_interval,
+                   schedule.next_transition(now),
+                   self.reconciled[mac] + self.reconcile_interval)
+
+    @asyncio.coroutine
+    def push(self, mac, target, reconcile):
+        """
+        Set the target temperature of a thermostat and, on reconciliation, its mode.
+        Runs async.
+        :type mac: str
+        :type target: float
+        :type reconcile: bool
+        :return: Whether the thermostat confirmed the target
+        :rtype: bool
+        """
+        if reconcile:
+            self.reconciliations += 1
+            # Verify the thermostat instead of trusting the cached state
+            thermostat_controller.device_state.invalidate(mac)
+            mode = yield from thermostat_controller.set_target_mode(mac)
+            if not mode.ok:
+                logging.error('Failed: %r' % mode)
+                return False
+
+        self.pushes += 1
+        result = yield from thermostat_controller.set_target_temperature(mac, target)
+        if not result.ok:
+            logging.error('Failed: %r' % result)
+            return False
+
+        self.pushed[mac] = target
+        thermostat_controller.device_state.save()
+        return True
+
+    def __repr__(self):
+        return '<SetpointScheduler thermostats:"%s" pushes:"%s" reconciliations:"%s">' % (
+            len(self.tasks), self.pushes, self.reconciliations)
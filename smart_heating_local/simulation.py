@@ -0,0 +1,213 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import random
+
+import aiocoap.resource
+from aiocoap import Context, Message, CONTENT, CHANGED, NOT_FOUND, BAD_REQUEST
+
+
+class SimulatedThermostat(object):
+    """
+    State of a virtual thermostat.
+    """
+    __slots__ = ('mac', 'temperature', 'mode', 'target', 'uptime', 'rssi', 'slowness', 'requests')
+
+    def __init__(self, mac, slowness=1.0):
+        """
+        :type mac: str
+        :param slowness: Factor applied to the latency of the fleet
+        :type slowness: float
+        """
+        self.mac = mac
+        self.temperature = 21.5
+        self.mode = 'manual'
+        self.target = 18.0
+        self.uptime = 100
+        self.rssi = -60.0
+        self.slowness = slowness
+        self.requests = 0
+
+    def get(self, path):
+        """
+        :type path: tuple
+        :return: The payload of the resource or None if it does not exist
+        :rtype: str|None
+        """
+        if path == ('sensors', 'temperature'):
+            return str(self.temperature)
+        if path == ('debug', 'heartbeat'):
+            return 'version:1,uptime:%s,rssi:%s' % (self.uptime, self.rssi)
+        if path == ('set', 'mode'):
+            return self.mode
+        if path == ('set', 'target'):
+            return str(self.target)
+        return None
+
+    def put(self, path, payload):
+        """
+        :type path: tuple
+        :type payload: str
+        :return: Whether the resource exists and accepted the payload
+        :rtype: bool
+        """
+        if path == ('set', 'mode'):
+            self.mode = payload
+            return True
+        if path == ('set', 'target'):
+            try:
+                self.target = float(payload)
+            except ValueError:
+                return False
+            return True
+        return False
+
+    def __repr__(self):
+        return '<SimulatedThermostat mac:"%s" mode:"%s" target:"%s" requests:"%s">' % (
+            self.mac, self.mode, self.target, self.requests)
+
+
+class ThermostatResource(aiocoap.resource.CoAPResource):
+    """
+    Serves all resources of a virtual thermostat.
+    """
+    isLeaf = True
+
+    def __init__(self, fleet, thermostat):
+        """
+        :type fleet: SimulatedFleet
+        :type thermostat: SimulatedThermostat
+        """
+        super(ThermostatResource, self).__init__()
+        self.fleet = fleet
+        self.thermostat = thermostat
+
+    @asyncio.coroutine
+    def render_GET(self, request):
+        self.thermostat.requests += 1
+        yield from self.fleet.delay(self.thermostat)
+        payload = self.thermostat.get(tuple(request.postpath))
+        if payload is None:
+            return Message(code=NOT_FOUND)
+        return Message(code=CONTENT, payload=payload.encode('utf-8'))
+
+    @asyncio.coroutine
+    def render_PUT(self, request):
+        self.thermostat.requests += 1
+        yield from self.fleet.delay(self.thermostat)
+        path = tuple(request.postpath)
+        if self.thermostat.get(path) is None:
+            return Message(code=NOT_FOUND)
+        if not self.thermostat.put(path, str(request.payload, 'utf-8')):
+            return Message(code=BAD_REQUEST)
+        return Message(code=CHANGED)
+
+
+class LossyContext(Context):
+    """
+    CoAP server context dropping received datagrams with the loss probability of its fleet.
+    """
+    fleet = None
+
+    def datagram_received(self, data, address):
+        if self.fleet is not None and self.fleet.random.random() < self.fleet.loss:
+            self.fleet.dropped += 1
+            return
+        super(LossyContext, self).datagram_received(data, address)
+
+
+class SimulatedFleet(object):
+    """
+    Virtual thermostats served on the IPv6 loopback address, standing in for the thermostats behind the border
+    router.
+
+    Each thermostat has its own CoAP server on a consecutive port, so the client treats them as separate endpoints
+    like real thermostats. The thermostat controller reaches them once registry.coap_url is replaced by
+    SimulatedFleet.coap_url and the thermostat registry is cleared.
+    """
+
+    def __init__(self, macs, port=56830, latency=0.0, loss=0.0, slowness=None, seed=None):
+        """
+        :type macs: List[str]
+        :param port: UDP port of the first thermostat
+        :param latency: Mean seconds a thermostat takes to answer. Each answer takes between 0.5 and 1.5 times the
+        mean.
+        :type latency: float
+        :param loss: Probability of a received datagram to be dropped
+        :type loss: float
+        :param slowness: mac -> factor applied to the latency of single thermostats
+        :type slowness: dict
+        :param seed: Seed of the random generator for reproducible runs
+        """
+        slowness = slowness or {}
+        self.latency = latency
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.thermostats = dict((mac, SimulatedThermostat(mac, slowness.get(mac, 1.0))) for mac in macs)
+        # mac -> UDP port
+        self.ports = dict((mac, port + index) for index, mac in enumerate(macs))
+        self.contexts = []
+        self.dropped = 0
+
+    def coap_url(self, mac):
+        """
+        Replacement for registry.coap_url.
+        :type mac: str
+        :rtype: str
+        """
+        return 'coap://[::1]:%s' % self.ports[mac]
+
+    def thermostat(self, mac):
+        """
+        :rtype: SimulatedThermostat
+        """
+        return self.thermostats[mac]
+
+    @asyncio.coroutine
+    def delay(self, thermostat):
+        """
+        Wait for the simulated latency of a thermostat.
+        Runs async.
+        :type thermostat: SimulatedThermostat
+        """
+        latency = self.latency * thermostat.slowness
+        if latency > 0:
+            yield from asyncio.sleep(latency * (0.5 + self.random.random()))
+
+    @asyncio.coroutine
+    def start(self):
+        """
+        Start serving the fleet.
+        Runs async.
+        """
+        for mac, thermostat in self.thermostats.items():
+            site = aiocoap.resource.Site(ThermostatResource(self, thermostat))
+            context = yield from LossyContext.create_server_context(site, bind=('::1', self.ports[mac]))
+            context.fleet = self
+            self.contexts.append(context)
+
+    def stop(self):
+        """
+        Stop serving the fleet.
+        """
+        for context in self.contexts:
+            context.shutdown()
+        self.contexts = []
+
+    def __repr__(self):
+        return '<SimulatedFleet thermostats:"%s" latency:"%s" loss:"%s" dropped:"%s">' % (
+            len(self.thermostats), self.latency, self.loss, self.dropped)
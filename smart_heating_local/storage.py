@@ -0,0 +1,238 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sqlite3
+import threading
+
+from smart_heating_local.config import Config
+from smart_heating_local.metrics import CREATE_EXCHANGE_TABLE_SQL, create_exchange_table
+from smart_heating_local.models import Measurement
+
+# Applied to each new connection. In WAL mode readers and the writer do not block each other and NORMAL
+# synchronization only syncs at checkpoints, which spares the SD card.
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    # Negative values are KiB
+    'PRAGMA cache_size=-4096',
+    'PRAGMA temp_store=MEMORY',
+)
+
+# Seconds to wait for a lock held by another connection
+BUSY_TIMEOUT = 30
+
+# Tables of measurements and of their hourly and daily aggregates, see retention. Timestamps are microseconds since
+# the epoch. The uploader pages through the measurements by their ID, which is declared, so a VACUUM keeps it.
+MEASUREMENT_TABLE_SQL = "CREATE TABLE IF NOT EXISTS %s (" \
+                        "id INTEGER PRIMARY KEY," \
+                        "mac CHAR(20) NOT NULL," \
+                        "timestamp INTEGER NOT NULL," \
+                        "%s REAL NOT NULL," \
+                        "status INTEGER NOT NULL," \
+                        "attempts INTEGER NOT NULL DEFAULT 0);"
+AGGREGATE_TABLE_SQL = "CREATE TABLE IF NOT EXISTS %s (" \
+                      "mac CHAR(20) NOT NULL," \
+                      "timestamp INTEGER NOT NULL," \
+                      "resolution INTEGER NOT NULL," \
+                      "minimum REAL NOT NULL," \
+                      "maximum REAL NOT NULL," \
+                      "total REAL NOT NULL," \
+                      "count INTEGER NOT NULL);"
+
+# Converts a local time text timestamp like '2016-01-01 10:05:00.000001' to microseconds since the epoch
+EPOCH_SQL = "CASE WHEN typeof(timestamp) = 'text' " \
+            "THEN CAST(strftime('%s', timestamp, 'utc') AS INTEGER) * 1000000 + " \
+            "CAST(substr(timestamp, 21, 6) AS INTEGER) " \
+            "ELSE timestamp END"
+
+
+def _rebuild(table, create_sql, columns):
+    """
+    :return: Statements replacing a table by a table of the given schema with epoch timestamps
+    :rtype: tuple
+    """
+    temporary = table + '_migration'
+    return (
+        'DROP TABLE IF EXISTS %s' % temporary,
+        create_sql.replace(table, temporary, 1),
+        'INSERT INTO %s (mac, timestamp, %s) SELECT mac, %s, %s FROM %s ORDER BY rowid' % (
+            temporary, columns, EPOCH_SQL, columns, table),
+        'DROP TABLE %s' % table,
+        'ALTER TABLE %s RENAME TO %s' % (temporary, table),
+    )
+
+
+# Schema migrations applied in order by migrate(). PRAGMA user_version holds the number of applied migrations.
+# Each migration runs in one transaction. The version is stored afterwards, so the statements must be idempotent.
+MIGRATIONS = (
+    # 1: Partial indexes on the upload queue. The uploader updates rows by their row ID, so no index on
+    # (mac, timestamp) is needed.
+    (
+        'CREATE INDEX IF NOT EXISTS heating_temperature_unsent ON heating_temperature (status) '
+        'WHERE status = %s' % Measurement.STATUS_NEW,
+        'CREATE INDEX IF NOT EXISTS heating_rssi_unsent ON heating_rssi (status) '
+        'WHERE status = %s' % Measurement.STATUS_NEW,
+    ),
+    # 2: Indexes for queries of the aggregated history. Switch to incremental vacuum, which needs a full VACUUM of
+    # existing databases. VACUUM may renumber row IDs, which the uploader guards against.
+    (
+        'CREATE INDEX IF NOT EXISTS heating_temperature_aggregates_mac ON heating_temperature_aggregates '
+        '(mac, timestamp)',
+        'CREATE INDEX IF NOT EXISTS heating_rssi_aggregates_mac ON heating_rssi_aggregates (mac, timestamp)',
+        'PRAGMA auto_vacuum = INCREMENTAL',
+        'VACUUM',
+    ),
+    # 3: Integer epoch timestamps and REAL values instead of text timestamps. Rebuilds the tables and their indexes.
+    _rebuild('heating_temperature', MEASUREMENT_TABLE_SQL % ('heating_temperature', 'temperature'),
+             'temperature, status, attempts') +
+    _rebuild('heating_rssi', MEASUREMENT_TABLE_SQL % ('heating_rssi', 'rssi'), 'rssi, status, attempts') +
+    _rebuild('heating_temperature_aggregates', AGGREGATE_TABLE_SQL % 'heating_temperature_aggregates',
+             'resolution, minimum, maximum, total, count') +
+    _rebuild('heating_rssi_aggregates', AGGREGATE_TABLE_SQL % 'heating_rssi_aggregates',
+             'resolution, minimum, maximum, total, count') +
+    (
+        'CREATE INDEX IF NOT EXISTS heating_temperature_unsent ON heating_temperature (status) '
+        'WHERE status = %s' % Measurement.STATUS_NEW,
+        'CREATE INDEX IF NOT EXISTS heating_rssi_unsent ON heating_rssi (status) '
+        'WHERE status = %s' % Measurement.STATUS_NEW,
+        'CREATE INDEX IF NOT EXISTS heating_temperature_aggregates_mac ON heating_temperature_aggregates '
+        '(mac, timestamp)',
+        'CREATE INDEX IF NOT EXISTS heating_rssi_aggregates_mac ON heating_rssi_aggregates (mac, timestamp)',
+    ),
+    # 4: Integer epoch timestamps of the CoAP exchange aggregates, comparable with those of the measurements
+    _rebuild('heating_coap_exchanges', CREATE_EXCHANGE_TABLE_SQL,
+             'path, requests, successes, error_responses, timeouts, exceptions, latency_sum, latency_max, histogram, '
+             'error_codes'),
+    # 5: Declared IDs of the measurements, the row IDs the uploader has paged through so far. Inserting the rowid
+    # column of the rebuilt table sets its ID.
+    _rebuild('heating_temperature', MEASUREMENT_TABLE_SQL % ('heating_temperature', 'temperature'),
+             'rowid, temperature, status, attempts') +
+    _rebuild('heating_rssi', MEASUREMENT_TABLE_SQL % ('heating_rssi', 'rssi'), 'rowid, rssi, status, attempts') +
+    (
+        'CREATE INDEX IF NOT EXISTS heating_temperature_unsent ON heating_temperature (status) '
+        'WHERE status = %s' % Measurement.STATUS_NEW,
+        'CREATE INDEX IF NOT EXISTS heating_rssi_unsent ON heating_rssi (status) '
+        'WHERE status = %s' % Measurement.STATUS_NEW,
+    ),
+)
+
+# Connections of the current thread by database path
+_local = threading.local()
+
+# All open connections, closed by close_connections()
+_connections = []
+_connections_lock = threading.Lock()
+
+# Incremented by close_connections(), so threads know their connections have been closed
+_generation = 0
+
+
+def create_tables(conn):
+    """
+    Creates the required database table in case they do not exist.
+    :param conn: The sqlite3 connection
+    :rtype conn: Connection
+    """
+
+    # Make sure local tables are available
+    conn.execute(MEASUREMENT_TABLE_SQL % ('heating_temperature', 'temperature'))
+    conn.execute(MEASUREMENT_TABLE_SQL % ('heating_rssi', 'rssi'))
+    conn.execute(AGGREGATE_TABLE_SQL % 'heating_temperature_aggregates')
+    conn.execute(AGGREGATE_TABLE_SQL % 'heating_rssi_aggregates')
+    create_exchange_table(conn)
+    conn.commit()
+    migrate(conn)
+
+
+def migrate(conn):
+    """
+    Apply the pending schema migrations.
+    :type conn: Connection
+    :return: The number of applied migrations
+    :rtype: int
+    """
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    # Manage the transactions explicitly. The sqlite3 module of Python 3.4 would commit before each DDL statement.
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for index in range(version, len(MIGRATIONS)):
+            conn.execute('BEGIN')
+            try:
+                for statement in MIGRATIONS[index]:
+                    # VACUUM cannot run in a transaction
+                    if statement != 'VACUUM':
+                        conn.execute(statement).fetchall()
+                conn.execute('COMMIT')
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            if 'VACUUM' in MIGRATIONS[index]:
+                conn.execute('VACUUM')
+            conn.execute('PRAGMA user_version = %d' % (index + 1))
+    finally:
+        conn.isolation_level = isolation_level
+    return max(0, len(MIGRATIONS) - version)
+
+
+def connect(path):
+    """
+    Open a new tuned connection and make sure the tables exist.
+    :type path: str
+    :rtype: Connection
+    """
+    # Connections are only used by the thread that opened them, but closed by close_connections()
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma).fetchall()
+    create_tables(conn)
+    return conn
+
+
+def get_connection(path=None):
+    """
+    Return the connection of the current thread to the database, opening it on first use.
+
+    Use it as a context manager to commit or roll back a transaction. Do not close it.
+    :param path: Defaults to Config.DATABASE_PATH
+    :type path: str
+    :rtype: Connection
+    """
+    if path is None:
+        path = Config.DATABASE_PATH
+    if getattr(_local, 'generation', None) != _generation:
+        _local.connections = {}
+        _local.generation = _generation
+    connections = _local.connections
+
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = connect(path)
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+def close_connections():
+    """
+    Close the connections of all threads, e.g. before the process exits.
+    """
+    global _generation
+    with _connections_lock:
+        for conn in _connections:
+            conn.close()
+        del _connections[:]
+        _generation += 1
@@ -0,0 +1,122 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from smart_heating_local.config import Config
+from smart_heating_local.models import Measurement, TemperatureMeasurement
+from smart_heating_local import server_controller
+from smart_heating_local.server import Server
+from smart_heating_local.server_simulation import SimulatedServer
+from smart_heating_local.storage import get_connection, close_connections
+from smart_heating_local.url_cache import ThermostatUrlCache
+
+MACS = ['2e:ff:ff:00:22:%02x' % index for index in range(3)]
+
+
+class BulkUploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.simulated = None
+        Server._bulk_rejected_until = 0
+
+    def tearDown(self):
+        Server._bulk_rejected_until = 0
+        if self.simulated is not None:
+            self.simulated.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def start(self, **kwargs):
+        """
+        :return: A server client talking to a new simulated server
+        :rtype: Server
+        """
+        self.simulated = SimulatedServer(**kwargs)
+        self.simulated.start()
+        server = Server()
+        server.SERVER_URL = self.simulated.url
+        server.thermostat_urls = ThermostatUrlCache(path=os.path.join(self.temp_dir, 'thermostat_urls'))
+        return server
+
+    @staticmethod
+    def measurements(count):
+        return [TemperatureMeasurement(MACS[index % len(MACS)], 1451606400000000 + index, 20.0 + index,
+                                       Measurement.STATUS_NEW, 0, row_id=index + 1) for index in range(count)]
+
+    def test_bulk_upload_posts_once_per_thermostat(self):
+        server = self.start()
+        measurements = self.measurements(30)
+
+        results = list(server.upload_temperature_measurements(measurements))
+
+        self.assertEqual(sorted(measurement.row_id for measurement, error in results), list(range(1, 31)))
+        self.assertEqual([error for measurement, error in results], [None] * 30)
+        # One lookup and one post per thermostat
+        self.assertEqual(self.simulated.requests, 6)
+        self.assertEqual([len(items) for items in self.simulated.received.values()], [10, 10, 10])
+
+    def test_created_measurements_count_as_uploaded(self):
+        server = self.start(echo=True)
+
+        results = list(server.upload_temperature_measurements(self.measurements(30)))
+
+        self.assertEqual([error for measurement, error in results], [None] * 30)
+        self.assertEqual(self.simulated.requests, 6)
+        self.assertEqual(sum(len(items) for items in self.simulated.received.values()), 30)
+
+    def test_falls_back_to_single_uploads(self):
+        server = self.start(bulk=False)
+
+        results = list(server.upload_temperature_measurements(self.measurements(30)))
+
+        self.assertEqual([error for measurement, error in results], [None] * 30)
+        # The rejected bulk upload is not tried again for the other thermostats
+        self.assertEqual(self.simulated.requests, 3 + 1 + 30)
+        self.assertGreater(Server._bulk_rejected_until, time.monotonic())
+
+        # Tried again after the retry interval
+        Server._bulk_rejected_until = time.monotonic()
+        self.simulated.bulk = True
+        list(server.upload_temperature_measurements(self.measurements(30)))
+        self.assertEqual(self.simulated.requests, 34 + 3)
+
+    def test_item_errors_are_applied_to_their_rows(self):
+        database_path = Config.DATABASE_PATH
+        Config.DATABASE_PATH = os.path.join(self.temp_dir, 'heating.db')
+        try:
+            conn = get_connection()
+            with conn:
+                conn.executemany('INSERT INTO heating_temperature (mac, timestamp, temperature, status, attempts) '
+                                 'VALUES (:mac, :timestamp, :temperature, :status, :attempts)',
+                                 [dict(mac=measurement.mac, timestamp=measurement.timestamp,
+                                       temperature=measurement.temperature, status=measurement.status,
+                                       attempts=measurement.attempts) for measurement in self.measurements(30)])
+            server = self.start(reject=lambda item: item['value'] in (25.0, 26.0))
+
+            server_controller.upload_measurements(server, 'heating_temperature', 'temperature',
+                                                  TemperatureMeasurement, server.upload_temperature_measurements)
+
+            self.assertEqual(conn.execute('SELECT temperature FROM heating_temperature WHERE status = %s' %
+                                          Measurement.STATUS_NEW).fetchall(), [(25.0,), (26.0,)])
+            self.assertEqual(conn.execute('SELECT SUM(attempts) FROM heating_temperature').fetchone()[0], 30)
+            self.assertEqual(self.simulated.requests, 1 + 3 + 3)
+        finally:
+            Config.DATABASE_PATH = database_path
+            close_connections()
@@ -0,0 +1,71 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import unittest
+from smart_heating_local.daemon import Daemon, Job
+
+
+class DaemonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.active = 0
+        self.max_active = 0
+
+    @asyncio.coroutine
+    def slow_job(self):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        yield from asyncio.sleep(0.03)
+        self.active -= 1
+
+    def test_jobs_do_not_overlap(self):
+        job = Job('slow', self.slow_job, interval=0.01)
+        daemon = Daemon([job], loop=self.loop)
+        self.loop.call_later(0.1, daemon.stop)
+        self.loop.run_until_complete(daemon.run())
+
+        self.assertGreaterEqual(job.runs, 2)
+        self.assertEqual(self.max_active, 1)
+
+    def test_failing_and_blocking_jobs_keep_running(self):
+        def fail():
+            raise Exception('expected')
+
+        job = Job('failing', fail, interval=0.01, blocking=True)
+        daemon = Daemon([job], loop=self.loop)
+        self.loop.call_later(0.05, daemon.stop)
+        self.loop.run_until_complete(daemon.run())
+
+        self.assertGreaterEqual(job.runs, 2)
+
+    def test_services_are_cancelled_on_stop(self):
+        cancelled = []
+
+        @asyncio.coroutine
+        def service():
+            try:
+                yield from asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        daemon = Daemon([Job('slow', self.slow_job, interval=0.01)], [service], loop=self.loop)
+        self.loop.call_later(0.05, daemon.stop)
+        self.loop.run_until_complete(daemon.run())
+
+        self.assertEqual(cancelled, [True])
@@ -0,0 +1,67 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import unittest
+from smart_heating_local.device_state import DeviceStateCache
+
+
+class DeviceStateCacheTestCase(unittest.TestCase):
+
+    TEMP_DIR = 'temp'
+    STATE_PATH = TEMP_DIR + '/test_device_state'
+    MAC = '2e:ff:ff:00:22:8b'
+
+    def setUp(self):
+        if not os.path.exists(self.TEMP_DIR):
+            os.mkdir(self.TEMP_DIR)
+        self.now = 1000.0
+        self.cache = self.create_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.TEMP_DIR)
+
+    def create_cache(self):
+        return DeviceStateCache(path=self.STATE_PATH, ttl=60, clock=lambda: self.now)
+
+    def test_ttl(self):
+        self.cache.confirm(self.MAC, DeviceStateCache.TARGET, 21.5)
+        self.now += 60
+        self.assertEqual(self.cache.get(self.MAC, DeviceStateCache.TARGET), 21.5)
+        self.now += 1
+        self.assertIsNone(self.cache.get(self.MAC, DeviceStateCache.TARGET))
+
+    def test_invalidate(self):
+        self.cache.confirm(self.MAC, DeviceStateCache.MODE, 'radio target')
+        self.cache.confirm(self.MAC, DeviceStateCache.TARGET, 21.5)
+        self.cache.invalidate(self.MAC, DeviceStateCache.TARGET)
+        self.assertEqual(self.cache.get(self.MAC, DeviceStateCache.MODE), 'radio target')
+        self.assertIsNone(self.cache.get(self.MAC, DeviceStateCache.TARGET))
+
+    def test_reboot_forgets_state(self):
+        self.cache.update_uptime(self.MAC, '100')
+        self.cache.confirm(self.MAC, DeviceStateCache.TARGET, 21.5)
+        self.cache.update_uptime(self.MAC, '200')
+        self.assertEqual(self.cache.get(self.MAC, DeviceStateCache.TARGET), 21.5)
+
+        self.cache.update_uptime(self.MAC, '5')
+        self.assertIsNone(self.cache.get(self.MAC, DeviceStateCache.TARGET))
+
+    def test_persistence(self):
+        self.cache.confirm(self.MAC, DeviceStateCache.TARGET, 21.5)
+        self.cache.save()
+        self.assertEqual(self.create_cache().get(self.MAC, DeviceStateCache.TARGET), 21.5)
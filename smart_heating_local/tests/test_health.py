@@ -0,0 +1,86 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import unittest
+from smart_heating_local.health import HealthMetrics, MetricsServer, render_metrics
+from smart_heating_local.metrics import ExchangeStatistics, OUTCOME_SUCCESS, OUTCOME_TIMEOUT
+
+
+class HealthTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.health = HealthMetrics()
+        self.health.cycle_finished(12.5, 2)
+        self.health.upload_finished('heating_temperature', 10, 1, 3.0)
+        self.health.job_failed('server_sync')
+        self.health.synchronized('thermostat')
+
+        statistics = ExchangeStatistics()
+        statistics.add(OUTCOME_SUCCESS, 0.2)
+        statistics.add(OUTCOME_TIMEOUT, 93.0)
+        self.totals = {'/sensors/temperature': statistics}
+
+    def test_render_metrics(self):
+        lines = render_metrics(self.health, self.totals, {'heating_temperature': 42}).splitlines()
+
+        self.assertIn('smart_heating_cycle_duration_seconds_sum 12.5', lines)
+        self.assertIn('smart_heating_device_failures_total 2.0', lines)
+        self.assertIn('smart_heating_coap_requests_total{path="/sensors/temperature",outcome="timeout"} 1.0', lines)
+        self.assertIn('smart_heating_coap_request_duration_seconds_bucket{path="/sensors/temperature",le="0.25"} 1.0',
+                      lines)
+        self.assertIn('smart_heating_coap_request_duration_seconds_bucket{path="/sensors/temperature",le="+Inf"} 2.0',
+                      lines)
+        self.assertIn('smart_heating_upload_backlog{table="heating_temperature"} 42.0', lines)
+        self.assertIn('smart_heating_uploads_total{table="heating_temperature"} 10.0', lines)
+        self.assertIn('smart_heating_job_failures_total{job="server_sync"} 1.0', lines)
+        self.assertTrue(any(line.startswith('smart_heating_process_max_rss_bytes ') for line in lines))
+        self.assertTrue(any(line.startswith('smart_heating_last_success_timestamp_seconds{sync="thermostat"}')
+                            for line in lines))
+
+    def test_snapshot(self):
+        snapshot = self.health.snapshot()
+        self.health.upload_finished('heating_rssi', 5, 0, 1.0)
+
+        self.assertEqual(snapshot.uploads, {'heating_temperature': 10})
+        self.assertEqual(snapshot.cycles, 1)
+
+    def test_metrics_server(self):
+        loop = asyncio.get_event_loop()
+        server = MetricsServer(lambda backlog: render_metrics(self.health, self.totals, backlog),
+                               query=lambda: {'heating_rssi': 7}, host='127.0.0.1', port=56861)
+
+        @asyncio.coroutine
+        def scrape(path):
+            reader, writer = yield from asyncio.open_connection('127.0.0.1', 56861)
+            writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path).encode('latin-1'))
+            response = yield from reader.read()
+            writer.close()
+            return response.decode('utf-8')
+
+        task = asyncio.async(server.run())
+        try:
+            loop.run_until_complete(asyncio.sleep(0.05))
+            response = loop.run_until_complete(scrape('/metrics'))
+            self.assertTrue(response.startswith('HTTP/1.0 200 OK'))
+            self.assertIn('smart_heating_cycle_duration_seconds_count 1.0', response)
+            self.assertIn('smart_heating_upload_backlog{table="heating_rssi"} 7.0', response)
+
+            self.assertTrue(loop.run_until_complete(scrape('/')).startswith('HTTP/1.0 404'))
+        finally:
+            task.cancel()
+            loop.run_until_complete(asyncio.wait([task]))
+        self.assertEqual(server.scrapes, 1)
@@ -0,0 +1,124 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import socket
+import threading
+import unittest
+import requests
+from requests.adapters import BaseAdapter
+from smart_heating_local import http_session
+from smart_heating_local.http_session import create_session, TimeoutSession
+from smart_heating_local.server import Server
+from smart_heating_local.server_models import RaspberryDevice
+
+
+class RecordingAdapter(BaseAdapter):
+    """
+    Answers every request with an empty JSON object and records the keyword arguments of the requests.
+    """
+
+    def __init__(self):
+        super(RecordingAdapter, self).__init__()
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append((request, kwargs))
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{}'
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class DroppingServer(object):
+    """
+    Reads each request and closes the connection without a response.
+    """
+
+    def __init__(self):
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(5)
+        self.socket.settimeout(0.1)
+        self.url = 'http://127.0.0.1:%s/' % self.socket.getsockname()[1]
+        self.requests = []
+        self.stopped = False
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        while not self.stopped:
+            try:
+                connection, address = self.socket.accept()
+            except socket.timeout:
+                continue
+            connection.settimeout(1)
+            self.requests.append(connection.recv(65536).split(b' ', 1)[0])
+            connection.close()
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join()
+        self.socket.close()
+
+
+class HttpSessionTestCase(unittest.TestCase):
+
+    def test_adapter_is_configured(self):
+        session = create_session(pool_size=2, timeout=5, retries=4, backoff=0.1)
+        adapter = session.get_adapter('http://example.com/')
+
+        self.assertEqual(adapter._pool_maxsize, 2)
+        self.assertEqual((adapter.max_retries.total, adapter.max_retries.backoff_factor), (4, 0.1))
+
+    def test_posts_are_not_repeated_after_a_lost_response(self):
+        server = DroppingServer()
+        session = create_session(timeout=1, retries=3, backoff=0)
+        try:
+            self.assertRaises(requests.ConnectionError, session.post, server.url, data='{}')
+            self.assertEqual(server.requests, [b'POST'])
+
+            del server.requests[:]
+            self.assertRaises(requests.ConnectionError, session.get, server.url)
+            self.assertEqual(server.requests, [b'GET'] * 4)
+        finally:
+            server.stop()
+
+    def test_default_timeout(self):
+        session = TimeoutSession(timeout=(1, 2))
+        adapter = RecordingAdapter()
+        session.mount('http://', adapter)
+
+        session.get('http://example.com/')
+        session.get('http://example.com/', timeout=7)
+        self.assertEqual([kwargs['timeout'] for request, kwargs in adapter.sent], [(1, 2), 7])
+
+    def test_server_communication_shares_the_session(self):
+        self.assertIs(Server.requests, http_session.session)
+        self.assertIs(RaspberryDevice.requests, http_session.session)
+
+        session = TimeoutSession(timeout=1)
+        adapter = RecordingAdapter()
+        session.mount('http://', adapter)
+        Server.requests = session
+        try:
+            self.assertTrue(Server().is_connected())
+        finally:
+            Server.requests = http_session.session
+        self.assertEqual(adapter.sent[0][0].url, Server.SERVER_URL)
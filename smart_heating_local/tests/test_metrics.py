@@ -0,0 +1,62 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sqlite3
+import unittest
+from smart_heating_local.metrics import *
+
+
+class ExchangeMetricsTestCase(unittest.TestCase):
+
+    MAC = '2e:ff:ff:00:22:8b'
+
+    def setUp(self):
+        self.metrics = ExchangeMetrics()
+
+    def test_statistics(self):
+        statistics = ExchangeStatistics()
+        statistics.add(OUTCOME_SUCCESS, 0.02)
+        statistics.add(OUTCOME_SUCCESS, 0.3)
+        statistics.add(OUTCOME_ERROR, 0.04, '4.04')
+        statistics.add(OUTCOME_TIMEOUT, 93.0)
+
+        self.assertEqual((statistics.requests, statistics.successes, statistics.error_responses,
+                          statistics.timeouts, statistics.exceptions), (4, 2, 1, 1, 0))
+        self.assertEqual(statistics.error_codes, {'4.04': 1})
+        self.assertEqual(statistics.buckets[0], 2)
+        self.assertEqual(statistics.buckets[-1], 1)
+        self.assertEqual(statistics.latency_max, 93.0)
+        self.assertEqual(statistics.percentile(0.5), 0.05)
+        self.assertEqual(statistics.percentile(1.0), 93.0)
+
+    def test_flush_and_query(self):
+        conn = sqlite3.connect(':memory:')
+        create_exchange_table(conn)
+        self.metrics.record(self.MAC, '/sensors/temperature', OUTCOME_SUCCESS, 0.1)
+        self.metrics.record(self.MAC, '/sensors/temperature', OUTCOME_SUCCESS, 0.3)
+        self.metrics.record(self.MAC, '/set/target', OUTCOME_EXCEPTION, 0.0)
+
+        self.assertEqual(self.metrics.flush(conn, 1451606400000000), 2)
+        self.assertEqual(self.metrics.statistics, {})
+        self.metrics.record(self.MAC, '/sensors/temperature', OUTCOME_TIMEOUT, 90.0)
+        self.metrics.flush(conn, 1451607300000000)
+
+        rows = query_exchanges(conn, mac=self.MAC, path='/sensors/temperature')
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][:5], (1451606400000000, self.MAC, '/sensors/temperature', 2, 2))
+        self.assertAlmostEqual(rows[0][8], 0.2)
+        self.assertEqual(rows[1][6], 1)
+        self.assertEqual(len(query_exchanges(conn, since=1451607000000000)), 1)
@@ -0,0 +1,53 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+from smart_heating_local.models import *
+
+
+class DeviceResultTestCase(unittest.TestCase):
+
+    def test_ok(self):
+        self.assertTrue(TemperatureReading('2e:ff:ff:00:22:8b', '2016-01-01 00:00:00.0', 21.5).ok)
+        self.assertFalse(TemperatureReading('2e:ff:ff:00:22:8b', '2016-01-01 00:00:00.0', error='no response').ok)
+
+    def test_slots(self):
+        reading = HeartbeatReading('2e:ff:ff:00:22:8b', '2016-01-01 00:00:00.0', rssi=-60.0)
+        with self.assertRaises(AttributeError):
+            reading.unknown = 1
+
+    def test_repr(self):
+        result = TargetResult('2e:ff:ff:00:22:8b', 'now', target=21.0, changed=True)
+        self.assertEqual(repr(result), '<TargetResult mac:"2e:ff:ff:00:22:8b" timestamp:"now" error:"None" '
+                                       'target:"21.0" changed:"True">')
+
+
+class MeasurementTestCase(unittest.TestCase):
+
+    def test_epoch_round_trip(self):
+        moment = datetime(2016, 7, 1, 12, 30, 15, 123456)
+        self.assertEqual(from_epoch(to_epoch(moment)), moment)
+
+    def test_date_is_converted_lazily(self):
+        measurement = TemperatureMeasurement('2e:ff:ff:00:22:8b', to_epoch(datetime(2016, 1, 1, 10)), 21.5,
+                                             Measurement.STATUS_NEW, 0, row_id=1)
+        self.assertIsNone(measurement._date)
+        # Measurements are logged on every upload
+        self.assertIn('timestamp:"%s"' % measurement.timestamp, repr(measurement))
+        self.assertIsNone(measurement._date)
+        self.assertEqual(measurement.date, datetime(2016, 1, 1, 10))
+        with self.assertRaises(AttributeError):
+            measurement.unknown = 1
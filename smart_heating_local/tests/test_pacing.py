@@ -0,0 +1,97 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import time
+import unittest
+from smart_heating_local.pacing import DevicePacer, RequestWindow
+
+
+class DevicePacerTestCase(unittest.TestCase):
+
+    GAP = 0.1
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.pacer = DevicePacer(gap=self.GAP)
+        self.started = []
+
+    @asyncio.coroutine
+    def request(self, mac):
+        yield from self.pacer.acquire(mac)
+        try:
+            self.started.append((mac, time.monotonic()))
+        finally:
+            self.pacer.release(mac)
+
+    def test_same_device_is_paced(self):
+        self.loop.run_until_complete(asyncio.gather(self.request('a'), self.request('a')))
+
+        (_, first), (_, second) = self.started
+        self.assertGreaterEqual(second - first, self.GAP * 0.9)
+        self.assertEqual(self.pacer.paced_requests, 1)
+
+    def test_other_devices_are_not_paced(self):
+        self.pacer.start_cycle()
+        self.loop.run_until_complete(asyncio.gather(*[self.request(mac) for mac in 'abcdef']))
+
+        self.assertEqual(self.pacer.paced_requests, 0)
+        self.assertLess(self.pacer.cycle_time(), self.GAP)
+
+
+class RequestWindowTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.peak = 0
+
+    @asyncio.coroutine
+    def request(self, window, timed_out=False):
+        yield from window.acquire()
+        try:
+            self.peak = max(self.peak, window.in_flight)
+            yield from asyncio.sleep(0.01)
+        finally:
+            window.release(timed_out)
+
+    def test_in_flight_requests_are_bounded(self):
+        window = RequestWindow(limit=3, adaptive=False)
+        self.loop.run_until_complete(asyncio.gather(*[self.request(window) for _ in range(10)]))
+
+        self.assertEqual(self.peak, 3)
+        self.assertEqual(window.queued_requests, 7)
+        self.assertEqual(window.in_flight, 0)
+
+    def test_adaptive_limit(self):
+        window = RequestWindow(limit=8, adaptive=True, min_limit=2)
+
+        self.loop.run_until_complete(asyncio.gather(*[self.request(window, timed_out=True) for _ in range(3)]))
+        self.assertEqual(window.limit, 2)
+
+        self.loop.run_until_complete(asyncio.gather(*[self.request(window) for _ in range(4)]))
+        self.assertGreater(window.limit, 2)
+        self.assertLessEqual(window.limit, 8)
+
+    def test_cancelled_waiter_frees_its_place(self):
+        window = RequestWindow(limit=1, adaptive=False)
+        self.loop.run_until_complete(window.acquire())
+        waiter = asyncio.async(window.acquire())
+        self.loop.run_until_complete(asyncio.sleep(0))
+        waiter.cancel()
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+        window.release()
+        self.assertEqual(window.in_flight, 0)
@@ -0,0 +1,79 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import ipaddress
+import os
+import shutil
+import tempfile
+import unittest
+from smart_heating_local.config import Config
+from smart_heating_local import registry
+from smart_heating_local.registry import Thermostat, ThermostatRegistry
+
+
+class ThermostatRegistryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.config_path = Config.CONFIG_PATH
+        Config.CONFIG_PATH = os.path.join(self.temp_dir, 'config')
+        self.coap_url = registry.coap_url
+        registry.coap_url = lambda mac: 'coap://[::%s]' % mac
+        self.registry = ThermostatRegistry()
+
+    def tearDown(self):
+        Config.CONFIG_PATH = self.config_path
+        registry.coap_url = self.coap_url
+        shutil.rmtree(self.temp_dir)
+
+    def test_uris(self):
+        thermostat = Thermostat('a', 'coap://[fdfd::1]')
+
+        self.assertEqual(thermostat.temperature_uri, 'coap://[fdfd::1]/sensors/temperature')
+        self.assertEqual(thermostat.heartbeat_uri, 'coap://[fdfd::1]/debug/heartbeat')
+        self.assertEqual(thermostat.mode_uri, 'coap://[fdfd::1]/set/mode')
+        self.assertEqual(thermostat.target_uri, 'coap://[fdfd::1]/set/target')
+        self.assertEqual(thermostat.address, ipaddress.IPv6Address('fdfd::1'))
+
+    def test_runtime_state(self):
+        thermostat = Thermostat('a', 'coap://[fdfd::1]')
+        thermostat.request_finished(False)
+        thermostat.request_finished(False)
+        self.assertEqual(thermostat.failure_streak, 2)
+
+        thermostat.request_finished(True, 0.2)
+        self.assertEqual((thermostat.failure_streak, thermostat.last_rtt), (0, 0.2))
+
+    def test_reloaded_only_after_change(self):
+        self.assertIsNone(self.registry.thermostats())
+
+        Config().save_thermostat_macs(['a', 'b'])
+        thermostats = self.registry.thermostats()
+        self.assertEqual([thermostat.mac for thermostat in thermostats], ['a', 'b'])
+        self.assertIs(self.registry.thermostats(), thermostats)
+
+        thermostats[0].failure_streak = 3
+        Config().save_thermostat_macs(['b', 'a', 'c'])
+        thermostats = self.registry.thermostats()
+        self.assertEqual([thermostat.mac for thermostat in thermostats], ['b', 'a', 'c'])
+        # Runtime state survives the reload
+        self.assertEqual(self.registry.get('a').failure_streak, 3)
+
+    def test_clear(self):
+        self.assertEqual(self.registry.get('a').address, ipaddress.IPv6Address('::a'))
+        registry.coap_url = lambda mac: 'coap://[::1]:5683'
+        self.registry.clear()
+        self.assertEqual(self.registry.get('a').url, 'coap://[::1]:5683')
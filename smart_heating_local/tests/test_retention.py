@@ -0,0 +1,105 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from smart_heating_local.config import Config
+from smart_heating_local.models import Measurement, to_epoch
+from smart_heating_local import retention
+from smart_heating_local.retention import RESOLUTION_HOUR, RESOLUTION_DAY, query_measurements
+from smart_heating_local.storage import get_connection, close_connections
+
+MAC = '2e:ff:ff:00:22:8b'
+
+
+class RetentionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.database_path = Config.DATABASE_PATH
+        Config.DATABASE_PATH = os.path.join(self.temp_dir, 'heating.db')
+        self.conn = get_connection()
+
+        rows = [
+            (datetime(2016, 1, 1, 10, 5, 0, 1), 20.0, Measurement.STATUS_SENT),
+            (datetime(2016, 1, 1, 10, 20, 0, 1), 22.0, Measurement.STATUS_SENT),
+            (datetime(2016, 1, 1, 10, 35, 0, 1), 30.0, Measurement.STATUS_NEW),
+            (datetime(2016, 1, 1, 11, 5, 0, 1), 21.0, Measurement.STATUS_ERROR),
+            (datetime(2016, 1, 2, 9, 5, 0, 1), 19.0, Measurement.STATUS_SENT),
+            (datetime(2016, 3, 1, 12, 0, 0, 1), 18.0, Measurement.STATUS_SENT),
+        ]
+        with self.conn:
+            self.conn.executemany('INSERT INTO heating_temperature (mac, timestamp, temperature, status) '
+                                  'VALUES (?, ?, ?, ?)', ((MAC, to_epoch(moment), value, status)
+                                                         for moment, value, status in rows))
+
+    def tearDown(self):
+        Config.DATABASE_PATH = self.database_path
+        close_connections()
+        shutil.rmtree(self.temp_dir)
+
+    def test_roll_up_keeps_new_and_recent_measurements(self):
+        with self.conn:
+            deleted = retention.roll_up(self.conn, 'heating_temperature', 'temperature',
+                                         to_epoch(datetime(2016, 2, 1)))
+        self.assertEqual(deleted, 4)
+
+        remaining = self.conn.execute('SELECT temperature FROM heating_temperature ORDER BY timestamp').fetchall()
+        self.assertEqual(remaining, [(30.0,), (18.0,)])
+        self.assertEqual(query_measurements(self.conn, 'heating_temperature', MAC,
+                                            until=to_epoch(datetime(2016, 1, 1, 11))), [
+            (to_epoch(datetime(2016, 1, 1, 10)), MAC, RESOLUTION_HOUR, 20.0, 22.0, 21.0, 2),
+            (to_epoch(datetime(2016, 1, 1, 10, 35, 0, 1)), MAC, 0, 30.0, 30.0, 30.0, 1),
+        ])
+
+    def test_queries_combine_raw_measurements_and_aggregates(self):
+        expected = [
+            (to_epoch(datetime(2016, 1, 1)), MAC, RESOLUTION_DAY, 20.0, 30.0, 23.25, 4),
+            (to_epoch(datetime(2016, 1, 2)), MAC, RESOLUTION_DAY, 19.0, 19.0, 19.0, 1),
+            (to_epoch(datetime(2016, 3, 1)), MAC, RESOLUTION_DAY, 18.0, 18.0, 18.0, 1),
+        ]
+        self.assertEqual(query_measurements(self.conn, 'heating_temperature', MAC, resolution=RESOLUTION_DAY),
+                         expected)
+
+        retention.main(now=datetime(2016, 3, 15))
+        self.assertEqual(query_measurements(self.conn, 'heating_temperature', MAC, resolution=RESOLUTION_DAY),
+                         expected)
+
+        # Merge all hourly aggregates into daily aggregates
+        Config.RETENTION_HOURLY_AGE, hourly_age = 0, Config.RETENTION_HOURLY_AGE
+        try:
+            retention.main(now=datetime(2016, 3, 15))
+        finally:
+            Config.RETENTION_HOURLY_AGE = hourly_age
+        self.assertEqual(query_measurements(self.conn, 'heating_temperature', MAC, resolution=RESOLUTION_DAY),
+                         expected)
+        self.assertEqual(self.conn.execute('SELECT DISTINCT resolution FROM heating_temperature_aggregates')
+                         .fetchall(), [(RESOLUTION_DAY,)])
+
+    def test_vacuum_frees_pages(self):
+        self.assertEqual(self.conn.execute('PRAGMA auto_vacuum').fetchone()[0], 2)
+        with self.conn:
+            self.conn.executemany('INSERT INTO heating_rssi (mac, timestamp, rssi, status) VALUES (?, ?, ?, ?)',
+                                  ((MAC, to_epoch(datetime(2016, 1, 1)) + i, -70.0, Measurement.STATUS_SENT)
+                                   for i in range(5000)))
+        with self.conn:
+            retention.roll_up(self.conn, 'heating_rssi', 'rssi', to_epoch(datetime(2016, 2, 1)))
+
+        self.assertGreater(retention.vacuum(self.conn), 0)
+        self.assertEqual(self.conn.execute('PRAGMA freelist_count').fetchone()[0], 0)
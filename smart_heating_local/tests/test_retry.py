@@ -0,0 +1,126 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import unittest
+
+import aiocoap.error
+from aiocoap import Code, Message
+
+from smart_heating_local import thermostat_controller
+from smart_heating_local.retry import RetryPolicy
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+
+    def test_delay_grows_exponentially_up_to_max(self):
+        policy = RetryPolicy(max_attempts=10, base_delay=1, max_delay=5, deadline=100, random=lambda: 1.0)
+
+        self.assertEqual([policy.delay(attempt) for attempt in range(1, 6)], [1, 2, 4, 5, 5])
+
+    def test_delay_is_jittered(self):
+        policy = RetryPolicy(base_delay=4, max_delay=30, random=lambda: 0.25)
+
+        self.assertEqual(policy.delay(2), 2)
+
+    def test_next_delay_respects_attempts_and_deadline(self):
+        policy = RetryPolicy(max_attempts=3, base_delay=1, max_delay=10, deadline=100, random=lambda: 1.0)
+
+        self.assertEqual(policy.next_delay(1, 100), 1)
+        self.assertIsNone(policy.next_delay(3, 100))
+        self.assertIsNone(policy.next_delay(2, 1.5))
+
+    def test_only_server_errors_are_retryable(self):
+        policy = RetryPolicy()
+
+        self.assertFalse(policy.is_retryable_code(4.04))
+        self.assertTrue(policy.is_retryable_code(5.03))
+
+
+class CoapRequestRetryTestCase(unittest.TestCase):
+
+    MAC = '00:11:22:33:44:55'
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.outcomes = []
+        self.requests = 0
+
+        self._coap_request = thermostat_controller._coap_request
+        self.retry_policy = thermostat_controller.retry_policy
+        self.gap = thermostat_controller.pacer.gap
+        thermostat_controller._coap_request = self.fake_request
+        thermostat_controller.retry_policy = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.01,
+                                                         deadline=5)
+        thermostat_controller.pacer.gap = 0
+        thermostat_controller.retry_statistics.clear()
+        thermostat_controller.registry.clear()
+
+    def tearDown(self):
+        thermostat_controller._coap_request = self._coap_request
+        thermostat_controller.retry_policy = self.retry_policy
+        thermostat_controller.pacer.gap = self.gap
+        thermostat_controller.retry_statistics.clear()
+        thermostat_controller.registry.clear()
+
+    @asyncio.coroutine
+    def fake_request(self, url, method, payload=None):
+        self.requests += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Message(code=outcome, payload='21.5')
+
+    def request(self):
+        return self.loop.run_until_complete(
+            thermostat_controller.coap_request(self.MAC, 'coap://[::1]/sensors/temperature', Code.GET))
+
+    def test_timeout_is_retried(self):
+        self.outcomes = [aiocoap.error.RequestTimedOut(), Code.CONTENT]
+
+        response = self.request()
+
+        self.assertEqual(response.code, Code.CONTENT)
+        statistics = thermostat_controller.retry_statistics[self.MAC]
+        self.assertEqual((statistics.operations, statistics.attempts, statistics.timeouts), (1, 2, 1))
+        self.assertEqual(statistics.retries, 1)
+
+    def test_server_error_is_retried_until_max_attempts(self):
+        self.outcomes = [Code.SERVICE_UNAVAILABLE] * 3
+
+        response = self.request()
+
+        self.assertEqual(response.code, Code.SERVICE_UNAVAILABLE)
+        self.assertEqual(self.requests, 3)
+        self.assertEqual(thermostat_controller.retry_statistics[self.MAC].error_responses, 3)
+
+    def test_client_error_is_not_retried(self):
+        self.outcomes = [Code.NOT_FOUND, Code.CONTENT]
+
+        response = self.request()
+
+        self.assertEqual(response.code, Code.NOT_FOUND)
+        self.assertEqual(self.requests, 1)
+        self.assertEqual(thermostat_controller.retry_statistics[self.MAC].error_responses, 1)
+        self.assertEqual(thermostat_controller.registry.get(self.MAC).failure_streak, 1)
+
+    def test_deadline_stops_retries(self):
+        thermostat_controller.retry_policy = RetryPolicy(max_attempts=10, base_delay=1, max_delay=1, deadline=0.5,
+                                                         random=lambda: 1.0)
+        self.outcomes = [aiocoap.error.RequestTimedOut()] * 10
+
+        self.assertIsNone(self.request())
+        self.assertEqual(self.requests, 1)
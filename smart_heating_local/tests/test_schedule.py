@@ -0,0 +1,61 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import unittest
+from datetime import datetime
+from smart_heating_local.schedule import HeatingSchedule, compile_schedule
+
+
+class HeatingScheduleTestCase(unittest.TestCase):
+
+    # 2016-01-04 is a Monday
+    heating_table = [
+        {'day': 0, 'time': '06:00:00', 'temperature': 21.0},
+        {'day': 0, 'time': '22:00:00', 'temperature': 17.0},
+        {'day': 4, 'time': '07:30:00', 'temperature': 22.5},
+    ]
+
+    def setUp(self):
+        self.schedule = compile_schedule(self.heating_table)
+
+    def test_temperature_at(self):
+        self.assertEqual(self.schedule.temperature_at(datetime(2016, 1, 4, 6, 0)), 21.0)
+        self.assertEqual(self.schedule.temperature_at(datetime(2016, 1, 4, 21, 59)), 21.0)
+        self.assertEqual(self.schedule.temperature_at(datetime(2016, 1, 5, 12, 0)), 17.0)
+        self.assertEqual(self.schedule.temperature_at(datetime(2016, 1, 8, 7, 30)), 22.5)
+
+    def test_temperature_at_wraps_around(self):
+        # Before the first entry of the week, the last entry of the previous week applies
+        self.assertEqual(self.schedule.temperature_at(datetime(2016, 1, 4, 5, 59)), 22.5)
+
+    def test_next_transition(self):
+        self.assertEqual(self.schedule.next_transition(datetime(2016, 1, 4, 6, 0, 30)), datetime(2016, 1, 4, 22, 0))
+        self.assertEqual(self.schedule.next_transition(datetime(2016, 1, 5, 12, 0)), datetime(2016, 1, 8, 7, 30))
+        self.assertEqual(self.schedule.next_transition(datetime(2016, 1, 9, 12, 0)), datetime(2016, 1, 11, 6, 0))
+
+    def test_unordered_entries(self):
+        schedule = HeatingSchedule([(4, '07:30', 22.5), (0, '06:00', 21.0)])
+        self.assertEqual(schedule.temperature_at(datetime(2016, 1, 4, 12, 0)), 21.0)
+
+    def test_empty(self):
+        schedule = compile_schedule([])
+        self.assertIsNone(schedule.temperature_at(datetime(2016, 1, 4)))
+        self.assertIsNone(schedule.next_transition(datetime(2016, 1, 4)))
+
+    def test_cached_by_content(self):
+        self.assertIs(compile_schedule(list(self.heating_table)), self.schedule)
+        changed = self.heating_table + [{'day': 6, 'time': '10:00:00', 'temperature': 20.0}]
+        self.assertIsNot(compile_schedule(changed), self.schedule)
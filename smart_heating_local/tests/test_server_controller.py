@@ -0,0 +1,127 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import tempfile
+import tracemalloc
+import unittest
+import requests
+from smart_heating_local.config import Config
+from smart_heating_local.health import health
+from smart_heating_local.models import Measurement, TemperatureMeasurement
+from smart_heating_local import server_controller
+from smart_heating_local.storage import get_connection, close_connections
+from smart_heating_local.url_cache import ThermostatUrlCache
+
+MAC = '2e:ff:ff:00:22:8b'
+
+
+class FakeServer(object):
+    """
+    Records uploads and fails them for some temperatures.
+    """
+
+    def __init__(self, url_cache_path, crash_at=None):
+        self.thermostat_urls = ThermostatUrlCache(path=url_cache_path)
+        self.uploaded = []
+        # Temperature at which the process is interrupted
+        self.crash_at = crash_at
+
+    def is_connected(self):
+        return True
+
+    def upload_temperature_measurements(self, measurements):
+        for measurement in measurements:
+            if measurement.temperature == self.crash_at:
+                raise KeyboardInterrupt()
+            if measurement.temperature == -1.0:
+                yield measurement, requests.ConnectionError('unreachable')
+            elif measurement.temperature == -2.0:
+                yield measurement, Exception('rejected')
+            else:
+                self.uploaded.append(measurement.temperature)
+                yield measurement, None
+
+
+class UploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.database_path = Config.DATABASE_PATH
+        Config.DATABASE_PATH = os.path.join(self.temp_dir, 'heating.db')
+        self.url_cache_path = os.path.join(self.temp_dir, 'thermostat_urls')
+        self.conn = get_connection()
+
+        with self.conn:
+            self.conn.executemany('INSERT INTO heating_temperature (mac, timestamp, temperature, status, attempts) '
+                                  'VALUES (?, ?, ?, ?, ?)',
+                                  [(MAC, index, float(index), Measurement.STATUS_NEW, 0) for index in range(20)] +
+                                  [(MAC, 20, -1.0, Measurement.STATUS_NEW, 0),
+                                   (MAC, 21, -2.0, Measurement.STATUS_NEW, server_controller.MAX_ATTEMPTS),
+                                   (MAC, 22, 99.0, Measurement.STATUS_SENT, 1)])
+
+    def tearDown(self):
+        Config.DATABASE_PATH = self.database_path
+        close_connections()
+        shutil.rmtree(self.temp_dir)
+
+    def test_unsent_measurements_are_read_in_chunks(self):
+        chunks = list(server_controller.unsent_measurements(self.conn, 'heating_temperature', 'temperature',
+                                                            TemperatureMeasurement, chunk_size=8))
+
+        self.assertEqual([len(chunk) for chunk in chunks], [8, 8, 6])
+        self.assertEqual([measurement.temperature for measurement in chunks[0]], [float(i) for i in range(8)])
+        self.assertEqual(chunks[2][-1].attempts, server_controller.MAX_ATTEMPTS)
+
+        plan = self.conn.execute('EXPLAIN QUERY PLAN SELECT id FROM heating_temperature WHERE status = %s AND '
+                                 'id > 0 ORDER BY id LIMIT 8' % Measurement.STATUS_NEW).fetchall()
+        self.assertIn('heating_temperature_unsent', ' '.join(str(row[-1]) for row in plan))
+
+    def upload(self, server):
+        chunk_size = server_controller.UPLOAD_CHUNK_SIZE
+        server_controller.UPLOAD_CHUNK_SIZE = 8
+        try:
+            server_controller.upload_measurements(server, 'heating_temperature', 'temperature',
+                                                  TemperatureMeasurement, server.upload_temperature_measurements)
+        finally:
+            server_controller.UPLOAD_CHUNK_SIZE = chunk_size
+
+    def test_upload_updates_status(self):
+        server = FakeServer(self.url_cache_path)
+        self.upload(server)
+
+        self.assertEqual(server.uploaded, [float(i) for i in range(20)])
+        statuses = dict(self.conn.execute('SELECT temperature, status FROM heating_temperature').fetchall())
+        self.assertEqual(statuses[0.0], Measurement.STATUS_SENT)
+        self.assertEqual(statuses[-1.0], Measurement.STATUS_NEW)
+        self.assertEqual(statuses[-2.0], Measurement.STATUS_ERROR)
+        self.assertEqual(server_controller.get_upload_backlog()['heating_temperature'], 1)
+
+    def test_interrupted_upload_only_keeps_committed_chunks(self):
+        self.assertRaises(KeyboardInterrupt, self.upload, FakeServer(self.url_cache_path, crash_at=10.0))
+
+        sent = self.conn.execute('SELECT temperature FROM heating_temperature WHERE status = %s ORDER BY id' %
+                                 Measurement.STATUS_SENT).fetchall()
+        self.assertEqual(sent, [(float(i),) for i in range(8)] + [(99.0,)])
+        self.assertEqual(self.conn.execute('SELECT MAX(attempts) FROM heating_temperature WHERE temperature = 9.0')
+                         .fetchone()[0], 0)
+
+    def test_peak_memory_of_the_pass_is_traced(self):
+        self.upload(FakeServer(self.url_cache_path))
+
+        self.assertGreater(health.upload_peak_memory.pop('heating_temperature'), 0)
+        self.assertFalse(tracemalloc.is_tracing())
@@ -0,0 +1,92 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import os
+import shutil
+import unittest
+from datetime import datetime, timedelta
+from smart_heating_local.config import Config
+from smart_heating_local.setpoint_scheduler import SetpointScheduler
+
+
+class RecordingScheduler(SetpointScheduler):
+    """
+    Records pushes instead of sending them to a thermostat.
+    """
+
+    def __init__(self, **kwargs):
+        super(RecordingScheduler, self).__init__(**kwargs)
+        self.recorded = []
+        self.succeed = True
+
+    @asyncio.coroutine
+    def push(self, mac, target, reconcile):
+        self.recorded.append((target, reconcile))
+        if self.succeed:
+            self.pushed[mac] = target
+        return self.succeed
+
+
+class SetpointSchedulerTestCase(unittest.TestCase):
+
+    TEMP_DIR = 'temp'
+    CONFIG_PATH = TEMP_DIR + '/test_config'
+    MAC = '2e:ff:ff:00:22:8b'
+
+    def setUp(self):
+        if not os.path.exists(self.TEMP_DIR):
+            os.mkdir(self.TEMP_DIR)
+        Config.CONFIG_PATH = self.CONFIG_PATH
+        Config().save_heating_table(self.MAC, [{'day': 0, 'time': '06:00:00', 'temperature': 21.0},
+                                               {'day': 0, 'time': '22:00:00', 'temperature': 17.0}])
+        self.scheduler = RecordingScheduler(check_interval=3600, reconcile_interval=6 * 3600, retry_delay=60)
+        self.loop = asyncio.get_event_loop()
+
+    def tearDown(self):
+        shutil.rmtree(self.TEMP_DIR)
+
+    def update(self, now):
+        return self.loop.run_until_complete(self.scheduler.update(self.MAC, now))
+
+    def test_push_at_transitions_only(self):
+        # Monday 2016-01-04
+        monday = datetime(2016, 1, 4)
+
+        # The first update verifies the thermostat
+        self.assertEqual(self.update(monday.replace(hour=21, minute=30)), monday.replace(hour=22))
+        self.assertEqual(self.scheduler.recorded, [(21.0, True)])
+
+        # Nothing changed before the transition
+        self.assertEqual(self.update(monday.replace(hour=21, minute=45)), monday.replace(hour=22))
+        self.assertEqual(len(self.scheduler.recorded), 1)
+
+        # At the transition the new target is pushed
+        self.assertEqual(self.update(monday.replace(hour=22)), monday.replace(hour=23))
+        self.assertEqual(self.scheduler.recorded[-1], (17.0, False))
+
+        # The thermostat is verified again after the reconciliation interval
+        self.update(monday.replace(hour=21, minute=30) + timedelta(hours=6))
+        self.assertEqual(self.scheduler.recorded[-1], (17.0, True))
+
+    def test_retry_after_failure(self):
+        now = datetime(2016, 1, 4, 12)
+        self.scheduler.succeed = False
+        self.assertEqual(self.update(now), now + timedelta(seconds=60))
+
+        self.scheduler.succeed = True
+        self.update(now + timedelta(seconds=60))
+        self.assertEqual(self.scheduler.recorded, [(21.0, True), (21.0, True)])
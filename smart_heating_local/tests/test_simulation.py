@@ -0,0 +1,110 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from smart_heating_local.config import Config
+from smart_heating_local.device_state import DeviceStateCache
+from smart_heating_local.metrics import query_exchanges
+from smart_heating_local import registry
+from smart_heating_local.simulation import SimulatedFleet
+from smart_heating_local.storage import close_connections, get_connection
+from smart_heating_local import thermostat_controller
+
+
+class SimulatedFleetTestCase(unittest.TestCase):
+
+    MACS = ['2e:ff:ff:00:00:01', '2e:ff:ff:00:00:02', '2e:ff:ff:00:00:03']
+
+    def setUp(self):
+        self.loop = asyncio.get_event_loop()
+        self.temp_dir = tempfile.mkdtemp()
+        self.fleet = SimulatedFleet(self.MACS, port=56841, latency=0.01, slowness={self.MACS[2]: 5.0})
+        self.loop.run_until_complete(self.fleet.start())
+
+        self.original = (Config.CONFIG_PATH, Config.DATABASE_PATH,
+                         thermostat_controller.device_state, registry.coap_url, thermostat_controller.pacer.gap)
+        Config.CONFIG_PATH = os.path.join(self.temp_dir, 'config')
+        Config.DATABASE_PATH = os.path.join(self.temp_dir, 'heating.db')
+        thermostat_controller.device_state = DeviceStateCache(path=os.path.join(self.temp_dir, 'device_state'))
+        registry.coap_url = self.fleet.coap_url
+        thermostat_controller.registry.clear()
+        thermostat_controller.pacer.gap = 0
+
+    def tearDown(self):
+        (Config.CONFIG_PATH, Config.DATABASE_PATH, thermostat_controller.device_state,
+         registry.coap_url, thermostat_controller.pacer.gap) = self.original
+        thermostat_controller.registry.clear()
+        thermostat_controller.shutdown_client_context()
+        close_connections()
+        self.fleet.stop()
+        shutil.rmtree(self.temp_dir)
+
+    def test_cycle(self):
+        config = Config()
+        config.save_thermostat_macs(self.MACS)
+        for mac in self.MACS:
+            config.save_heating_table(mac, [{'day': 0, 'time': '00:00:00', 'temperature': 20.5}])
+
+        results = self.loop.run_until_complete(thermostat_controller.cycle())
+
+        self.assertTrue(all(result.ok for device_results in results for result in device_results))
+        for mac in self.MACS:
+            thermostat = self.fleet.thermostat(mac)
+            self.assertEqual((thermostat.mode, thermostat.target), ('radio target', 20.5))
+            self.assertEqual(thermostat.requests, 6)
+        with sqlite3.connect(Config.DATABASE_PATH) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM heating_temperature').fetchone()[0], 3)
+            # One row per resource of each thermostat
+            for mac in self.MACS:
+                self.assertEqual(len(query_exchanges(conn, mac=mac)), 4)
+
+    def test_locked_database_does_not_block_the_event_loop(self):
+        Config().save_thermostat_macs(self.MACS)
+        # Create the database in WAL mode, then lock it like the retention job vacuuming
+        get_connection()
+        lock = sqlite3.connect(Config.DATABASE_PATH)
+        lock.execute('BEGIN IMMEDIATE')
+        self.loop.call_later(0.5, lock.rollback)
+
+        @asyncio.coroutine
+        def longest_stall():
+            longest = 0
+            while not task.done():
+                started = self.loop.time()
+                yield from asyncio.sleep(0.01)
+                longest = max(longest, self.loop.time() - started)
+            return longest
+
+        task = asyncio.async(thermostat_controller.cycle(set_targets=False))
+        stall = self.loop.run_until_complete(longest_stall())
+        lock.close()
+
+        self.assertTrue(all(result.ok for device_results in task.result() for result in device_results))
+        self.assertLess(stall, 0.25)
+        with sqlite3.connect(Config.DATABASE_PATH) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM heating_temperature').fetchone()[0], 3)
+
+    def test_unknown_resource(self):
+        response = self.loop.run_until_complete(thermostat_controller.coap_request(
+            self.MACS[0], self.fleet.coap_url(self.MACS[0]) + '/sensors/humidity', 1))
+
+        self.assertEqual(thermostat_controller.response_error(response), 'response code 4.04')
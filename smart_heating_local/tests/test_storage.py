@@ -0,0 +1,140 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from smart_heating_local.metrics import CREATE_EXCHANGE_TABLE_SQL
+from smart_heating_local.models import Measurement, to_epoch
+from smart_heating_local.storage import MIGRATIONS, get_connection, close_connections, migrate
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'heating.db')
+
+    def tearDown(self):
+        close_connections()
+        shutil.rmtree(self.temp_dir)
+
+    def test_connection_is_tuned_and_has_tables(self):
+        conn = get_connection(self.path)
+
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        self.assertIn('heating_temperature', tables)
+        self.assertIn('heating_rssi', tables)
+
+    def test_connections_are_reused_per_thread(self):
+        conn = get_connection(self.path)
+        self.assertIs(get_connection(self.path), conn)
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(get_connection(self.path)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+    def test_closed_connections_are_replaced(self):
+        conn = get_connection(self.path)
+        close_connections()
+
+        self.assertRaises(sqlite3.ProgrammingError, conn.execute, 'SELECT 1')
+        self.assertEqual(get_connection(self.path).execute('SELECT 1').fetchone(), (1,))
+
+    def test_migrations(self):
+        conn = get_connection(self.path)
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], len(MIGRATIONS))
+        self.assertEqual(migrate(conn), 0)
+
+        # Interrupted after the statements, before the version was stored
+        conn.execute('PRAGMA user_version = 0')
+        self.assertEqual(migrate(conn), len(MIGRATIONS))
+
+    def test_unsent_measurements_use_partial_index(self):
+        conn = get_connection(self.path)
+        for table, index in (('heating_temperature', 'heating_temperature_unsent'),
+                             ('heating_rssi', 'heating_rssi_unsent')):
+            plan = conn.execute('EXPLAIN QUERY PLAN SELECT * FROM %s WHERE status = %s'
+                                % (table, Measurement.STATUS_NEW)).fetchall()
+            self.assertIn(index, ' '.join(str(row[-1]) for row in plan))
+
+    def test_text_timestamps_are_migrated(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE heating_temperature (mac CHAR(20) NOT NULL, timestamp TIMESTAMP NOT NULL, '
+                     'temperature FLOAT NOT NULL, status INTEGER NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)')
+        conn.execute('CREATE TABLE heating_temperature_aggregates (mac CHAR(20) NOT NULL, '
+                     'timestamp TIMESTAMP NOT NULL, resolution INTEGER NOT NULL, minimum FLOAT NOT NULL, '
+                     'maximum FLOAT NOT NULL, total FLOAT NOT NULL, count INTEGER NOT NULL)')
+        conn.executemany('INSERT INTO heating_temperature (mac, timestamp, temperature, status) VALUES (?, ?, ?, ?)',
+                         [('a', '2016-07-01 12:30:15.123456', 21.5, Measurement.STATUS_NEW),
+                          ('a', '2016-01-01 08:00:00', 20.0, Measurement.STATUS_SENT)])
+        conn.execute("INSERT INTO heating_temperature_aggregates VALUES ('a', '2016-01-01 10:00:00', 3600, 1, 2, 3, 2)")
+        conn.execute('PRAGMA user_version = 2')
+        conn.commit()
+        conn.close()
+
+        conn = get_connection(self.path)
+        self.assertEqual(conn.execute('SELECT timestamp, temperature, status FROM heating_temperature').fetchall(),
+                         [(to_epoch(datetime(2016, 7, 1, 12, 30, 15, 123456)), 21.5, Measurement.STATUS_NEW),
+                          (to_epoch(datetime(2016, 1, 1, 8)), 20.0, Measurement.STATUS_SENT)])
+        self.assertEqual(conn.execute('SELECT timestamp FROM heating_temperature_aggregates').fetchall(),
+                         [(to_epoch(datetime(2016, 1, 1, 10)),)])
+        columns = conn.execute('PRAGMA table_info(heating_temperature)').fetchall()
+        self.assertEqual([column[2] for column in columns],
+                         ['INTEGER', 'CHAR(20)', 'INTEGER', 'REAL', 'INTEGER', 'INTEGER'])
+        self.assertIn('heating_temperature_unsent',
+                      [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")])
+
+    def test_exchange_timestamps_are_migrated(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute(CREATE_EXCHANGE_TABLE_SQL.replace('timestamp INTEGER', 'timestamp TIMESTAMP'))
+        conn.execute("INSERT INTO heating_coap_exchanges VALUES ('2016-07-01 12:30:15.123456', 'a', "
+                     "'/sensors/temperature', 2, 2, 0, 0, 0, 0.2, 0.15, '2,0', '')")
+        conn.execute('PRAGMA user_version = 3')
+        conn.commit()
+        conn.close()
+
+        conn = get_connection(self.path)
+        self.assertEqual(conn.execute('SELECT timestamp, mac, requests, histogram FROM heating_coap_exchanges')
+                         .fetchall(), [(to_epoch(datetime(2016, 7, 1, 12, 30, 15, 123456)), 'a', 2, '2,0')])
+        columns = conn.execute('PRAGMA table_info(heating_coap_exchanges)').fetchall()
+        self.assertEqual([column[2] for column in columns if column[1] == 'timestamp'], ['INTEGER'])
+
+    def test_measurement_ids_are_migrated(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE heating_temperature (mac CHAR(20) NOT NULL, timestamp INTEGER NOT NULL, '
+                     'temperature REAL NOT NULL, status INTEGER NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)')
+        conn.executemany('INSERT INTO heating_temperature (mac, timestamp, temperature, status) VALUES (?, ?, ?, ?)',
+                         [('a', 1451606400000000 + i, float(i), Measurement.STATUS_NEW) for i in range(4)])
+        conn.execute('DELETE FROM heating_temperature WHERE temperature = 1.0')
+        conn.execute('PRAGMA user_version = 4')
+        conn.commit()
+        conn.close()
+
+        conn = get_connection(self.path)
+        self.assertEqual(conn.execute('SELECT id, temperature FROM heating_temperature ORDER BY id').fetchall(),
+                         [(1, 0.0), (3, 2.0), (4, 3.0)])
+        columns = conn.execute('PRAGMA table_info(heating_temperature)').fetchall()
+        self.assertEqual([(column[1], column[5]) for column in columns if column[5] > 0], [('id', 1)])
+        self.assertIn('heating_temperature_unsent',
+                      [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")])
@@ -14,11 +14,42 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import sqlite3
 import unittest
+import aiocoap.resource
 from smart_heating_local.thermostat_controller import *
+from smart_heating_local import registry
+from smart_heating_local import thermostat_controller
 from nose.plugins.attrib import attr
 
 
+class TemperatureResource(aiocoap.resource.CoAPResource):
+    """
+    Stand-in for the temperature resource of a thermostat.
+    """
+
+    def __init__(self, observable):
+        super(TemperatureResource, self).__init__()
+        self.observable = observable
+        self.value = 21.5
+
+    @asyncio.coroutine
+    def render_GET(self, request):
+        return Message(code=CONTENT, payload=str(self.value).encode('utf-8'))
+
+
+@asyncio.coroutine
+def create_thermostat_server(port, temperature_resource):
+    """
+    Serve /sensors/temperature on the IPv6 loopback address.
+    """
+    root = aiocoap.resource.CoAPResource()
+    sensors = aiocoap.resource.CoAPResource()
+    root.put_child('sensors', sensors)
+    sensors.put_child('temperature', temperature_resource)
+    return (yield from Context.create_server_context(aiocoap.resource.Site(root), bind=('::1', port)))
+
+
 class ThermostatControllerTestCase(unittest.TestCase):
     """
     Tests the processing of the API.
@@ -34,3 +65,86 @@ class ThermostatControllerTestCase(unittest.TestCase):
 
     def test_coap_url(self):
         self.assertEqual(coap_url('2e:ff:ff:00:22:8b'), 'coap://[fdfd::221:2eff:ff00:228b]')
+
+    def test_response_error(self):
+        self.assertEqual(response_error(None), 'no response')
+        self.assertIsNone(response_error(Message(code=CONTENT)))
+        self.assertEqual(response_error(Message(code=NOT_FOUND)), 'response code 4.04')
+
+    def test_store_readings(self):
+        conn = sqlite3.connect(':memory:')
+        create_tables(conn)
+        store_temperatures(conn, [TemperatureReading("2e:ff:ff:00:22:8b'", 'now', 21.5),
+                                  TemperatureReading('2e:ff:ff:00:22:8b', 'now', error='no response')])
+        store_rssi(conn, [HeartbeatReading('2e:ff:ff:00:22:8b', 'now', rssi=-60.0)])
+        conn.commit()
+
+        self.assertEqual(conn.execute('SELECT mac, temperature FROM heating_temperature').fetchall(),
+                         [("2e:ff:ff:00:22:8b'", 21.5)])
+        self.assertEqual(conn.execute('SELECT mac, rssi FROM heating_rssi').fetchall(), [('2e:ff:ff:00:22:8b', -60.0)])
+
+    def test_execute_tasks(self):
+        @asyncio.coroutine
+        def succeed(mac):
+            return TemperatureReading(mac, 'now', 21.0)
+
+        @asyncio.coroutine
+        def fail(mac):
+            raise Exception('expected')
+
+        results = asyncio.get_event_loop().run_until_complete(execute_tasks([succeed('a'), fail('b'), succeed('c')]))
+        self.assertEqual([result.mac for result in results], ['a', 'c'])
+
+    def test_client_context_is_shared(self):
+        thermostat_controller.client_contexts_created = 0
+        loop = asyncio.get_event_loop()
+        try:
+            contexts = loop.run_until_complete(asyncio.gather(thermostat_controller.get_client_context(),
+                                                              thermostat_controller.get_client_context()))
+            self.assertIs(contexts[0], contexts[1])
+            self.assertIs(loop.run_until_complete(thermostat_controller.get_client_context()), contexts[0])
+            self.assertEqual(thermostat_controller.client_contexts_created, 1)
+        finally:
+            thermostat_controller.shutdown_client_context()
+
+    def test_temperature_observer(self):
+        loop = asyncio.get_event_loop()
+        ports = {'observable': 56831, 'polled': 56832}
+        resources = {'observable': TemperatureResource(True), 'polled': TemperatureResource(False)}
+        servers = [loop.run_until_complete(create_thermostat_server(ports[mac], resources[mac])) for mac in ports]
+
+        original_coap_url, original_gap = registry.coap_url, thermostat_controller.pacer.gap
+        registry.coap_url = lambda mac: 'coap://[::1]:%s' % ports[mac]
+        thermostat_controller.registry.clear()
+        thermostat_controller.pacer.gap = 0
+        observer = TemperatureObserver()
+        try:
+            observer.start(['observable', 'polled'])
+            loop.run_until_complete(asyncio.sleep(0.1))
+
+            self.assertTrue(observer.is_observed('observable'))
+            self.assertFalse(observer.is_observed('polled'))
+            self.assertIn('polled', observer.unobservable)
+
+            resources['observable'].value = 22.0
+            resources['observable'].updated_state()
+            loop.run_until_complete(asyncio.sleep(0.1))
+
+            readings = observer.pop_readings()
+            self.assertEqual([(reading.mac, reading.temperature) for reading in readings],
+                             [('observable', 21.5), ('observable', 22.0)])
+            # The stable temperature is stored again without a notification
+            held = observer.pop_readings()
+            self.assertEqual([(reading.mac, reading.temperature) for reading in held], [('observable', 22.0)])
+            self.assertGreaterEqual(held[0].timestamp, readings[-1].timestamp)
+
+            observer.stop()
+            self.assertEqual(observer.pop_readings(), [])
+        finally:
+            observer.stop()
+            loop.run_until_complete(asyncio.sleep(0.01))
+            registry.coap_url, thermostat_controller.pacer.gap = original_coap_url, original_gap
+            thermostat_controller.registry.clear()
+            thermostat_controller.shutdown_client_context()
+            for server in servers:
+                server.shutdown()
@@ -0,0 +1,110 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import requests
+from requests.adapters import BaseAdapter
+from smart_heating_local.http_session import TimeoutSession
+from smart_heating_local.models import Measurement, TemperatureMeasurement
+from smart_heating_local.server import Server
+from smart_heating_local.url_cache import ThermostatUrlCache
+
+MAC = '2e:ff:ff:00:22:8b'
+
+
+class ThermostatServerAdapter(BaseAdapter):
+    """
+    Answers thermostat lookups with the current thermostat URL and accepts measurements posted to it.
+    """
+
+    def __init__(self):
+        super(ThermostatServerAdapter, self).__init__()
+        self.thermostat_url = 'http://server/thermostat/1/'
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append((request.method, request.url))
+        response = requests.Response()
+        response.request = request
+        response.status_code = 200
+        response._content = b'{}'
+        if 'lookup' in request.url:
+            response._content = json.dumps({'thermostat': {'url': self.thermostat_url}}).encode('utf-8')
+        elif request.method == 'POST' and not request.url.startswith(self.thermostat_url):
+            response.status_code = 404
+        return response
+
+    def close(self):
+        pass
+
+
+class ThermostatUrlCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'thermostat_urls')
+        self.now = 1000.0
+        self.cache = ThermostatUrlCache(path=self.path, ttl=60, clock=lambda: self.now)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_ttl_and_hit_rate(self):
+        self.assertIsNone(self.cache.get(MAC))
+        self.cache.put(MAC, 'http://server/thermostat/1/')
+        self.now += 60
+        self.assertEqual(self.cache.get(MAC), 'http://server/thermostat/1/')
+        self.now += 1
+        self.assertIsNone(self.cache.get(MAC))
+        self.assertEqual((self.cache.hits, self.cache.misses, self.cache.hit_rate), (1, 2, 1 / 3))
+
+    def test_persisted(self):
+        self.cache.put(MAC, 'http://server/thermostat/1/')
+        self.cache.put('a', 'http://server/thermostat/2/')
+        self.cache.save()
+        self.cache.invalidate('a')
+        self.cache.save()
+
+        cache = ThermostatUrlCache(path=self.path, ttl=60, clock=lambda: self.now)
+        self.assertEqual(cache.get(MAC), 'http://server/thermostat/1/')
+        self.assertIsNone(cache.get('a'))
+
+    def test_upload_uses_cache_and_looks_up_stale_urls(self):
+        adapter = ThermostatServerAdapter()
+        session = TimeoutSession(timeout=1)
+        session.mount('http://', adapter)
+        server = Server()
+        server.requests = session
+        server.thermostat_urls = self.cache
+        measurement = TemperatureMeasurement(MAC, 0, 21.5, Measurement.STATUS_NEW, 0)
+
+        server.upload_temperature_measurement(measurement)
+        server.upload_temperature_measurement(measurement)
+        self.assertEqual([method for method, url in adapter.sent], ['GET', 'POST', 'POST'])
+
+        # The thermostat moved
+        adapter.thermostat_url = 'http://server/thermostat/7/'
+        del adapter.sent[:]
+        server.upload_temperature_measurement(measurement)
+        self.assertEqual(adapter.sent, [('POST', 'http://server/thermostat/1/temperature/'),
+                                        ('GET', server.device_thermostat_lookup_url(MAC)),
+                                        ('POST', 'http://server/thermostat/7/temperature/')])
+        self.assertEqual(self.cache.get(MAC), 'http://server/thermostat/7/')
+        self.assertEqual(self.cache.invalidations, 1)
@@ -14,22 +14,56 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import sqlite3
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
 from asyncio.tasks import async
 import aiocoap
 from aiocoap import *
-import time
 
-import copy
 from smart_heating_local.config import Config
+from smart_heating_local.device_state import DeviceStateCache
+from smart_heating_local.health import health
+from smart_heating_local.metrics import *
+from smart_heating_local.pacing import DevicePacer, RequestWindow
+from smart_heating_local.registry import ThermostatRegistry, ipv6, coap_url
+from smart_heating_local.retry import RetryPolicy, RetryStatistics
+from smart_heating_local.schedule import compile_schedule
+from smart_heating_local.storage import create_tables, get_connection, close_connections
 from smart_heating_local.models import *
 from smart_heating_local import logging
 
-# Thread safe queue to store the results
 from collections import deque
 
-results = deque()
+# Shared CoAP client context, created lazily by get_client_context() and closed by shutdown_client_context()
+_client_context = None
+
+# Number of CoAP client contexts created during the current cycle. Should not exceed 1.
+client_contexts_created = 0
+
+# Keeps a minimal gap between two requests to the same thermostat
+pacer = DevicePacer()
+
+# Limits the requests outstanding at the same time over the border router
+request_window = RequestWindow()
+
+# Retries of failed CoAP requests, shared by all operations
+retry_policy = RetryPolicy()
+
+# mac -> RetryStatistics of the current cycle
+retry_statistics = {}
+
+# Latency and outcome of each CoAP exchange, flushed to the database once per cycle
+exchange_metrics = ExchangeMetrics()
+
+# Temperature observations of a long running process, created by start_observations()
+observer = None
+
+# Last known mode and target temperature of the thermostats. Avoids querying them before each write.
+device_state = DeviceStateCache()
+
+# Configured thermostats with their resource URIs and runtime state
+registry = ThermostatRegistry()
 
 
 def parse_coap_response_code(response_code):
@@ -46,63 +80,174 @@ def parse_coap_response_code(response_code):
     return response_code_class + response_code_detail / 100  # returns a float
 
 
-def ipv6(mac_addr):
+def is_successful_response(response):
+    """
+    If a CoAP response is successful, i.e. not None and has a code between 2 and 3
+    :type response: Message
+    :rtype bool
     """
-    Convert MAC into IPv6 format.
+    if response is not None:
+        code = parse_coap_response_code(response.code)
+        if 2 <= code < 3:
+            return True
+    return False
 
-    E.g. 2e:ff:ff:00:22:8b to 2eff:ff00:228b
 
-    :type mac_addr: str
-    :rtype: str
+def response_error(response):
     """
-    bytes = mac_addr.replace(':', '')
-    ip = ''
-    for index, part in enumerate(bytes):
-        ip += part
-        if index % 4 == 3 and index < len(bytes) - 1:
-            ip += ':'
-    # Prefix from border router
-    return 'fdfd::221:' + ip
+    Describe why a CoAP request failed.
+    :type response: Message|None
+    :return: The error description or None if the response is successful
+    :rtype: str|None
+    """
+    if response is None:
+        return 'no response'
+    if is_successful_response(response):
+        return None
+    return 'response code %.2f' % parse_coap_response_code(response.code)
 
 
-def coap_url(mac_addr):
+@asyncio.coroutine
+def get_client_context():
     """
-    Return the CoAP url associated to a MAC address
-    :type mac_addr: str
+    Return the shared CoAP client context. It is created on first use and reused by all subsequent requests,
+    so the whole cycle sends over a single UDP socket.
+    Runs async.
+    :rtype: Context
     """
-    return 'coap://[' + ipv6(mac_addr) + ']'
+    global _client_context, client_contexts_created
 
+    if _client_context is None:
+        # Store the pending creation so concurrent callers wait for the same context
+        _client_context = async(Context.create_client_context())
+        client_contexts_created += 1
 
-def is_successful_response(response):
+    context_future = _client_context
+    try:
+        return (yield from asyncio.shield(context_future))
+    except Exception:
+        if context_future.done() and _client_context is context_future:
+            # Creation failed. Allow the next caller to retry.
+            _client_context = None
+        raise
+
+
+def shutdown_client_context():
     """
-    If a CoAP response is successful, i.e. not None and has a code between 2 and 3
-    :type response: Message
-    :rtype bool
+    Close the shared CoAP client context and release its socket. Does nothing if no context has been created.
     """
-    if response is not None:
-        code = parse_coap_response_code(response.code)
-        if 2 <= code < 3:
-            return True
-    return False
+    global _client_context
 
+    context_future = _client_context
+    _client_context = None
+    if context_future is None:
+        return
 
-def coap_request(url, method, payload=None):
+    if context_future.done() and not context_future.cancelled() and context_future.exception() is None:
+        context_future.result().shutdown()
+    else:
+        context_future.cancel()
+
+
+def coap_request(mac, url, method, payload=None):
     """
-    Performs a CoAP request
+    Performs a CoAP request. Timeouts, failures and server errors are retried according to the retry policy.
+    Each attempt waits for the pacer if the last request to the same thermostat has just finished and for a free
+    slot in the request window.
+    :param mac: MAC address of the requested thermostat
+    :type mac: str
     :type url: str
     :param method: One out of 1 (GET), 2 (POST), 3 (PUT), 4 (DELETE) from aiocoap.Code
     :type method: int
     :type payload: float|int|str
     :rtype: Optional[Response]
-    :return: Response or None in case of an error
+    :return: The last response or None if no response has been received
     """
     if payload is None:
         request_str = '%s %s' % (method, url)
     else:
         request_str = '%s %s "%s"' % (method, url, payload)
-    logging.info(request_str)
 
-    protocol = yield from Context.create_client_context()
+    loop = asyncio.get_event_loop()
+    path = urlsplit(url).path
+    statistics = retry_statistics.get(mac)
+    if statistics is None:
+        statistics = retry_statistics[mac] = RetryStatistics()
+    started = loop.time()
+    deadline = started + retry_policy.deadline
+    attempt = 0
+    response = None
+    rtt = None
+
+    try:
+        while True:
+            attempt += 1
+            statistics.attempts += 1
+            logging.info(request_str if attempt == 1 else '%s (attempt #%s)' % (request_str, attempt))
+
+            response = None
+            timed_out = False
+            yield from pacer.acquire(mac)
+            try:
+                yield from request_window.acquire()
+            except Exception:
+                pacer.release(mac)
+                raise
+            sent = loop.time()
+            try:
+                response = yield from asyncio.wait_for(_coap_request(url, method, payload),
+                                                       max(0, deadline - loop.time()))
+            except (aiocoap.error.RequestTimedOut, asyncio.TimeoutError):
+                timed_out = True
+                statistics.timeouts += 1
+                exchange_metrics.record(mac, path, OUTCOME_TIMEOUT, loop.time() - sent)
+                logging.error('Request timed out: %s' % request_str)
+            except Exception as e:
+                statistics.failures += 1
+                exchange_metrics.record(mac, path, OUTCOME_EXCEPTION, loop.time() - sent)
+                logging.error('Request failed: %s' % request_str)
+                logging.exception(e)
+            else:
+                rtt = loop.time() - sent
+
+                # Log response
+                successful = is_successful_response(response)
+                level = logging.INFO if successful else logging.ERROR
+                logging.log(level, '%s: %s, %r' % (request_str, response.code, response.payload))
+
+                if successful:
+                    exchange_metrics.record(mac, path, OUTCOME_SUCCESS, rtt)
+                    return response
+                code = parse_coap_response_code(response.code)
+                exchange_metrics.record(mac, path, OUTCOME_ERROR, rtt, '%.2f' % code)
+                statistics.error_responses += 1
+                if not retry_policy.is_retryable_code(code):
+                    return response
+            finally:
+                request_window.release(timed_out)
+                pacer.release(mac)
+
+            delay = retry_policy.next_delay(attempt, deadline - loop.time())
+            if delay is None:
+                logging.error('Giving up after %s attempts: %s' % (attempt, request_str))
+                return response
+            yield from asyncio.sleep(delay)
+    finally:
+        statistics.operations += 1
+        statistics.latency += loop.time() - started
+        get_thermostat(mac).request_finished(is_successful_response(response), rtt)
+
+
+def _coap_request(url, method, payload=None):
+    """
+    Performs a single CoAP request without pacing or retries.
+    :type url: str
+    :type method: int
+    :type payload: float|int|str
+    :rtype: Response
+    :raise aiocoap.error.RequestTimedOut: If the thermostat did not respond
+    """
+    protocol = yield from get_client_context()
 
     if isinstance(payload, float) or isinstance(payload, int):
         payload = str(payload)
@@ -117,60 +262,239 @@ def coap_request(url, method, payload=None):
     request = Message(code=method, payload=encoded_payload)
     request.set_request_uri(url)
 
-    try:
-        response = yield from protocol.request(request).response
-    except aiocoap.error.RequestTimedOut as e:
-        logging.error('Request timed out: %s' % request_str)
-        return None
-    except Exception as e:
-        logging.error('Request failed: %s' % request_str)
-        logging.exception(e)
-        return None
-    else:
-        # Replace payload bytes with encoded string
-        response.payload = str(response.payload, 'utf-8')
-
-        # Log response
-        level = logging.INFO if is_successful_response(response) else logging.ERROR
-        logging.log(level, '%s: %s, %r' % (request_str, response.code, response.payload))
+    response = yield from protocol.request(request).response
 
-        return response
+    # Replace payload bytes with encoded string
+    response.payload = str(response.payload, 'utf-8')
+    return response
 
 
 @asyncio.coroutine
 def get_temperature(thermostat_mac):
     """
-    Query the temperature from a thermostat and append the result to the thread safe results list.
+    Query the temperature from a thermostat.
     Runs async.
     :type thermostat_mac: str
+    :rtype: TemperatureReading
     """
-    url = coap_url(thermostat_mac) + '/sensors/temperature'
-    timestamp = str(datetime.now())
+    url = get_thermostat(thermostat_mac).temperature_uri
+    timestamp = epoch_now()
 
-    response = yield from async(coap_request(url, Code.GET))
+    response = yield from async(coap_request(thermostat_mac, url, Code.GET))
 
-    if is_successful_response(response):
-        temperature = float(response.payload)
-        results.append([thermostat_mac, timestamp, temperature])
+    error = response_error(response)
+    if error is not None:
+        return TemperatureReading(thermostat_mac, timestamp, error=error)
+
+    try:
+        return TemperatureReading(thermostat_mac, timestamp, float(response.payload))
+    except ValueError:
+        return TemperatureReading(thermostat_mac, timestamp, error='invalid payload %r' % response.payload)
+
+
+class TemperatureObserver(object):
+    """
+    Observes (RFC 7641) the temperature resource of thermostats and buffers the notifications until they are stored.
+
+    A failed or silent observation is registered again after Config.OBSERVE_RETRY_DELAY. Thermostats rejecting the
+    observation are remembered and have to be polled. A stable temperature is not notified again, so the last notified
+    temperature of an observed thermostat is stored once per cycle until it changes.
+    """
+
+    def __init__(self):
+        # mac -> Task keeping the observation alive
+        self.tasks = {}
+        # MACs with a registered observation
+        self.active = set()
+        # MACs of thermostats that do not support observation
+        self.unobservable = set()
+        # Buffered notifications
+        self.readings = deque()
+        # mac -> last notified temperature
+        self.temperatures = {}
+        self.notifications = 0
+
+    def start(self, macs):
+        """
+        Start observing thermostats which are not observed yet.
+        :type macs: List[str]
+        """
+        for mac in macs:
+            if mac not in self.tasks and mac not in self.unobservable:
+                self.tasks[mac] = async(self._observe(mac))
+
+    def stop(self):
+        """
+        Cancel all observations.
+        """
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        self.active.clear()
+
+    def is_observed(self, mac):
+        """
+        :return: Whether notifications of the thermostat arrive, i.e. it does not need to be polled
+        :rtype: bool
+        """
+        return mac in self.active
+
+    def pop_readings(self):
+        """
+        Return and remove the buffered notifications. Observed thermostats without a notification since the last call
+        get a reading of their last notified temperature.
+        :rtype: List[TemperatureReading]
+        """
+        readings = list(self.readings)
+        self.readings.clear()
+        notified = set(reading.mac for reading in readings)
+        now = epoch_now()
+        for mac in sorted(self.active - notified):
+            if mac in self.temperatures:
+                readings.append(TemperatureReading(mac, now, self.temperatures[mac]))
+        return readings
+
+    def _on_notification(self, mac, response):
+        """
+        Buffer a notification. Called by aiocoap.
+        :type response: Message
+        """
+        if not is_successful_response(response):
+            return
+        try:
+            temperature = float(str(response.payload, 'utf-8'))
+        except ValueError:
+            logging.error('Invalid temperature notification from %s: %r' % (mac, response.payload))
+            return
+        self.notifications += 1
+        self.temperatures[mac] = temperature
+        self.readings.append(TemperatureReading(mac, epoch_now(), temperature))
+
+    @asyncio.coroutine
+    def _register(self, mac):
+        """
+        Register an observation of the thermostats temperature.
+        Runs async.
+        :return: The observation or None if the thermostat does not support it
+        :rtype: ClientObservation|None
+        """
+        url = get_thermostat(mac).temperature_uri
+        request = Message(code=Code.GET)
+        request.set_request_uri(url)
+        request.opt.observe = 0
+
+        protocol = yield from get_client_context()
+        timed_out = False
+        yield from pacer.acquire(mac)
+        try:
+            yield from request_window.acquire()
+        except Exception:
+            pacer.release(mac)
+            raise
+        try:
+            protocol_request = protocol.request(request)
+            response = yield from protocol_request.response
+        except aiocoap.error.RequestTimedOut:
+            timed_out = True
+            raise
+        finally:
+            request_window.release(timed_out)
+            pacer.release(mac)
+
+        if response.opt.observe is None or not is_successful_response(response):
+            # The thermostat answered like to a plain GET
+            protocol_request.observation.cancel()
+            return None
+
+        # The initial response is a reading as well
+        self._on_notification(mac, response)
+        return protocol_request.observation
+
+    @asyncio.coroutine
+    def _observe(self, mac):
+        """
+        Keep the observation of a thermostat registered until it is cancelled.
+        Runs async.
+        :type mac: str
+        """
+        loop = asyncio.get_event_loop()
+        observation = None
+        try:
+            while True:
+                try:
+                    observation = yield from self._register(mac)
+                except Exception as e:
+                    logging.error('Observation of %s failed: %s: %s' % (mac, e.__class__.__name__, e))
+                    yield from asyncio.sleep(Config.OBSERVE_RETRY_DELAY)
+                    continue
+
+                if observation is None:
+                    logging.warning('%s does not support observation. Falling back to polling.' % mac)
+                    self.unobservable.add(mac)
+                    return
+
+                logging.info('Observing temperature of %s' % mac)
+                self.active.add(mac)
+                failed = asyncio.Future()
+                last_notification = [loop.time()]
+
+                def on_notification(response, mac=mac, last_notification=last_notification):
+                    last_notification[0] = loop.time()
+                    self._on_notification(mac, response)
+
+                def on_error(exception, failed=failed):
+                    if not failed.done():
+                        failed.set_result(exception)
+
+                observation.register_callback(on_notification)
+                observation.register_errback(on_error)
+
+                # Wait until the observation fails or falls silent
+                while not failed.done():
+                    silence = loop.time() - last_notification[0]
+                    if silence >= Config.OBSERVE_MAX_SILENCE:
+                        logging.error('No notification from %s for %.0f s' % (mac, silence))
+                        observation.cancel()
+                        break
+                    yield from asyncio.wait([failed], timeout=Config.OBSERVE_MAX_SILENCE - silence)
+                else:
+                    logging.error('Observation of %s failed: %r' % (mac, failed.result()))
+
+                self.active.discard(mac)
+                observation = None
+                yield from asyncio.sleep(Config.OBSERVE_RETRY_DELAY)
+        finally:
+            self.active.discard(mac)
+            if observation is not None and not observation.cancelled:
+                observation.cancel()
 
 
 @asyncio.coroutine
 def get_heartbeat(thermostat_mac):
     """
-    Query the heartbeat from a thermostat and append the result to thread safe results list.
+    Query the heartbeat from a thermostat.
     Runs async.
     :type thermostat_mac: str
+    :rtype: HeartbeatReading
     """
-    url = coap_url(thermostat_mac) + '/debug/heartbeat'
-    timestamp = str(datetime.now())
+    url = get_thermostat(thermostat_mac).heartbeat_uri
+    timestamp = epoch_now()
 
-    response = yield from async(coap_request(url, Code.GET))
+    response = yield from async(coap_request(thermostat_mac, url, Code.GET))
 
-    if is_successful_response(response):
-        version, uptime, rssi = map(lambda x: x.split(':')[1], str(response.payload).split(','))
+    error = response_error(response)
+    if error is not None:
+        return HeartbeatReading(thermostat_mac, timestamp, error=error)
 
-        # Future work: also return version and uptime
-        results.append([thermostat_mac, timestamp, rssi])
+    try:
+        version, uptime, rssi = [item.split(':')[1] for item in str(response.payload).split(',')]
+        rssi = float(rssi)
+    except (ValueError, IndexError):
+        return HeartbeatReading(thermostat_mac, timestamp, error='invalid payload %r' % response.payload)
+
+    # Forget the cached state if the thermostat rebooted
+    device_state.update_uptime(thermostat_mac, uptime)
+    return HeartbeatReading(thermostat_mac, timestamp, version=version, uptime=uptime, rssi=rssi)
 
 
 def get_mode(thermostat_mac):
@@ -180,8 +504,8 @@ def get_mode(thermostat_mac):
     :return: The mode or None in case of errors.
     :rtype: str|None
     """
-    url = coap_url(thermostat_mac) + '/set/mode'
-    response = yield from async(coap_request(url, Code.GET))
+    url = get_thermostat(thermostat_mac).mode_uri
+    response = yield from async(coap_request(thermostat_mac, url, Code.GET))
 
     if is_successful_response(response):
         return str(response.payload)
@@ -194,27 +518,34 @@ def set_target_mode(mac):
     Set a thermostats operating mode to target.
     Runs async.
     :type mac: str
+    :rtype: ModeResult
     """
     logging.info("Ensure target mode for %s" % mac)
+    timestamp = epoch_now()
 
     # Desired mode
     target_mode = 'radio target'
 
-    # Check if the desired mode is already set
-    current_mode = yield from async(get_mode(mac))
+    # Check if the desired mode is already set. Only query the thermostat if its mode is not cached.
+    current_mode = device_state.get(mac, DeviceStateCache.MODE)
+    if current_mode is None:
+        current_mode = yield from async(get_mode(mac))
+        if current_mode is not None:
+            device_state.confirm(mac, DeviceStateCache.MODE, current_mode)
     if current_mode == target_mode:
         # Already set, nothing to do here
-        return
-
-    # Wait
-    wait()
+        return ModeResult(mac, timestamp, mode=target_mode)
 
     # Set mode
-    url = coap_url(mac) + '/set/mode'
-    response = yield from async(coap_request(url, Code.PUT, target_mode))
+    url = get_thermostat(mac).mode_uri
+    response = yield from async(coap_request(mac, url, Code.PUT, target_mode))
 
-    if is_successful_response(response):
-        results.append({'payload': response.payload})
+    error = response_error(response)
+    if error is not None:
+        device_state.invalidate(mac, DeviceStateCache.MODE)
+        return ModeResult(mac, timestamp, mode=current_mode, error=error)
+    device_state.confirm(mac, DeviceStateCache.MODE, target_mode)
+    return ModeResult(mac, timestamp, mode=target_mode, changed=True)
 
 
 def get_target_temperature(mac):
@@ -224,162 +555,198 @@ def get_target_temperature(mac):
     :return: The target temperature
     :rtype: float|None
     """
+    url = get_thermostat(mac).target_uri
+    response = yield from async(coap_request(mac, url, Code.GET))
 
-    tries = 0
-    url = coap_url(mac) + '/set/target'
-    result = dict()
-    result['url'] = url
-
-    # Try the request up to 3 times
-    while tries < 3:
-        tries += 1
-
-        response = yield from async(coap_request(url, Code.GET))
-
-        if is_successful_response(response):
-            return float(response.payload)
-
-        # Wait between requests
-        wait()
-
+    if is_successful_response(response):
+        return float(response.payload)
     return None
 
 
 @asyncio.coroutine
 def set_target_temperature(mac, target_temperature):
     """
-    Set the target temperature of a thermostat. Stores the result in the thread safe results list.
+    Set the target temperature of a thermostat.
     Runs async.
     :type mac: str
     :param target_temperature:
+    :rtype: TargetResult
     """
+    timestamp = epoch_now()
 
-    # Check if the desired target is already set
-    current_target = yield from async(get_target_temperature(mac))
+    # Check if the desired target is already set. Only query the thermostat if its target is not cached.
+    current_target = device_state.get(mac, DeviceStateCache.TARGET)
+    if current_target is None:
+        current_target = yield from async(get_target_temperature(mac))
+        if current_target is not None:
+            device_state.confirm(mac, DeviceStateCache.TARGET, current_target)
     if current_target == target_temperature:
         # Already set, nothing to do here
-        return
-
-    # Wait between requests
-    wait()
+        return TargetResult(mac, timestamp, target=target_temperature)
 
     # Set target temperature
-    url = coap_url(mac) + '/set/target'
-    response = yield from async(coap_request(url, Code.PUT, target_temperature))
+    url = get_thermostat(mac).target_uri
+    response = yield from async(coap_request(mac, url, Code.PUT, target_temperature))
 
-    result = dict()
-    result['url'] = url
-    if response is not None:
-        code = parse_coap_response_code(response.code)
-        result['code'] = code
-        if 2 <= code < 3:
-            result['target'] = target_temperature
-    else:
-        result['error'] = True
-    results.append(result)
+    error = response_error(response)
+    if error is not None:
+        device_state.invalidate(mac, DeviceStateCache.TARGET)
+        return TargetResult(mac, timestamp, target=current_target, error=error)
+    device_state.confirm(mac, DeviceStateCache.TARGET, target_temperature)
+    return TargetResult(mac, timestamp, target=target_temperature, changed=True)
 
 
+@asyncio.coroutine
 def execute_tasks(tasks):
     """
-    Execute a list of tasks in parallel. Returns the list of results.
-    Uses a thread safe list to store the results.
+    Execute a list of tasks or coroutines in parallel and return their results in the same order.
+    Unexpected exceptions are logged and omitted.
+    Runs async.
     :type tasks: List[Task]
-    :rtype: Collections.deque
+    :rtype: list
     """
-    asyncio.get_event_loop().run_until_complete(asyncio.wait(tasks))
-    temp = copy.deepcopy(results)
-    results.clear()
-    return temp
+    results = yield from asyncio.gather(*tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error('Task failed: %s: %s' % (result.__class__.__name__, result))
+    return [result for result in results if not isinstance(result, Exception)]
 
 
 def get_thermostats():
     """
-    Load the list thermostats mac addresses from the config file and return it.
-    :rtype: List[str]
+    Return the configured thermostats. The config file is only read again after the thermostats have changed.
+    :rtype: List[Thermostat]
     """
-
-    # Load config from shelve
-    config = Config()
-    thermostat_macs = config.get_thermostat_macs()
-    if thermostat_macs is None:
+    thermostats = registry.thermostats()
+    if thermostats is None:
         # No thermostats configured
         logging.error('No thermostats defined in local config!')
         return []
-
-    # Store thermostats
-    thermostats = [{'mac': mac} for mac in thermostat_macs]
     return thermostats
 
 
-def create_tables(conn):
+def get_thermostat(mac):
     """
-    Creates the required database table in case they do not exist.
-    :param conn: The sqlite3 connection
-    :rtype conn: Connection
+    :return: The registry entry of a thermostat
+    :rtype: Thermostat
     """
+    return registry.get(mac)
 
-    # Make sure local tables are available
-    create_temperature_table_sql = "CREATE TABLE IF NOT EXISTS heating_temperature (" \
-                                   "mac CHAR(20) NOT NULL," \
-                                   "timestamp TIMESTAMP NOT NULL," \
-                                   "temperature FLOAT NOT NULL," \
-                                   "status INTEGER NOT NULL," \
-                                   "attempts INTEGER NOT NULL DEFAULT 0);"
-    create_rssi_table_sql = "CREATE TABLE IF NOT EXISTS heating_rssi (" \
-                            "mac CHAR(20) NOT NULL," \
-                            "timestamp TIMESTAMP NOT NULL," \
-                            "rssi FLOAT NOT NULL," \
-                            "status INTEGER NOT NULL," \
-                            "attempts INTEGER NOT NULL DEFAULT 0);"
-    conn.execute(create_temperature_table_sql)
-    conn.execute(create_rssi_table_sql)
-    conn.commit()
 
+def start_observations(macs):
+    """
+    Observe the temperature of the given thermostats instead of polling it. Only useful in a long running process.
+    :type macs: List[str]
+    """
+    global observer
+    if observer is None:
+        observer = TemperatureObserver()
+    observer.start(macs)
 
-def log_temperatures():
+
+def stop_observations():
     """
-    Query temperatures and meta data from the configured thermostats and store them in the database.
+    Cancel all temperature observations. Does nothing if no observations have been started.
     """
-    thermostats = get_thermostats()
+    global observer
+    if observer is not None:
+        observer.stop()
+        observer = None
 
-    # Open database connection using the with statement. Ensures the connection gets closed.
-    with sqlite3.connect('/home/pi/smart-heating-local/data/heating.db') as conn:
 
-        # Make sure local tables are available
-        create_tables(conn)
+# Parameterized statements. sqlite3 caches the prepared statements of a connection.
+INSERT_TEMPERATURE_SQL = 'INSERT INTO heating_temperature (mac, timestamp, temperature, status) VALUES (?, ?, ?, ?)'
+INSERT_RSSI_SQL = 'INSERT INTO heating_rssi (mac, timestamp, rssi, status) VALUES (?, ?, ?, ?)'
 
-        cur = conn.cursor()
 
-        # Get temperature values
-        # Start tasks and wait
-        temp_measurements = execute_tasks([async(get_temperature(thermostat['mac'])) for thermostat in thermostats])
-        if len(temp_measurements) > 0:
-            new_values = ", ".join(
-                ["('" + mac + "','" + ts + "'," + str(temp) + "," + str(TemperatureMeasurement.STATUS_NEW) + ")"
-                 for mac, ts, temp in temp_measurements])
-            cur.execute(
-                "INSERT INTO heating_temperature (mac, timestamp, temperature, status) VALUES " + new_values + ";")
+def store_temperatures(conn, readings):
+    """
+    Insert the successful temperature readings into the database. Does not commit.
+    :type conn: Connection
+    :type readings: Iterable[TemperatureReading]
+    """
+    conn.executemany(INSERT_TEMPERATURE_SQL,
+                     ((reading.mac, reading.timestamp, reading.temperature, TemperatureMeasurement.STATUS_NEW)
+                      for reading in readings if reading.ok))
 
-        # Between two requests, wait
-        wait()
 
-        # Get RSSI values
-        # Start tasks and wait
-        rssi_measurements = execute_tasks([async(get_heartbeat(thermostat['mac'])) for thermostat in thermostats])
-        if len(rssi_measurements) > 0:
-            new_values = ", ".join(["('" + mac + "','" + ts + "'," + rssi + "," + str(MetaMeasurement.STATUS_NEW) + ")"
-                                    for mac, ts, rssi in rssi_measurements])
-            cur.execute("INSERT INTO heating_rssi (mac, timestamp, rssi, status) VALUES " + new_values + ";")
+def store_rssi(conn, readings):
+    """
+    Insert the RSSI of successful heartbeat readings into the database. Does not commit.
+    :type conn: Connection
+    :type readings: Iterable[HeartbeatReading]
+    """
+    conn.executemany(INSERT_RSSI_SQL,
+                     ((reading.mac, reading.timestamp, reading.rssi, MetaMeasurement.STATUS_NEW)
+                      for reading in readings if reading.ok))
+
 
-        # Commit
-        conn.commit()
+def store_readings(conn, temperatures, heartbeats):
+    """
+    Insert successful temperature and heartbeat readings into the database. Does not commit.
+    :type conn: Connection
+    :type temperatures: Iterable[TemperatureReading]
+    :type heartbeats: Iterable[HeartbeatReading]
+    """
+    store_temperatures(conn, temperatures)
+    store_rssi(conn, heartbeats)
 
 
-def get_scheduled_temperature(thermostat_mac, heating_table):
+# Single thread writing to the database. The uploader and the retention job lock the database from their threads for
+# up to storage.BUSY_TIMEOUT, which must not block the event loop.
+database_writer = ThreadPoolExecutor(max_workers=1)
+
+
+def _commit(store, args):
+    # The with statement commits or rolls back the transaction
+    with get_connection() as conn:
+        store(conn, *args)
+
+
+@asyncio.coroutine
+def write(store, *args):
+    """
+    Run a store function with the database connection of the writer thread and commit.
+    Runs async.
+    :param store: Function inserting rows, called with the connection and args. Must not commit.
+    """
+    yield from asyncio.get_event_loop().run_in_executor(database_writer, _commit, store, args)
+
+
+@asyncio.coroutine
+def log_temperatures():
+    """
+    Query temperatures and meta data from the configured thermostats and store them in the database.
+    Buffered notifications of observed thermostats are stored instead of polling them.
+    Runs async.
+    """
+    thermostats = get_thermostats()
+
+    # Get temperature values
+    # Start tasks and wait
+    polled_thermostats = thermostats
+    observed_measurements = []
+    if observer is not None:
+        polled_thermostats = [thermostat for thermostat in thermostats
+                              if not observer.is_observed(thermostat.mac)]
+        observed_measurements = observer.pop_readings()
+    temp_measurements = yield from execute_tasks(
+        [get_temperature(thermostat.mac) for thermostat in polled_thermostats])
+
+    # Get RSSI values
+    # Start tasks and wait
+    rssi_measurements = yield from execute_tasks([get_heartbeat(thermostat.mac) for thermostat in thermostats])
+
+    yield from write(store_readings, observed_measurements + temp_measurements, rssi_measurements)
+
+
+def get_scheduled_temperature(thermostat_mac, heating_table, moment=None):
     """
     Calculate the currently scheduled target temperature from the thermostats heating table
     :type thermostat_mac: str
     :type heating_table: List[Dict]
+    :param moment: Time to calculate the target temperature for. Defaults to now.
+    :type moment: datetime
     :return: The currently scheduled target temperature
     :rtype: float
     """
@@ -387,63 +754,135 @@ def get_scheduled_temperature(thermostat_mac, heating_table):
         logging.warning("Heating table for %s is empty" % thermostat_mac)
         return None
 
-    previous_entry = None
-    now = datetime.now()
-
-    # We assume the heating_table to be ordered by day and time. The ordering is done by the server.
-    # Traverse the heating table and store the latest tuple entry (day, time) less or equal to now
-    for entry in heating_table:
-        day = entry.get('day')
-        time = entry.get('time')
-        now_day = now.weekday()
-        now_time = str(now.time())
-
-        # print(day, time, "-", now_day, now_time)
-        if day <= now_day or (day == now_day and time <= now_time):
-            previous_entry = entry
-        else:
-            break
-
-    if previous_entry is None:
-        # No entry before now. Therefore the last entry in the schedule is still applicable
-        last_entry = heating_table[-1]
-        return last_entry.get('temperature')
-    return previous_entry.get('temperature')
+    if moment is None:
+        moment = datetime.now()
+    return compile_schedule(heating_table).temperature_at(moment)
 
 
+@asyncio.coroutine
 def set_target_temperatures():
     """
     Set the target temperature on all configured thermostats.
+    Runs async.
     """
     thermostats = get_thermostats()
 
-    for thermostat in thermostats:
-        thermostat_mac = thermostat['mac']
-        heating_table = Config().get_heating_table(thermostat_mac)
-        thermostat['target'] = get_scheduled_temperature(thermostat_mac, heating_table)
+    targets = [get_scheduled_temperature(thermostat.mac, Config().get_heating_table(thermostat.mac))
+               for thermostat in thermostats]
 
-    print(thermostats)
+    print(list(zip(thermostats, targets)))
 
     # Ensure target mode is set
-    modes = execute_tasks([asyncio.async(set_target_mode(thermostat['mac'])) for thermostat in thermostats])
+    modes = yield from execute_tasks([set_target_mode(thermostat.mac) for thermostat in thermostats])
     print(modes)
 
-    # Wait
-    wait()
-
     # Set temperature values
-    target_temperatures = execute_tasks([asyncio.async(set_target_temperature(thermostat['mac'], thermostat['target']))
-                                         for thermostat in thermostats])
+    target_temperatures = yield from execute_tasks(
+        [set_target_temperature(thermostat.mac, target) for thermostat, target in zip(thermostats, targets)])
     print(target_temperatures)
 
 
-def wait():
+@asyncio.coroutine
+def thermostat_pipeline(mac, target_temperature, set_targets=True):
     """
-    Wait 3 seconds.
+    Query and persist the measurements of a single thermostat, then set its mode and scheduled temperature.
+    The steps run sequentially, independent of the other thermostats. The measurements are committed as soon as
+    they are available.
+    Runs async.
+    :type mac: str
+    :type target_temperature: float|None
+    :param set_targets: Whether to set mode and target temperature
+    :type set_targets: bool
+    :return: The results of the steps
+    :rtype: List[DeviceResult]
+    """
+    started = pacer.clock()
+    results = []
+    try:
+        temperatures = []
+        if observer is None or not observer.is_observed(mac):
+            temperature = yield from get_temperature(mac)
+            results.append(temperature)
+            temperatures.append(temperature)
+
+        heartbeat = yield from get_heartbeat(mac)
+        results.append(heartbeat)
+        yield from write(store_readings, temperatures, [heartbeat])
+
+        if not set_targets:
+            return results
+
+        mode = yield from set_target_mode(mac)
+        results.append(mode)
+        if target_temperature is not None:
+            target = yield from set_target_temperature(mac, target_temperature)
+            results.append(target)
+    except Exception as e:
+        logging.error('Pipeline of %s failed' % mac)
+        logging.exception(e)
+        results.append(DeviceResult(mac, epoch_now(), error='%s: %s' % (e.__class__.__name__, e)))
+    finally:
+        logging.info('Pipeline of %s finished in %.1f s: %r' % (mac, pacer.clock() - started,
+                                                              retry_statistics.get(mac)))
+    return results
+
 
-    Intended purpose is to give a low power device time to finish its last request.
+@asyncio.coroutine
+def cycle(observe=False, set_targets=True):
     """
-    time.sleep(3)
+    Query, persist and control the temperature of configured thermostats once.
+
+    The shared CoAP client context is kept open, so subsequent cycles of a long running process reuse it.
+    Runs async.
+    :param observe: Whether to observe the temperatures instead of polling them
+    :type observe: bool
+    :param set_targets: Whether to set mode and target temperatures. Disabled if a SetpointScheduler pushes them.
+    :type set_targets: bool
+    :return: The results of each thermostats pipeline
+    :rtype: List[List[DeviceResult]]
+    """
+    global client_contexts_created
+    client_contexts_created = 0
+    pacer.start_cycle()
+    retry_statistics.clear()
+    failures = 0
+
+    try:
+        thermostats = get_thermostats()
+        if observe:
+            start_observations([thermostat.mac for thermostat in thermostats])
+
+        if observer is not None:
+            yield from write(store_temperatures, observer.pop_readings())
+
+        # Each thermostat runs its own pipeline. A slow thermostat only delays itself.
+        pipelines = []
+        for thermostat in thermostats:
+            mac = thermostat.mac
+            target_temperature = None
+            if set_targets:
+                target_temperature = get_scheduled_temperature(mac, Config().get_heating_table(mac))
+            pipelines.append(thermostat_pipeline(mac, target_temperature, set_targets))
+        device_results = yield from execute_tasks(pipelines)
+
+        rows = exchange_metrics.take_rows(epoch_now())
+        yield from write(store_exchanges, rows)
+        logging.info('Flushed CoAP exchange metrics of %s resources' % len(rows))
+
+        for results in device_results:
+            for result in results:
+                if not result.ok:
+                    failures += 1
+                    logging.error('Failed: %r' % result)
+        health.synchronized('thermostat')
+        return device_results
+    finally:
+        device_state.save()
+        health.cycle_finished(pacer.cycle_time(), failures)
+        logging.info('CoAP client contexts created this cycle: %s' % client_contexts_created)
+        logging.info('Cycle finished in %.1f s, %s requests paced for %.1f s in total' %
+                     (pacer.cycle_time(), pacer.paced_requests, pacer.total_delay))
+        logging.info('Request window: %r' % request_window)
 
 
 def main():
@@ -453,5 +892,8 @@ def main():
     For each configured thermostat query and persist the temperature measurements and meta data
     and set the scheduled temperatures.
     """
-    log_temperatures()
-    set_target_temperatures()
+    try:
+        asyncio.get_event_loop().run_until_complete(cycle())
+    finally:
+        shutdown_client_context()
+        close_connections()
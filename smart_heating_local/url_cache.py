@@ -0,0 +1,86 @@
+"""
+Copyright 2016 Michael Spiegel, Wilhelm Kleiminger
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+
+from smart_heating_local.persisted_cache import PersistedCache
+
+
+class ThermostatUrlCache(PersistedCache):
+    """
+    The server URL of each thermostat by its MAC address, as looked up on the server.
+
+    An URL is trusted until its time to live expires or it is invalidated, e.g. because the server does not know it
+    anymore. The cache is kept in memory and persisted in a shelve file by save(), so it survives restarts.
+    """
+    PATH_SETTING = 'THERMOSTAT_URL_CACHE_PATH'
+    TTL_SETTING = 'THERMOSTAT_URL_TTL'
+
+    def __init__(self, path=None, ttl=None, clock=time.time):
+        """
+        :param path: Path of the shelve file. Defaults to Config.THERMOSTAT_URL_CACHE_PATH.
+        :param ttl: Seconds a looked up URL is trusted. Defaults to Config.THERMOSTAT_URL_TTL.
+        :param clock: Wall clock returning seconds since the epoch
+        """
+        super(ThermostatUrlCache, self).__init__(path, ttl, clock)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, mac):
+        """
+        :type mac: str
+        :return: The cached URL or None if it is unknown or expired
+        :rtype: str|None
+        """
+        # Entries are (url, lookup time)
+        url, looked_up = self._get_entries().get(mac, (None, 0))
+        if url is None or not self._is_fresh(looked_up):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return url
+
+    def put(self, mac, url):
+        """
+        Store an URL looked up on the server.
+        :type mac: str
+        :type url: str
+        """
+        self._get_entries()[mac] = (url, self.clock())
+        self._changed(mac)
+
+    def invalidate(self, mac):
+        """
+        Forget the URL of a thermostat, e.g. after the server responded 404 Not Found for it.
+        :type mac: str
+        """
+        if self._get_entries().pop(mac, None) is not None:
+            self.invalidations += 1
+            self._changed(mac)
+
+    @property
+    def hit_rate(self):
+        """
+        :return: The share of lookups answered by the cache or None if there were no lookups
+        :rtype: float|None
+        """
+        lookups = self.hits + self.misses
+        return None if lookups == 0 else self.hits / lookups
+
+    def __repr__(self):
+        return '<ThermostatUrlCache thermostats:"%s" hits:"%s" misses:"%s">' % (
+            0 if self._entries is None else len(self._entries), self.hits, self.misses)